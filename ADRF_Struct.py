@@ -1,3 +1,13 @@
+import itertools
+
+
+def field_bits(lookup, position):
+	"""
+	Turn a lookup of MSB first bit strings into the field's bits in the SPI word, which is sent LSB first
+	"""
+	return dict((key, int(bits[::-1], 2) << position) for key, bits in lookup.items())
+
+
 class ADRF_Ctl(object):
 	Write_Lookup = {
 		True: '1',
@@ -34,6 +44,25 @@ class ADRF_Ctl(object):
 		False: '0'
 	}
 
+	# Bits of every field value in the 16 bit SPI word, fields in message order from bit 0
+	Freq_Bits = field_bits(Freq_Lookup, 0)
+	HighPower_Bits = field_bits(HighPower_Lookup, 6)
+	VGA1_Bits = field_bits(VGA1_Lookup, 7)
+	VGA2_Bits = field_bits(VGA2_Lookup, 9)
+	VGA3_Bits = field_bits(VGA3_Lookup, 11)
+	Postamp_Bits = field_bits(Postamp_Lookup, 13)
+	DCOfs_Bits = field_bits(DCOfs_Lookup, 14)
+	Write_Bits = field_bits(Write_Lookup, 15)
+
+	# Total gain in dB to (VGA1, VGA2, VGA3, Postamp) and their bits, among equal totals the one with the most gain up
+	# front, which adds the least noise
+	Gain_Table = dict()
+	for _gains in sorted(itertools.product(VGA1_Lookup, VGA2_Lookup, VGA3_Lookup, Postamp_Lookup)):
+		Gain_Table[sum(_gains)] = (_gains, VGA1_Bits[_gains[0]] | VGA2_Bits[_gains[1]] | VGA3_Bits[_gains[2]] |
+								   Postamp_Bits[_gains[3]])
+	del _gains
+	Gains = sorted(Gain_Table)
+
 	def __init__(self):
 		self._Freq = 0
 		self._HighPower = True
@@ -52,7 +81,7 @@ class ADRF_Ctl(object):
 		if set not in self.Freq_Lookup.keys():
 			raise ValueError("Frequency Setpoint must be from 1 to 64 Mhz or 0 for bypass!")
 		self._Freq = set
-		if set > 31 or set is 0:
+		if set > 31 or set == 0:
 			self._HighPower = True
 		else:
 			self._HighPower = False
@@ -117,19 +146,24 @@ class ADRF_Ctl(object):
 			raise ValueError("DC Offset Enable must be bool!")
 		self._DCOfs = set
 
+	@property
+	def Gain(self):
+		return self.VGA1 + self.VGA2 + self.VGA3 + self.Postamp
+
+	@Gain.setter
+	def Gain(self, set):
+		if set not in self.Gain_Table:
+			raise ValueError("Total gain must be one of {}dB!".format(self.Gains))
+		self._VGA1, self._VGA2, self._VGA3, self._Postamp = self.Gain_Table[set][0]
+
+	def GetWord(self, Write=True):
+		return (self.Freq_Bits[self.Freq] | self.HighPower_Bits[self.HighPower] | self.VGA1_Bits[self.VGA1] |
+				self.VGA2_Bits[self.VGA2] | self.VGA3_Bits[self.VGA3] | self.Postamp_Bits[self.Postamp] |
+				self.DCOfs_Bits[self.DCOfs] | self.Write_Bits[Write])
+
 	def GetMessage(self, Write=True):
-		message = ""
-		message = message + self.Freq_Lookup[self.Freq]
-		message = message + self.HighPower_Lookup[self.HighPower]
-		message = message + self.VGA1_Lookup[self.VGA1]
-		message = message + self.VGA2_Lookup[self.VGA2]
-		message = message + self.VGA3_Lookup[self.VGA3]
-		message = message + self.Postamp_Lookup[self.Postamp]
-		message = message + self.DCOfs_Lookup[self.DCOfs]
-		message = message + self.Write_Lookup[Write]
-		message = message[::-1] # Reverse to match SPI transfer order (LSB First)
-		message = [int(message[:8], 2), int(message[8:], 2)]
-		return message
+		word = self.GetWord(Write)
+		return [word >> 8, word & 0xFF]
 
 if __name__ == '__main__':
 	temp = ADRF_Ctl()
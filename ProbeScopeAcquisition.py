@@ -0,0 +1,115 @@
+import collections
+import threading
+import time
+
+import ProbeScopeInterface
+import ProbeScopeTransactions
+from telemetry import telemetry
+
+
+class ContinuousAcquisition(object):
+	"""
+	Streaming acquisition that keeps several sample requests in flight
+
+	Every received frame re-arms one request, so the link never idles waiting for the host. In push mode the requests
+	are TRIGGERED_COMMAND arms and the device answers when it triggers, with blocks set frames come as block transfers.
+	Requests are transactions of the device's TransactionManager, so frames are matched to requests in one place and a
+	single capture taken while streaming is not counted twice. A request that times out is counted as lost and
+	replaced. poll has to be called periodically to update the rate window used by stats.
+
+	:param transactions: ProbeScopeTransactions.TransactionManager of the device
+	:param timeout: Seconds a request may go without progress on the link before it is lost
+	"""
+	RATE_WINDOW = 1.0  # Seconds of history used for the live rates
+
+	def __init__(self, serial_io, transactions, in_flight=2, timeout=2.0, push=False, baudrate=115200, blocks=False):
+		self.serial_io = serial_io
+		self.transactions = transactions
+		self.in_flight = in_flight
+		self.timeout = timeout
+		self.push = push
+		self.blocks = blocks
+		self.baudrate = baudrate
+
+		self.lock = threading.Lock()
+		self.running = False
+		self.outstanding = 0
+
+		self.frames = 0
+		self.timeouts = 0
+		self.history = collections.deque()
+
+	@property
+	def request_command(self):
+		if self.push:
+			return ProbeScopeInterface.TRIGGERED_SAMPLE_COMMAND
+		if self.blocks:
+			return ProbeScopeInterface.REQUEST_SAMPLE_BLOCKS_COMMAND
+		return ProbeScopeInterface.REQUEST_SAMPLE_DATA_COMMAND
+
+	def start(self):
+		with self.lock:
+			self.running = True
+			self.history.clear()
+			# Requests still outstanding from before the last stop count towards in_flight
+			requests = self.fill_pipeline()
+		self.watch(requests)
+
+	def stop(self):
+		with self.lock:
+			self.running = False
+
+	def fill_pipeline(self):
+		# Called with the lock held, the futures are watched after releasing it, a failed one completes right away
+		policy = ProbeScopeTransactions.RetryPolicy(self.timeout)
+		requests = list()
+		while self.running and self.outstanding < self.in_flight:
+			requests.append(self.transactions.request_samples(self.request_command, policy))
+			self.outstanding += 1
+		return requests
+
+	def watch(self, requests):
+		for future in requests:
+			future.add_done_callback(self.request_done)
+
+	def request_done(self, future):
+		# On the serial worker thread with the frame, on the transaction thread when it timed out
+		error = None if future.cancelled() else future.exception()
+		with self.lock:
+			self.outstanding = max(self.outstanding - 1, 0)
+			if isinstance(error, ProbeScopeTransactions.TransactionTimeout):
+				self.timeouts += 1
+				telemetry.request_lost()
+			elif future.cancelled() or isinstance(error, ProbeScopeTransactions.TransactionError):
+				self.running = False  # The transactions stopped, nothing more can be requested
+				return
+			else:
+				self.frames += 1  # Also when a consumer of the frame failed, the worker reported that
+			requests = self.fill_pipeline()
+		self.watch(requests)
+
+	def poll(self):
+		now = time.monotonic()
+		with self.lock:
+			self.history.append((now, self.frames, self.serial_io.rx_bytes))
+			while len(self.history) > 2 and now - self.history[1][0] >= self.RATE_WINDOW:
+				self.history.popleft()
+
+	def stats(self):
+		with self.lock:
+			fps = 0.0
+			utilization = 0.0
+			if len(self.history) >= 2:
+				t0, frames0, rx0 = self.history[0]
+				t1, frames1, rx1 = self.history[-1]
+				if t1 > t0:
+					fps = (frames1 - frames0) / (t1 - t0)
+					# 10 bits on the wire per byte with 8N1 framing
+					utilization = (rx1 - rx0) * 10 / (t1 - t0) / self.baudrate
+			return {
+				"fps": fps,
+				"link_utilization": utilization,
+				"frames": self.frames,
+				"timeouts": self.timeouts,
+				"outstanding": self.outstanding
+			}
@@ -0,0 +1,268 @@
+import asyncio
+import os
+import struct
+
+import serial
+
+import ProbeScopeInterface
+import ProbeScopeTransactions
+
+try:
+	import serial_asyncio
+except ImportError:
+	serial_asyncio = None
+
+
+class SerialTransport(asyncio.Transport):
+	"""
+	Minimal asyncio transport over a pyserial port, used when pyserial-asyncio is not installed
+
+	Reads and writes are driven by the event loop's reader and writer callbacks, so this needs a selector loop and a
+	port with a file descriptor (POSIX serial ports and ptys). A write the port can not take right away is buffered, it
+	never blocks the loop.
+	"""
+
+	def __init__(self, loop, protocol, serial_port):
+		super(SerialTransport, self).__init__()
+		self.loop = loop
+		self.protocol = protocol
+		self.serial_port = serial_port
+		self.serial_port.timeout = 0
+		self.fd = self.serial_port.fileno()
+		self.buffer = bytearray()
+		self.closing = False
+
+		# Connected before the constructor returns, the caller may write right away
+		self.protocol.connection_made(self)
+		self.loop.add_reader(self.fd, self.read_ready)
+
+	def read_ready(self):
+		try:
+			data = self.serial_port.read(max(1, self.serial_port.in_waiting))
+		except serial.serialutil.SerialException as e:
+			self.close(e)
+			return
+		if len(data) > 0:
+			self.protocol.data_received(data)
+
+	def write(self, data):
+		if self.closing or not data:
+			return
+		if not self.buffer:
+			# pyserial's non-blocking write spins while the port is full, the descriptor is non-blocking already
+			try:
+				written = os.write(self.fd, data)
+			except BlockingIOError:
+				written = 0
+			except OSError as e:
+				self.close(e)
+				return
+			data = data[written:]
+			if not data:
+				return
+			self.loop.add_writer(self.fd, self.write_ready)
+		self.buffer += data
+
+	def write_ready(self):
+		try:
+			written = os.write(self.fd, self.buffer)
+		except BlockingIOError:
+			return
+		except OSError as e:
+			self.close(e)
+			return
+		del self.buffer[:written]
+		if not self.buffer:
+			self.loop.remove_writer(self.fd)
+
+	def get_write_buffer_size(self):
+		return len(self.buffer)
+
+	def is_closing(self):
+		return self.closing
+
+	def close(self, exc=None):
+		if self.closing:
+			return
+		self.closing = True
+		self.loop.remove_reader(self.fd)
+		self.loop.remove_writer(self.fd)
+		self.buffer.clear()
+		self.serial_port.close()
+		self.loop.call_soon(self.protocol.connection_lost, exc)
+
+	def get_extra_info(self, name, default=None):
+		if name == "serial":
+			return self.serial_port
+		return default
+
+
+async def create_serial_connection(loop, protocol_factory, port, baudrate=115200):
+	if serial_asyncio is not None:
+		return await serial_asyncio.create_serial_connection(loop, protocol_factory, port, baudrate=baudrate)
+	protocol = protocol_factory()
+	transport = SerialTransport(loop, protocol, serial.Serial(port, baudrate=baudrate))
+	return transport, protocol
+
+
+class ProbeScopeProtocol(asyncio.Protocol):
+	"""
+	Decodes the received byte stream with ProbeScopeParser and hands every message to message_callback
+	"""
+
+	def __init__(self, message_callback):
+		self.message_callback = message_callback
+		self.parser = ProbeScopeInterface.ProbeScopeParser()
+		self.transport = None
+		self.connected = asyncio.get_event_loop().create_future()
+
+	def connection_made(self, transport):
+		self.transport = transport
+		if not self.connected.done():
+			self.connected.set_result(transport)
+
+	def data_received(self, data):
+		for res in self.parser.feed(data):
+			self.message_callback(res)
+
+	def connection_lost(self, exc):
+		self.transport = None
+
+
+class TransportSender(object):
+	"""
+	Stands in for the SerialWorker of a TransactionManager, commands are written on the event loop in the order sent
+
+	The manager also resends from its own thread, the transport is only ever touched from the loop.
+	"""
+
+	def __init__(self, loop, transport):
+		self.loop = loop
+		self.transport = transport
+
+	def send(self, command):
+		self.loop.call_soon_threadsafe(self.transport.write, bytes(command))
+
+
+class ProbeScopeClient(object):
+	"""
+	Asyncio client for a Probe-Scope, no Qt
+
+	Responses are matched with their requests by a ProbeScopeTransactions.TransactionManager, the same as for the
+	devices of the GUI, so timeouts, retries and late responses behave the same. Several requests, of any kind, can be
+	outstanding at once. A request that gets no response fails with ProbeScopeTransactions.TransactionTimeout.
+
+	Example::
+
+		client = await ProbeScopeClient.connect("/dev/ttyUSB0")
+		await client.write_registers(0x3000, [0, 1])
+		frame = await client.request_samples()
+	"""
+
+	def __init__(self, loop):
+		self.loop = loop
+		self.protocol = None
+		self.transactions = None
+		self.subscribers = list()
+
+	@classmethod
+	async def connect(cls, port, baudrate=115200):
+		client = cls(asyncio.get_running_loop())
+		transport, client.protocol = await create_serial_connection(
+			client.loop, lambda: ProbeScopeProtocol(client.message_received), port, baudrate)
+		# pyserial-asyncio only schedules connection_made
+		await client.protocol.connected
+		client.transactions = ProbeScopeTransactions.TransactionManager(TransportSender(client.loop, transport))
+		client.transactions.start()
+		return client
+
+	def close(self):
+		if self.protocol is not None and self.protocol.transport is not None:
+			self.protocol.transport.close()
+		if self.transactions is not None:
+			self.transactions.stop()
+		for queue in self.subscribers:
+			self.publish(queue, None)
+
+	@staticmethod
+	def publish(queue, frame):
+		if queue.full():
+			queue.get_nowait()
+		queue.put_nowait(frame)
+
+	def message_received(self, message):
+		if self.transactions is not None:
+			self.transactions.on_message(message)
+		if type(message) is ProbeScopeInterface.ProbeScopeSamples:
+			for queue in self.subscribers:
+				self.publish(queue, message)
+
+	async def wait(self, future):
+		# Cancelling the awaiting task cancels the transaction
+		return await asyncio.wrap_future(future, loop=self.loop)
+
+	async def request_samples(self, policy=ProbeScopeTransactions.SAMPLES_POLICY):
+		"""
+		Request one capture
+
+		:rtype: ProbeScopeInterface.ProbeScopeSamples
+		"""
+		return await self.wait(self.transactions.request_samples(policy=policy))
+
+	async def write_registers(self, address, data, policy=ProbeScopeTransactions.REGISTER_POLICY):
+		"""
+		:rtype: ProbeScopeInterface.ProbeScopeWriteResponse
+		"""
+		return await self.wait(self.transactions.write_registers(address, data, policy))
+
+	async def read_registers(self, address, length, policy=ProbeScopeTransactions.REGISTER_POLICY):
+		"""
+		:rtype: ProbeScopeInterface.ProbeScopeReadResponse
+		"""
+		return await self.wait(self.transactions.read_registers(address, length, policy))
+
+	async def init_device(self):
+		await self.write_registers(0x3000, [0, 1])
+		await self.write_registers(0x4000, b'\xAA')
+
+	async def set_dac(self, a, b, c, d):
+		return await self.write_registers(0x4002, struct.pack("<HHHH", a, b, c, d))
+
+	async def sync_registers(self, register_map, policy=ProbeScopeTransactions.REGISTER_POLICY):
+		"""
+		Write what changed in a ProbeScopeRegisters.RegisterMap, all writes are in flight at once
+
+		On failure the map is invalidated, so the next sync writes everything again.
+
+		:return: number of write frames sent
+		:rtype: int
+		"""
+		try:
+			responses = await self.wait(self.transactions.flush_registers(register_map, policy))
+		except (ProbeScopeTransactions.TransactionError, asyncio.CancelledError):
+			register_map.invalidate()
+			raise
+		return len(responses)
+
+	async def read_back(self, register_map, names=None, policy=ProbeScopeTransactions.REGISTER_POLICY):
+		"""
+		Read regions of a ProbeScopeRegisters.RegisterMap into its shadow, all reads are in flight at once
+		"""
+		await self.wait(self.transactions.read_back(register_map, names, policy))
+
+	async def frames(self, maxsize=16):
+		"""
+		Async iterator over every received capture, requested or pushed
+
+		When the consumer falls behind the oldest frames are dropped.
+		"""
+		queue = asyncio.Queue(maxsize)
+		self.subscribers.append(queue)
+		try:
+			while True:
+				frame = await queue.get()
+				if frame is None:
+					return
+				yield frame
+		finally:
+			self.subscribers.remove(queue)
@@ -0,0 +1,369 @@
+import collections
+import os
+import threading
+import time
+
+import ProbeScopeAcquisition
+import ProbeScopeInterface
+import ProbeScopeRecording
+import ProbeScopeRegisters
+import ProbeScopeSerial
+import ProbeScopeTransactions
+import measurements
+
+# Bytes around the samples of a sample response, START_OF_MESSAGE to END_OF_MESSAGE
+SAMPLE_RESPONSE_OVERHEAD = 10
+
+
+def recording_paths(path, count):
+	"""
+	One recording per device, numbered when there is more than one, capture.psrec becomes capture_0.psrec, ...
+	"""
+	if count == 1:
+		return [path]
+	root, ext = os.path.splitext(path)
+	return ["{}_{}{}".format(root, i, ext) for i in range(count)]
+
+
+class ProbeScopeDevice(object):
+	"""
+	One Probe-Scope of a DeviceManager
+
+	Every device has its own SerialWorker thread and parser, so a slow or noisy link only holds up its own frames, and
+	its own TransactionManager for requests that wait for their response.
+	Frames are stamped with the manager's clock at the time they were captured, estimated as the time they were parsed
+	less the time the response took on the wire.
+
+	:param message_callback: Called with every parsed message on the device's worker thread, after the manager saw it
+	"""
+
+	def __init__(self, index, serial_port, frame_callback, message_callback=None, clock=time.time):
+		self.index = index
+		self.clock = clock
+		self.frame_callback = frame_callback
+		self.message_callback = message_callback
+		self.register_map = ProbeScopeRegisters.RegisterMap()
+		self.recorder = None
+
+		self.serial_io = ProbeScopeSerial.SerialWorker(serial_port, self.on_message)
+		self.transactions = ProbeScopeTransactions.TransactionManager(self.serial_io)
+		self.acquisition = ProbeScopeAcquisition.ContinuousAcquisition(self.serial_io, self.transactions,
+																	   baudrate=serial_port.baudrate)
+
+	@property
+	def port(self):
+		return self.serial_io.serial_port.port
+
+	def wire_time(self, samples):
+		# 10 bits on the wire per byte with 8N1 framing, escapes are rare enough to leave out
+		return (len(samples.samples) + SAMPLE_RESPONSE_OVERHEAD) * 10 / self.acquisition.baudrate
+
+	def on_message(self, message):
+		# Runs on this device's serial worker thread, the transaction completes once the message was handled
+		try:
+			if type(message) is ProbeScopeInterface.ProbeScopeSamples:
+				message.timestamp = self.clock() - self.wire_time(message)
+				recorder = self.recorder
+				if recorder is not None:
+					recorder.put(message.timestamp, message, self.register_map.snapshot())
+				self.frame_callback(self.index, message)
+			if self.message_callback is not None:
+				self.message_callback(message)
+		except Exception as e:
+			# The worker prints and counts it, whoever waits for the message gets the exception
+			self.transactions.fail(message, e)
+			raise
+		self.transactions.on_message(message)
+
+	def open(self, port):
+		"""
+		Open port and initialize the device, everything set in register_map is written again
+
+		Nothing blocks, the writes are queued behind the open on the worker thread.
+
+		:return: future of the port name and the init writes' responses, fails with the SerialException when the port
+			can not be opened
+		:rtype: concurrent.futures.Future
+		"""
+		opened = self.serial_io.open(port)
+		self.register_map.invalidate()
+		return ProbeScopeTransactions.gather([opened, self.write_registers()])
+
+	def write_registers(self):
+		"""
+		Write what changed in register_map, on failure the map is invalidated so the next flush writes everything
+
+		:rtype: concurrent.futures.Future
+		"""
+		future = self.transactions.flush_registers(self.register_map)
+		future.add_done_callback(self.writes_done)
+		return future
+
+	def read_registers(self, names=None):
+		"""
+		Read the regions of register_map back from the device into its shadow, staged values that differ are written
+		again on the next flush
+
+		:param names: Regions to read, all that can be read if None
+		:return: future of the read responses
+		:rtype: concurrent.futures.Future
+		"""
+		return self.transactions.read_back(self.register_map, names)
+
+	def writes_done(self, future):
+		if not future.cancelled() and future.exception() is not None:
+			# The shadow is ahead of the device
+			self.register_map.invalidate()
+
+	def stats(self):
+		stats = self.acquisition.stats()
+		stats.update(self.serial_io.stats())
+		stats["transactions"] = self.transactions.stats()
+		stats["port"] = self.port
+		return stats
+
+
+class AlignedCapture(object):
+	"""
+	Frames of every device captured at about the same time, None for devices that had no frame in time
+
+	:param frames: ProbeScopeSamples per device, in device order
+	"""
+
+	def __init__(self, frames):
+		self.frames = frames
+		timestamps = [frame.timestamp for frame in frames if frame is not None]
+		self.timestamp = min(timestamps)
+		self.skew = max(timestamps) - self.timestamp
+
+	def __len__(self):
+		return len(self.frames)
+
+	@property
+	def complete(self):
+		return None not in self.frames
+
+	def statistics(self):
+		"""
+		:return: measurements.frame_statistics of every channel in ADC codes, None for missing channels
+		:rtype: list
+		"""
+		return [measurements.frame_statistics(frame.samples) if frame is not None else None for frame in self.frames]
+
+
+class FrameAligner(object):
+	"""
+	Groups the frames of several devices into AlignedCapture by their timestamps
+
+	Every device has a FIFO of waiting frames. Once each has one, the oldest frames form a capture if they are all within
+	window seconds of the newest of them, otherwise the frames too old to ever find partners are dropped and counted as
+	unaligned. A device that stops sending would hold everyone up, so flush sends frames that waited longer than
+	max_wait on as partial captures. Captures are passed to callback in time order, from the thread of the frame that
+	completed them.
+
+	:param window: Largest skew between the frames of a capture in seconds, at most half the frame interval
+	:param max_pending: Frames kept per device, older ones are dropped and counted as unaligned
+	"""
+
+	def __init__(self, channels, callback, window=0.05, max_wait=0.5, max_pending=16):
+		self.callback = callback
+		self.window = window
+		self.max_wait = max_wait
+		self.pending = [collections.deque() for _ in range(channels)]
+		self.max_pending = max_pending
+		self.lock = threading.Lock()
+
+		# Counters
+		self.captures = 0
+		self.partial = 0
+		self.unaligned = 0
+
+	def add(self, channel, frame):
+		with self.lock:
+			pending = self.pending[channel]
+			pending.append(frame)
+			if len(pending) > self.max_pending:
+				pending.popleft()
+				self.unaligned += 1
+			self.align()
+
+	def align(self):
+		# Called with the lock held, the lock also keeps captures in order
+		while all(self.pending):
+			heads = [pending[0].timestamp for pending in self.pending]
+			newest = max(heads)
+			if newest - min(heads) > self.window:
+				for pending, timestamp in zip(self.pending, heads):
+					if newest - timestamp > self.window:
+						pending.popleft()
+						self.unaligned += 1
+				continue
+			self.captures += 1
+			self.callback(AlignedCapture([pending.popleft() for pending in self.pending]))
+
+	def flush(self, now):
+		"""
+		Send frames older than max_wait on as partial captures, call periodically with the clock of the timestamps
+		"""
+		with self.lock:
+			while any(self.pending):
+				oldest = min(pending[0].timestamp for pending in self.pending if pending)
+				if now - oldest < self.max_wait:
+					return
+				frames = [pending.popleft() if pending and pending[0].timestamp - oldest <= self.window else None
+						  for pending in self.pending]
+				self.captures += 1
+				self.partial += 1
+				self.callback(AlignedCapture(frames))
+
+	def stats(self):
+		return {
+			"captures": self.captures,
+			"partial": self.partial,
+			"unaligned": self.unaligned,
+			"pending": [len(pending) for pending in self.pending]
+		}
+
+
+class DeviceManager(object):
+	"""
+	Several Probe-Scopes acquiring in parallel on one host clock
+
+	Each device runs its own serial worker, parser and acquisition, the manager only timestamps their frames with the
+	shared clock and groups them into AlignedCapture for capture_callback. Add every device before start, adding one
+	restarts the alignment.
+
+	:param capture_callback: Called with every AlignedCapture, from a serial worker thread or from poll
+	:param clock: Host clock shared by all devices, its timestamps go to recordings
+	"""
+
+	def __init__(self, capture_callback=None, clock=time.time, window=0.05, max_wait=0.5):
+		self.capture_callback = capture_callback
+		self.clock = clock
+		self.window = window
+		self.max_wait = max_wait
+		self.devices = list()
+		self.aligner = FrameAligner(0, self.deliver, window, max_wait)
+
+	def __len__(self):
+		return len(self.devices)
+
+	def __getitem__(self, index):
+		return self.devices[index]
+
+	def add(self, serial_port, message_callback=None):
+		"""
+		Add a device on a serial.Serial, or anything behaving like one, and start its worker
+
+		:return: the new device, open it with ProbeScopeDevice.open
+		:rtype: ProbeScopeDevice
+		"""
+		device = ProbeScopeDevice(len(self.devices), serial_port, self.frame_received, message_callback, self.clock)
+		self.devices.append(device)
+		self.aligner = FrameAligner(len(self.devices), self.deliver, self.window, self.max_wait)
+		device.serial_io.start()
+		device.transactions.start()
+		return device
+
+	def remove(self, device):
+		"""
+		Stop a device and take it out, the devices after it move down a channel and the alignment restarts
+		"""
+		device.acquisition.stop()
+		recorder = device.recorder
+		device.recorder = None
+		if recorder is not None:
+			recorder.stop()
+		device.transactions.stop()
+		device.serial_io.stop()
+		self.devices.remove(device)
+		for index, remaining in enumerate(self.devices):
+			remaining.index = index
+		self.aligner = FrameAligner(len(self.devices), self.deliver, self.window, self.max_wait)
+
+	def frame_received(self, index, samples):
+		self.aligner.add(index, samples)
+
+	def deliver(self, capture):
+		if self.capture_callback is not None:
+			self.capture_callback(capture)
+
+	def start(self, in_flight=2, push=False, blocks=False):
+		for device in self.devices:
+			device.acquisition.in_flight = in_flight
+			device.acquisition.push = push
+			device.acquisition.blocks = blocks
+			device.acquisition.start()
+
+	def stop(self):
+		for device in self.devices:
+			device.acquisition.stop()
+
+	def request_all(self, command=ProbeScopeInterface.REQUEST_SAMPLE_DATA_COMMAND):
+		"""
+		Request one frame from every device at the same time, for single captures outside of start
+
+		:return: future of the frames of the open devices
+		:rtype: concurrent.futures.Future
+		"""
+		return ProbeScopeTransactions.gather([device.transactions.request_samples(command)
+											  for device in self.devices if device.serial_io.is_open])
+
+	def poll(self):
+		"""
+		Update the frame and link rates and flush late frames, call periodically
+
+		Lost requests are not handled here, their transactions time out and the acquisition replaces them.
+		"""
+		for device in self.devices:
+			device.acquisition.poll()
+		self.flush()
+
+	def flush(self):
+		"""
+		Send frames that waited too long for the other devices on as partial captures
+		"""
+		self.aligner.flush(self.clock())
+
+	def record(self, paths, adc_scale=1, adc_decimation=1, registers=b""):
+		"""
+		Record every device to its own file, the timestamps of all of them are on the shared clock
+
+		Every frame is stored with its device's register map as it was when the frame arrived.
+
+		:param paths: One path per device
+		:param registers: Register writes outside the register map, stored after the map's state with every frame
+		"""
+		if len(paths) != len(self.devices):
+			raise ValueError("{} paths for {} devices!".format(len(paths), len(self.devices)))
+		for device, path in zip(self.devices, paths):
+			recorder = ProbeScopeRecording.FrameWriter(path, registers, adc_scale, adc_decimation)
+			recorder.start()
+			device.recorder = recorder
+
+	def stop_recording(self):
+		"""
+		:return: FrameWriter of every device that was recording
+		:rtype: list
+		"""
+		recorders = list()
+		for device in self.devices:
+			recorder = device.recorder
+			device.recorder = None
+			if recorder is not None:
+				recorder.stop()
+				recorders.append(recorder)
+		return recorders
+
+	def stats(self):
+		return {
+			"devices": [device.stats() for device in self.devices],
+			"alignment": self.aligner.stats()
+		}
+
+	def close(self):
+		self.stop()
+		self.stop_recording()
+		for device in self.devices:
+			device.transactions.stop()
+			device.serial_io.stop()
@@ -0,0 +1,386 @@
+import os
+import select
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+
+from ProbeScopeInterface import *
+
+WAVEFORMS = ("sine", "square", "ramp", "noise", "escape")
+
+
+def ProbeScopeMakeSamples(samples, command=REQUEST_SAMPLE_DATA):
+	return bytearray().join((
+		bytes([START_OF_MESSAGE, COMMAND_RESULT, command, LENGTH_FIELD_INDICATOR]),
+		ProbeScopeEscapeBytes(struct.pack("<I", len(samples))),
+		DATA_FIELD,
+		ProbeScopeEscapeBytes(samples),
+		END_FIELD
+	))
+
+
+def ProbeScopeMakeSampleBlocks(samples, block_size=4096, command=REQUEST_SAMPLE_BLOCKS):
+	"""
+	Sample response of a block transfer, the samples in chunks of block_size separated by END_OF_BLOCK
+	"""
+	chunks = [ProbeScopeEscapeBytes(samples[i:i + block_size]) for i in range(0, max(len(samples), 1), block_size)]
+	return bytearray().join((
+		bytes([START_OF_MESSAGE, COMMAND_RESULT, command, LENGTH_FIELD_INDICATOR]),
+		ProbeScopeEscapeBytes(struct.pack("<I", len(samples))),
+		DATA_FIELD,
+		bytes([END_OF_BLOCK]).join(chunks),
+		END_FIELD
+	))
+
+
+def ProbeScopeMakeWriteResponse(data_len):
+	return bytearray().join((
+		bytes([START_OF_MESSAGE, COMMAND_RESULT, WRITE_REGISTERS, LENGTH_FIELD_INDICATOR]),
+		ProbeScopeEscapeBytes(struct.pack("<I", data_len)),
+		END_FIELD
+	))
+
+
+def ProbeScopeMakeReadResponse(data):
+	# Status byte, length, data and a trailing status byte, the layout parse_read_reg_response expects
+	return bytearray().join((
+		bytes([START_OF_MESSAGE, COMMAND_RESULT, READ_REGISTERS]),
+		ProbeScopeEscapeBytes(bytes([0, LENGTH_FIELD_INDICATOR]) + struct.pack("<I", len(data)) +
+							  bytes([DATA_FIELD_INDICATOR]) + bytes(data) + bytes([0])),
+		END_FIELD
+	))
+
+
+def make_waveform(points, waveform="sine", noise=4.0, rng=None):
+	"""
+	One frame of int8 ADC codes, ten periods of waveform with a random phase and gaussian noise
+
+	The escape waveform is made only of bytes that need escaping, the worst case for the link and the parser.
+	"""
+	rng = rng if rng is not None else np.random.default_rng()
+	if waveform == "escape":
+		specials = np.frombuffer(ESCAPED_CHARS, dtype=np.uint8)
+		return specials[rng.integers(0, len(specials), points)].tobytes()
+
+	t = np.linspace(0, 10, points, endpoint=False) + rng.uniform(0, 1)
+	if waveform == "square":
+		y = np.where(t % 1 < 0.5, 100.0, -100.0)
+	elif waveform == "ramp":
+		y = (t % 1) * 246 - 123
+	elif waveform == "noise":
+		y = np.zeros(points)
+	else:
+		y = np.sin(2 * np.pi * t) * 123
+	y = y + rng.normal(0, noise, points)
+	return np.clip(np.round(y), -128, 127).astype(np.int8).tobytes()
+
+
+def make_sine(points):
+	return make_waveform(points, "sine")
+
+
+class DeviceCommand(object):
+	def __init__(self, command, address=None, length=None, data=None):
+		self.command = command
+		self.address = address
+		self.length = length
+		self.data = data
+
+
+class DeviceParser(ProbeScopeParser):
+	"""
+	Parser for the device side of the link, decodes the host's commands
+	"""
+
+	def __init__(self):
+		super(DeviceParser, self).__init__()
+		self.command_dict = {
+			REQUEST_SAMPLE_DATA: self.parse_request_command,
+			REQUEST_SAMPLE_BLOCKS: self.parse_request_command,
+			TRIGGERED_COMMAND: self.parse_request_command,
+			WRITE_REGISTERS: self.parse_write_command,
+			READ_REGISTERS: self.parse_read_command
+		}
+
+	def parse_request_command(self):
+		ret = DeviceCommand(self.char_buff[1])
+		self.char_buff = list()
+		return ret
+
+	def parse_write_command(self):
+		if len(self.char_buff) < 13:
+			return self.drop(ERROR_TRUNCATED)
+		address, length = struct.unpack("<IxI", bytes(self.char_buff[3:12]))
+		ret = DeviceCommand(WRITE_REGISTERS, address, length, bytes(self.char_buff[13:13 + length]))
+		self.char_buff = list()
+		return ret
+
+	def parse_read_command(self):
+		if len(self.char_buff) < 12:
+			return self.drop(ERROR_TRUNCATED)
+		address, length = struct.unpack("<IxI", bytes(self.char_buff[3:12]))
+		ret = DeviceCommand(READ_REGISTERS, address, length)
+		self.char_buff = list()
+		return ret
+
+
+class EmulatedSerial(object):
+	"""
+	Enough of serial.Serial over one end of a socket pair for SerialWorker and ProbeScopeClient
+
+	The port name is ignored, opening and closing only gate reads and writes so the link survives a reopen.
+	"""
+
+	def __init__(self, sock, baudrate=115200):
+		self.sock = sock
+		self.port = None
+		self.baudrate = baudrate
+		self.timeout = None
+		self.is_open = False
+
+	def open(self):
+		self.is_open = True
+
+	def close(self):
+		self.is_open = False
+
+	def fileno(self):
+		return self.sock.fileno()
+
+	@property
+	def in_waiting(self):
+		import fcntl
+		import termios
+		buf = fcntl.ioctl(self.sock.fileno(), termios.FIONREAD, b"\0\0\0\0")
+		return struct.unpack("i", buf)[0]
+
+	def read(self, size=1):
+		# Like pyserial, wait for size bytes or until timeout runs out
+		deadline = None if self.timeout is None else time.monotonic() + self.timeout
+		data = bytearray()
+		while len(data) < size:
+			wait = None if deadline is None else max(deadline - time.monotonic(), 0)
+			if not select.select([self.sock], [], [], wait)[0]:
+				break
+			chunk = self.sock.recv(size - len(data))
+			if not chunk:
+				break
+			data.extend(chunk)
+		return bytes(data)
+
+	def write(self, data):
+		self.sock.sendall(data)
+		return len(data)
+
+
+class DeviceEmulator(threading.Thread):
+	"""
+	Probe-Scope emulated in software, on a pty, an in-process socket pair or a real serial port
+
+	Answers sample requests with frames of the configured waveform, block transfers in chunks of block_size, pushes a frame trigger_interval after each
+	TRIGGERED_COMMAND arms it, and backs register reads and writes with a 64k memory map. The TX side is paced to
+	bytes_per_second, 11520 models a 115200 baud link with 10 bits per byte, None sends as fast as the transport
+	takes it. Line noise can be injected as random garbage between responses and as bit errors.
+
+	:param points: Samples per frame, can be changed while running
+	:param block_size: Samples per chunk of a block transfer
+	:param garbage_rate: Chance of a burst of random bytes ahead of each response
+	:param bit_error_rate: Chance of each sent byte having one bit flipped
+	"""
+	POLL = 0.01  # Seconds between checks for stop and due triggers
+	BURST = 256  # Largest TX burst in bytes, the link's transmit buffer
+
+	def __init__(self, points=1000, waveform="sine", noise=4.0, bytes_per_second=11520, trigger_interval=0.01,
+				 garbage_rate=0.0, bit_error_rate=0.0, seed=None, block_size=4096):
+		threading.Thread.__init__(self, daemon=True)
+		if waveform not in WAVEFORMS:
+			raise ValueError("Waveform must be one of {}!".format(WAVEFORMS))
+		self.points = points
+		self.waveform = waveform
+		self.noise = noise
+		self.bytes_per_second = bytes_per_second
+		self.trigger_interval = trigger_interval
+		self.garbage_rate = garbage_rate
+		self.bit_error_rate = bit_error_rate
+		self.block_size = block_size
+		self.rng = np.random.default_rng(seed)
+
+		self.registers = bytearray(0x10000)
+		self.parser = DeviceParser()
+		self.output = bytearray()
+		self.armed = list()  # Due times of armed triggers
+		self.tx_credit = 0.0
+		self.tx_last = None
+		self.stopped = threading.Event()
+		self.read = None
+		self.write = None
+		self.master = None
+
+		# Counters
+		self.requests = 0
+		self.pushes = 0
+		self.register_writes = 0
+		self.register_reads = 0
+		self.rx_bytes = 0
+		self.tx_bytes = 0
+
+	def open_pty(self):
+		"""
+		Serve on a new pseudo terminal and start, POSIX only
+
+		:return: device name of the host end, for serial.Serial
+		:rtype: str
+		"""
+		import tty
+		self.master, slave = os.openpty()
+		# No echo or line editing, even before the host opens its end
+		tty.setraw(slave)
+		self.use_fd(self.master)
+		self.start()
+		return os.ttyname(slave)
+
+	def open_loopback(self):
+		"""
+		Serve on an in-process socket pair and start, POSIX only
+
+		:return: serial.Serial stand in for the host end
+		:rtype: EmulatedSerial
+		"""
+		host, device = socket.socketpair()
+		self.master = device
+		self.use_fd(device.fileno())
+		self.start()
+		return EmulatedSerial(host)
+
+	def open_serial(self, port):
+		"""
+		Serve on a real serial port, e.g. one end of a null modem cable, and start, also on Windows
+		"""
+		port.timeout = self.POLL
+		self.read = lambda timeout, want_write=False: port.read(max(1, port.in_waiting))
+		self.write = port.write
+		self.master = port
+		self.start()
+
+	def use_fd(self, fd):
+		os.set_blocking(fd, False)
+
+		def read(timeout, want_write=False):
+			# Also wakes up when a blocked write can go on
+			if not select.select([fd], [fd] if want_write else [], [], timeout)[0]:
+				return b""
+			try:
+				return os.read(fd, 65536)
+			except (BlockingIOError, InterruptedError):
+				return b""
+
+		def write(data):
+			try:
+				return os.write(fd, data)
+			except BlockingIOError:
+				return 0
+
+		self.read = read
+		self.write = write
+
+	def stop(self):
+		self.stopped.set()
+		self.join()
+
+	def stats(self):
+		return {
+			"requests": self.requests,
+			"pushes": self.pushes,
+			"register_writes": self.register_writes,
+			"register_reads": self.register_reads,
+			"rx_bytes": self.rx_bytes,
+			"tx_bytes": self.tx_bytes,
+			"tx_pending": len(self.output)
+		}
+
+	def queue_response(self, response):
+		if self.garbage_rate and self.rng.random() < self.garbage_rate:
+			self.output.extend(self.rng.integers(0, 256, self.rng.integers(1, 17), dtype=np.uint8).tobytes())
+		self.output.extend(response)
+
+	def frame(self, command):
+		return ProbeScopeMakeSamples(make_waveform(self.points, self.waveform, self.noise, self.rng), command)
+
+	def handle(self, command):
+		if command.command == REQUEST_SAMPLE_DATA:
+			self.requests += 1
+			self.queue_response(self.frame(REQUEST_SAMPLE_DATA))
+		elif command.command == REQUEST_SAMPLE_BLOCKS:
+			self.requests += 1
+			self.queue_response(ProbeScopeMakeSampleBlocks(
+				make_waveform(self.points, self.waveform, self.noise, self.rng), self.block_size))
+		elif command.command == TRIGGERED_COMMAND:
+			last = self.armed[-1] if self.armed else time.monotonic()
+			self.armed.append(max(last, time.monotonic()) + self.trigger_interval)
+		elif command.command == WRITE_REGISTERS:
+			self.register_writes += 1
+			end = min(command.address + len(command.data), len(self.registers))
+			self.registers[command.address:end] = command.data[:end - command.address]
+			self.queue_response(ProbeScopeMakeWriteResponse(len(command.data)))
+		elif command.command == READ_REGISTERS:
+			self.register_reads += 1
+			self.queue_response(ProbeScopeMakeReadResponse(
+				self.registers[command.address:command.address + command.length]))
+
+	def fire_triggers(self, now):
+		while self.armed and self.armed[0] <= now:
+			self.armed.pop(0)
+			self.pushes += 1
+			self.queue_response(self.frame(TRIGGERED_COMMAND))
+
+	def send(self, now):
+		if not self.output:
+			self.tx_last = now
+			return
+		if self.bytes_per_second is None:
+			length = len(self.output)
+		else:
+			# Token bucket, credit accrues at the link rate up to one TX burst
+			if self.tx_last is not None:
+				self.tx_credit = min(self.tx_credit + (now - self.tx_last) * self.bytes_per_second, self.BURST)
+			self.tx_last = now
+			length = min(int(self.tx_credit), len(self.output))
+			if length == 0:
+				return
+		data = bytes(self.output[:length])
+		if self.bit_error_rate:
+			errors = np.flatnonzero(self.rng.random(length) < self.bit_error_rate)
+			if len(errors):
+				corrupted = np.frombuffer(data, dtype=np.uint8).copy()
+				corrupted[errors] ^= (1 << self.rng.integers(0, 8, len(errors))).astype(np.uint8)
+				data = corrupted.tobytes()
+		written = self.write(data) or 0
+		del self.output[:written]
+		self.tx_bytes += written
+		if self.bytes_per_second is not None:
+			self.tx_credit -= written
+
+	def next_wait(self, now):
+		wait = self.POLL
+		if self.armed:
+			wait = min(wait, max(self.armed[0] - now, 0))
+		if self.output and self.bytes_per_second is not None:
+			# Until a useful chunk of credit has built up
+			chunk = min(len(self.output), 64)
+			wait = min(wait, max(chunk - self.tx_credit, 0) / self.bytes_per_second)
+		return wait
+
+	def run(self):
+		while not self.stopped.is_set():
+			want_write = bool(self.output) and self.bytes_per_second is None
+			data = self.read(self.next_wait(time.monotonic()), want_write)
+			if data:
+				self.rx_bytes += len(data)
+				for command in self.parser.feed(data):
+					self.handle(command)
+			now = time.monotonic()
+			self.fire_triggers(now)
+			self.send(now)
@@ -1,7 +1,7 @@
 import os
+import struct
 import sys
 import time
-from enum import Enum
 
 # Force pyqtgraph to use PySide2
 os.environ["PYQTGRAPH_QT_LIB"] = "PySide2"
@@ -9,21 +9,45 @@ os.environ["PYQTGRAPH_QT_LIB"] = "PySide2"
 import numpy as np
 import pyqtgraph
 import serial
-import serial.tools.list_ports
 from PySide2 import QtCore, QtGui
 from PySide2.QtWidgets import QApplication, QCheckBox, QGridLayout, QGroupBox, QHBoxLayout, QPushButton, QStyleFactory, \
-	QVBoxLayout, QWidget, QMainWindow, QComboBox, QLabel, QLayout, QLineEdit
+	QVBoxLayout, QWidget, QMainWindow, QComboBox, QLabel, QLayout, QLineEdit, QFileDialog
 
+import ProbeScopeDevices
 import ProbeScopeInterface
+import ProbeScopePorts
+import ProbeScopeRecording
+import ProbeScopeTransactions
+import autoset
+import dsp
 import measurements
-
-ADC_STEP = 0.004
-ADC_SAMPLE_RATE = 250000000
-
-
-class SerialState(Enum):
-	Waiting_For_Samples = 1
-	Waiting_For_Reg_Response = 2
+import persistence
+import plot_lod
+import spectrum
+import telemetry
+import trigger
+
+ADC_STEP = ProbeScopeInterface.ADC_STEP
+ADC_SAMPLE_RATE = ProbeScopeInterface.ADC_SAMPLE_RATE
+
+TRIGGER_MODES = {
+	"Off": None,
+	"Rising": "rising",
+	"Falling": "falling",
+	"Pulse width": "pulse_width",
+	"Runt": "runt"
+}
+
+# Pens of the channels of further devices, the first device keeps the main curve's
+CHANNEL_PENS = [(100, 200, 250), (250, 120, 120), (120, 250, 120), (250, 160, 250)]
+
+# Replay speed, None replays as fast as the GUI draws
+REPLAY_SPEEDS = {
+	"1x": 1,
+	"2x": 2,
+	"10x": 10,
+	"Max": None
+}
 
 
 class SelfPopulatingComboBox(QComboBox):
@@ -34,33 +58,121 @@ class SelfPopulatingComboBox(QComboBox):
 		super(SelfPopulatingComboBox, self).showPopup()
 
 
-class SerialThread(QtCore.QThread):
-	def __init__(self, serial_port, serial_lock, command_callback, parent=None):
+class SerialSignals(QtCore.QObject):
+	"""
+	Hands messages parsed on the serial worker thread to the GUI thread through queued signals
+
+	Sample frames are not queued, only the newest one is kept until the GUI takes it with take_samples, so a busy GUI
+	drops frames instead of falling behind. Transaction futures complete on worker threads, call_soon runs their
+	follow-ups on the GUI thread.
+	"""
+	samples_ready = QtCore.Signal()
+	capture_ready = QtCore.Signal()
+	message_received = QtCore.Signal(object)
+	call_requested = QtCore.Signal(object)
+
+	def __init__(self, parent=None):
+		super(SerialSignals, self).__init__(parent)
+		self.samples_lock = QtCore.QMutex()
+		self.latest_samples = None
+		self.latest_capture = None
+		self.dropped_samples = 0
+		self.call_requested.connect(self.call)
+
+	def call(self, function):
+		function()
+
+	def call_soon(self, function):
+		self.call_requested.emit(function)
+
+	def lock_samples(self):
+		if not self.samples_lock.tryLock():
+			telemetry.telemetry.count("lock_contention")
+			self.samples_lock.lock()
+
+	def take_samples(self):
+		self.lock_samples()
+		samples = self.latest_samples
+		self.latest_samples = None
+		self.samples_lock.unlock()
+		return samples
+
+	def deliver_samples(self, samples):
+		self.lock_samples()
+		pending = self.latest_samples is not None
+		if pending:
+			self.dropped_samples += 1
+			telemetry.telemetry.count("display_drops")
+		self.latest_samples = samples
+		self.samples_lock.unlock()
+		if not pending:
+			self.samples_ready.emit()
+
+	def take_capture(self):
+		self.lock_samples()
+		capture = self.latest_capture
+		self.latest_capture = None
+		self.samples_lock.unlock()
+		return capture
+
+	def deliver_capture(self, capture):
+		# Aligned captures of several devices, only the newest is kept like single frames
+		self.lock_samples()
+		pending = self.latest_capture is not None
+		if pending:
+			self.dropped_samples += 1
+			telemetry.telemetry.count("display_drops")
+		self.latest_capture = capture
+		self.samples_lock.unlock()
+		if not pending:
+			self.capture_ready.emit()
+
+	def message_callback(self, message):
+		if type(message) in (ProbeScopeInterface.ProbeScopeSamples, ProbeScopeInterface.ProbeScopeSampleBlock):
+			self.deliver_samples(message)
+		else:
+			self.message_received.emit(message)
+
+
+class SpectrumWorker(QtCore.QThread):
+	"""
+	Computes spectra off the GUI thread, only the newest submitted frame is kept so a slow FFT never queues up frames
+	"""
+	spectrum_ready = QtCore.Signal(object)
+
+	def __init__(self, analyzer, parent=None):
 		QtCore.QThread.__init__(self, parent)
-		self.serial_port = serial_port
-		self.serial_lock = serial_lock
-		self.command_callback = command_callback
-		self.parser = ProbeScopeInterface.ProbeScopeParser()
+		self.analyzer = analyzer
+		self.mutex = QtCore.QMutex()
+		self.condition = QtCore.QWaitCondition()
+		self.pending = None
+
+	def submit(self, y, sample_rate, averages):
+		self.mutex.lock()
+		self.pending = (y, sample_rate, averages)
+		self.condition.wakeOne()
+		self.mutex.unlock()
+
+	def stop(self):
+		self.requestInterruption()
+		self.mutex.lock()
+		self.condition.wakeOne()
+		self.mutex.unlock()
+		self.wait()
 
 	def run(self):
-		while True:
-			time.sleep(0.5)
-			self.serial_lock.lock()
-			if self.serial_port.isOpen():
-				data = []
-				try:
-					data = self.serial_port.read(16000)
-				except serial.serialutil.SerialException as e:
-					print("Serial broke!")
-					self.serial_lock.unlock()
-					continue
-
-				for s_char in data:
-					res = self.parser.read_char(s_char)
-					if res is not None:
-						self.command_callback(res)
-			# print("Serial Obj:" + str(self.serial_port))
-			self.serial_lock.unlock()
+		while not self.isInterruptionRequested():
+			self.mutex.lock()
+			if self.pending is None:
+				self.condition.wait(self.mutex, 100)
+			job = self.pending
+			self.pending = None
+			self.mutex.unlock()
+
+			if job is not None:
+				y, sample_rate, averages = job
+				self.analyzer.averages = averages
+				self.spectrum_ready.emit(self.analyzer.add(y, sample_rate))
 
 
 class WidgetGallery(QMainWindow):
@@ -72,9 +184,26 @@ class WidgetGallery(QMainWindow):
 		self.adc_decimation = 1
 		self.offset = 0
 		self.samples = None
+		self.autoranger = autoset.Autoranger()
+		self.lod = None
+		self.partial = None  # Block transfer being drawn and its envelope
+		self.x_axis_key = None
+		self.x_axis_cache = None
+		self.phosphor_key = None
+		self.spectrum_result = None
+		self.trigger = None
+		self.dsp_pipeline = None
+		self.dsp_oversized = False  # Told the user a frame was too long for DSP
+		self.channel_curves = list()
+		self.port_list = dict()
+		self.device_port_list = dict()
+		self.connected_ports = dict()  # Port each device was opened on, reopened when it is plugged in again
 
-		self.serial_state = None
-		self.serial_state_timeout = time.time()
+		self.replay_reader = None
+		self.replay_index = 0
+		self.live_adc = None  # adc_scale and adc_decimation to go back to after a replay
+
+		self.sample_future = None
 
 		self.originalPalette = QApplication.palette()
 
@@ -84,29 +213,78 @@ class WidgetGallery(QMainWindow):
 		serial_label.setText("Serial Port:")
 
 		self.Serial_Handel = serial.Serial()
-		self.Serial_Handel.timeout = 0
 		self.Serial_Handel.baudrate = 115200
-		self.serial_lock = QtCore.QMutex()
 
-		self.serial_thread = SerialThread(self.Serial_Handel, self.serial_lock, self.command_callback)
-		self.serial_thread.start()
+		self.serial_signals = SerialSignals(self)
+		self.serial_signals.samples_ready.connect(self.samples_ready)
+		self.serial_signals.message_received.connect(self.command_callback)
+		self.serial_signals.capture_ready.connect(self.capture_ready)
+		# The first device is the one the controls act on, devices added later are shown as further channels
+		self.devices = ProbeScopeDevices.DeviceManager(self.serial_signals.deliver_capture)
+		device = self.devices.add(self.Serial_Handel, self.serial_message)
+		self.serial_io = device.serial_io
+		self.acquisition = device.acquisition
+		self.register_map = device.register_map
+		self.transactions = device.transactions
+
+		# Captures of several devices wait for each other, late ones go out partial
+		self.align_timer = QtCore.QTimer()
+		self.align_timer.setInterval(100)
+		self.align_timer.timeout.connect(self.devices.flush)
+
+		# Ports are listed in the background, the boxes only ever show the last scan
+		self.port_scanner = ProbeScopePorts.PortScanner(
+			lambda added, removed: self.serial_signals.call_soon(lambda: self.ports_changed(added, removed)))
 
 		self.Serial_Port_Box = SelfPopulatingComboBox()
 		self.Serial_Port_Box.view().setMinimumWidth(30)
 		self.update_ports()
-		self.Serial_Port_Box.setCurrentIndex(0)
-		self.port_list = dict()
 		self.Serial_Port_Box.popupAboutToBeShown.connect(self.update_ports)
+		self.Serial_Port_Box.popupAboutToBeShown.connect(self.port_scanner.rescan)
 		self.Serial_Port_Box.currentIndexChanged.connect(self.selected_port)
 
+		self.Device_Port_Box = SelfPopulatingComboBox()
+		self.Device_Port_Box.view().setMinimumWidth(30)
+		self.Device_Port_Box.popupAboutToBeShown.connect(self.update_device_ports)
+		self.Device_Port_Box.popupAboutToBeShown.connect(self.port_scanner.rescan)
+		self.Device_Port_Box.activated.connect(self.add_device)
+		self.port_scanner.start()
+
 		# create plot
 		self.main_plot = pyqtgraph.PlotWidget()
 
+		# Persistence image drawn under the live trace
+		self.phosphor = persistence.PhosphorAccumulator()
+		self.phosphor_image = pyqtgraph.ImageItem()
+		self.phosphor_image.setLookupTable(pyqtgraph.ColorMap(
+			[0.0, 0.33, 0.66, 1.0],
+			[(0, 0, 0), (0, 120, 60), (200, 200, 100), (255, 255, 255)]).getLookupTable(0.0, 1.0, 256))
+		self.phosphor_image.setZValue(-1)
+		self.phosphor_image.setVisible(False)
+		self.main_plot.addItem(self.phosphor_image)
+
 		self.curve = self.main_plot.plot()
 		self.curve.setPen((200, 200, 100))
 		self.main_plot.getAxis('left').setGrid(255)
 		self.main_plot.getAxis('bottom').setGrid(255)
 		self.curve.getViewBox().setMouseMode(pyqtgraph.ViewBox.RectMode)
+		self.curve.getViewBox().sigXRangeChanged.connect(self.redraw_curve)
+		self.curve.getViewBox().sigResized.connect(self.redraw_curve)
+
+		self.spectrum_plot = pyqtgraph.PlotWidget()
+		self.spectrum_plot.setLabel('bottom', "Frequency", units="Hz")
+		self.spectrum_plot.setLabel('left', "Power", units="dB")
+		self.spectrum_curve = self.spectrum_plot.plot()
+		self.spectrum_curve.setPen((100, 200, 200))
+		self.spectrum_plot.setVisible(False)
+
+		self.spectrum_worker = SpectrumWorker(spectrum.SpectrumAnalyzer())
+		self.spectrum_worker.spectrum_ready.connect(self.update_spectrum)
+		self.spectrum_worker.start()
+
+		plot_layout = QVBoxLayout()
+		plot_layout.addWidget(self.main_plot, 2)
+		plot_layout.addWidget(self.spectrum_plot, 1)
 
 		self.ControlGroupBox = QGroupBox("Controls")
 		self.create_control_group_box()
@@ -115,6 +293,10 @@ class WidgetGallery(QMainWindow):
 		topLayout.addStretch(1)
 		topLayout.addWidget(serial_label)
 		topLayout.addWidget(self.Serial_Port_Box, 2)
+		device_label = QLabel()
+		device_label.setText("Add Device:")
+		topLayout.addWidget(device_label)
+		topLayout.addWidget(self.Device_Port_Box, 2)
 
 		self.label_font = QtGui.QFont("Times", 600, QtGui.QFont.Bold)
 		self.bottom_layout = QHBoxLayout()
@@ -128,20 +310,22 @@ class WidgetGallery(QMainWindow):
 			measurements.meas_pk_pk,
 			measurements.meas_rms,
 			measurements.meas_average,
-			None
+			self.meas_spectrum
 		]
 
 		for i in range(4):
-			print("{}: N/A".format(i + 1))
 			meas_n = QLabel()
 			meas_n.setText("{}: N/A".format(i + 1))
 			meas_n.setAlignment(QtCore.Qt.AlignLeft)
 			self.measurements_list.append(meas_n)
 			self.bottom_layout.addWidget(meas_n, alignment=QtCore.Qt.AlignLeft)
 
+		self.channels_label = QLabel()
+		self.bottom_layout.addWidget(self.channels_label, alignment=QtCore.Qt.AlignLeft)
+
 		mainLayout = QGridLayout()
 		mainLayout.addLayout(topLayout, 0, 0, 1, 2)
-		mainLayout.addWidget(self.main_plot, 1, 0, 2, 1)
+		mainLayout.addLayout(plot_layout, 1, 0, 2, 1)
 		mainLayout.addWidget(self.ControlGroupBox, 1, 1, 2, 1)
 		mainLayout.addLayout(self.bottom_layout, 3, 0, 1, 2, alignment=QtCore.Qt.AlignLeft)
 		mainLayout.setRowMinimumHeight(3, 20)
@@ -156,60 +340,131 @@ class WidgetGallery(QMainWindow):
 
 		self.setWindowTitle("Probe-Scope Acquisition")
 
-	def command_callback(self, command):
-		print("Got {}!".format(command))
+	def closeEvent(self, event):
+		self.port_scanner.stop()
+		self.stop_recording()
+		self.devices.close()
+		self.stop_dsp()
+		self.spectrum_worker.stop()
+		self.stop_replay()
+		super(WidgetGallery, self).closeEvent(event)
+
+	def serial_message(self, message):
+		# Runs on the serial worker thread, after the device counted and recorded the message
+		if len(self.devices) > 1 and type(message) is ProbeScopeInterface.ProbeScopeSamples:
+			return  # Drawn from the aligned captures
+		dsp_pipeline = self.dsp_pipeline
+		if dsp_pipeline is not None and type(message) is ProbeScopeInterface.ProbeScopeSamples:
+			if len(message.samples) <= dsp_pipeline.max_length:
+				# Processed frames come back through serial_signals.deliver_samples
+				dsp_pipeline.submit(message.samples)
+				return
+			# e.g. a block transfer capture, too long for a DSP slot, it is drawn unprocessed
+			telemetry.telemetry.count("dsp_oversized")
+			if not self.dsp_oversized:
+				self.dsp_oversized = True
+				print("{} samples are too many for DSP, showing the frame unprocessed".format(len(message.samples)))
+		self.serial_signals.message_callback(message)
+
+	def samples_ready(self):
+		samples = self.serial_signals.take_samples()
+		if samples is not None:
+			self.command_callback(samples)
+
+	def capture_ready(self):
+		capture = self.serial_signals.take_capture()
+		if capture is None or len(capture) < 2:
+			return  # A single device is drawn frame by frame
+		if capture.frames[0] is not None:
+			self.update_plot(capture.frames[0])
+		self.update_channels(capture)
 
+	def command_callback(self, command):
 		if type(command) is ProbeScopeInterface.ProbeScopeSamples:
-			print("Plotting!")
 			self.update_plot(command)
 
-		elif type(command) is ProbeScopeInterface.ProbeScopeWriteResponse:
-			if self.serial_state is SerialState.Waiting_For_Reg_Response:
-				self.serial_state = None
+		elif type(command) is ProbeScopeInterface.ProbeScopeSampleBlock:
+			self.update_partial(command)
+
+		elif type(command) is dsp.ProcessedSamples:
+			# Back from the DSP pipeline, update_plot takes its decimation into the time axis
+			self.update_plot(command)
 
 	def get_samples(self):
-		if self.serial_state is SerialState.Waiting_For_Samples:
-			if time.time() - self.serial_state_timeout < 0:
-				print("Already waiting for samples!")
-				return
-		elif self.serial_state is not None:
-			if time.time() - self.serial_state_timeout < 0:
-				print("In another state ({})!".format(self.serial_state))
-				return
-		if self.serial_lock.tryLock(50):
-			if self.Serial_Handel.isOpen():
-				self.serial_state = SerialState.Waiting_For_Samples
-				self.serial_state_timeout = time.time() + 2
-				self.Serial_Handel.write(ProbeScopeInterface.REQUEST_SAMPLE_DATA_COMMAND)
-			else:
-				print("Serial handel closed, cannot get samples")
-			self.serial_lock.unlock()
+		if self.sample_future is not None and not self.sample_future.done():
+			print("Already waiting for samples!")
+			return
+		if self.serial_io.is_open:
+			# Times out after SAMPLES_POLICY, the next request can go out then
+			self.sample_future = self.devices.request_all(self.sample_command())
 		else:
-			print("Failed to get serial lock! Cannot request samples!")
+			print("Serial handel closed, cannot get samples")
+
+	def sample_command(self):
+		if self.blocks_check.isChecked():
+			return ProbeScopeInterface.REQUEST_SAMPLE_BLOCKS_COMMAND
+		return ProbeScopeInterface.REQUEST_SAMPLE_DATA_COMMAND
 
 	def auto_sample(self):
 		TIMEOUT = 500
 		if not self.autoPushButton.isChecked():
 			return
 
-		if self.serial_state_timeout is not None and time.time() - self.serial_state_timeout > 0:
-			self.serial_state = None
+		if self.sample_future is not None and not self.sample_future.done():
+			pass  # Still waiting, try again on the next tick
+		elif self.serial_io.is_open:
+			self.sample_future = self.devices.request_all(self.sample_command())
+		else:
+			print("Serial handel closed, cannot get samples")
 
-		if self.serial_state is not None:
-			self.auto_sample_timer.start(TIMEOUT)
+		self.auto_sample_timer.start(TIMEOUT)
 
-		if self.serial_lock.tryLock(50):
-			if self.Serial_Handel.isOpen():
-				self.serial_state = SerialState.Waiting_For_Samples
-				self.serial_state_timeout = time.time() + 2
-				self.Serial_Handel.write(ProbeScopeInterface.REQUEST_SAMPLE_DATA_COMMAND)
-			else:
-				print("Serial handel closed, cannot get samples")
-			self.serial_lock.unlock()
+	def stream_sample(self):
+		if self.streamPushButton.isChecked():
+			if not self.in_flight_box.hasAcceptableInput():
+				print("Invalid requests in flight!")
+				self.streamPushButton.setChecked(False)
+				return
+			self.devices.start(int(self.in_flight_box.text()), self.push_check.isChecked(), self.blocks_check.isChecked())
+			self.stream_stats_timer.start()
 		else:
-			print("Failed to get serial lock! Cannot request samples!")
+			self.devices.stop()
+			self.stream_stats_timer.stop()
+
+	def update_stream_stats(self):
+		self.devices.poll()
+		stats = self.acquisition.stats()
+		discarded = self.trigger.discarded if self.trigger is not None else 0
+		message = "{:.1f} frames/s, link {:.0f}%, {} timeouts, {} dropped by display, {} not triggered".format(
+			stats["fps"], stats["link_utilization"] * 100, stats["timeouts"], self.serial_signals.dropped_samples,
+			discarded)
+		for device in self.devices[1:]:
+			message += ", CH{} {:.1f} frames/s".format(device.index + 1, device.acquisition.stats()["fps"])
+		if len(self.devices) > 1:
+			alignment = self.devices.aligner.stats()
+			message += ", {} partial, {} unaligned".format(alignment["partial"], alignment["unaligned"])
+		if telemetry.telemetry.enabled:
+			message += " | " + telemetry.telemetry.status()
+		self.statusBar().showMessage(message)
+
+	def toggle_telemetry(self):
+		enabled = self.telemetryPushButton.isChecked()
+		telemetry.telemetry.reset()
+		telemetry.telemetry.enabled = enabled
+		if enabled:
+			self.telemetry_timer.start()
+		else:
+			self.telemetry_timer.stop()
 
-		self.auto_sample_timer.start(TIMEOUT)
+	def update_telemetry(self):
+		if not self.streamPushButton.isChecked():
+			# While streaming update_stream_stats shows it
+			self.statusBar().showMessage(telemetry.telemetry.status())
+
+	def export_telemetry(self):
+		path, _ = QFileDialog.getSaveFileName(self, "Export telemetry to", "telemetry.json", "JSON (*.json)")
+		if path:
+			telemetry.telemetry.export(path)
 
 	def update_measurements(self):
 		if self.samples is None:
@@ -220,82 +475,462 @@ class WidgetGallery(QMainWindow):
 			else:
 				self.measurements_list[i].setText("{}: {}".format(i + 1, meas(self.samples)))
 
+	def update_channels(self, capture):
+		"""
+		Draw the frames of the further devices of an aligned capture, with their pk-pk and RMS
+		"""
+		v_step = ADC_STEP * self.adc_scale
+		texts = list()
+		for channel, (frame, statistics) in enumerate(zip(capture.frames[1:], capture.statistics()[1:]), 1):
+			while len(self.channel_curves) < channel:
+				curve = self.main_plot.plot()
+				curve.setPen(CHANNEL_PENS[len(self.channel_curves) % len(CHANNEL_PENS)])
+				self.channel_curves.append(curve)
+			if frame is None:
+				texts.append("CH{}: N/A".format(channel + 1))
+				continue
+			y = np.asarray(frame.samples) * v_step
+			x = np.linspace(-0.5, 0.5, len(y)) * len(y) * self.adc_decimation / ADC_SAMPLE_RATE
+			index, y = plot_lod.MinMaxPyramid(y).envelope(0, len(y), max(1, int(self.curve.getViewBox().width())))
+			self.channel_curves[channel - 1].setData(x[index], y)
+			texts.append("CH{}: {:.2f}V pk-pk {:.2f}V RMS".format(
+				channel + 1, statistics["pk_pk"] * v_step, statistics["rms"] * v_step))
+		texts.append("skew {:.1f}ms".format(capture.skew * 1e3))
+		self.channels_label.setText(", ".join(texts))
+
+	def update_partial(self, block):
+		"""
+		Draw a block transfer while it arrives, on the time axis of the whole capture
+		"""
+		if self.partial is None or self.partial[0] is not block:
+			pixels = max(1, int(self.curve.getViewBox().width()))
+			self.partial = (block, plot_lod.ProgressiveEnvelope(len(block), pixels))
+		index, y = self.partial[1].update(block.samples)
+		if len(index) == 0:
+			return
+		x = self.x_axis(len(block), self.adc_decimation)
+		self.curve.setData(x[index], y * ADC_STEP * self.adc_scale)
+
 	def update_plot(self, samples):
-		if self.serial_state is SerialState.Waiting_For_Samples:
-			self.serial_state = None
-		total_len = len(samples.samples) * (1 / (ADC_SAMPLE_RATE / self.adc_decimation))
-		x = np.linspace(-(total_len / 2), total_len / 2, len(samples.samples))
+		self.partial = None
+		timeline = getattr(samples, "timeline", None)  # Only set while telemetry is enabled
 		y = np.asarray(samples.samples) * ADC_STEP * self.adc_scale
+		decimation = self.adc_decimation * getattr(samples, "decimation", 1)
+		x = self.x_axis(len(y), decimation)
+		trigger_offset = 0
+		if self.trigger is not None:
+			trigger_index = self.trigger.find(y)
+			if trigger_index is None:
+				telemetry.telemetry.count("not_triggered")
+				telemetry.telemetry.finish_frame(timeline)
+				return  # Frames that do not trigger are not shown
+			# Time zero on the trigger point
+			x = x - x[trigger_index]
+			trigger_offset = len(y) // 2 - trigger_index
 		self.samples = (x, y)
-		self.curve.setData(x, y)
+		self.update_measurements()
+		if timeline is not None:
+			timeline[4] = time.perf_counter()
+		self.lod = plot_lod.MinMaxPyramid(y)
+		self.redraw_curve()
+		if self.persistencePushButton.isChecked():
+			self.update_persistence(samples.samples, trigger_offset)
+		if self.fftPushButton.isChecked():
+			self.spectrum_worker.submit(y, ADC_SAMPLE_RATE / decimation, int(self.fft_average_box.text()))
+		if timeline is not None:
+			timeline[5] = time.perf_counter()
+			telemetry.telemetry.finish_frame(timeline)
+
+	def autoset(self):
+		if not self.autosetPushButton.isChecked():
+			return
+		if not self.serial_io.is_open:
+			print("Serial handel closed, cannot autoset")
+			self.autosetPushButton.setChecked(False)
+			return
+		# Start from a gain the device is known to have
+		self.register_map.set("VGA", self.autoranger.adrf.GetMessage())
+		self.autoset_step()
+
+	def autoset_step(self):
+		# Write the gain, then take the first frame captured with it, requested unless frames already keep coming
+		if self.autoPushButton.isChecked() or self.streamPushButton.isChecked():
+			command = None
+		else:
+			command = self.sample_command()
+		future = ProbeScopeTransactions.sequence([
+			self.write_registers,
+			lambda: self.transactions.request_samples(command)
+		])
+		future.add_done_callback(lambda done: self.serial_signals.call_soon(lambda: self.autoset_frame(done)))
+
+	def autoset_frame(self, future):
+		if not self.autosetPushButton.isChecked():
+			return
+		try:
+			samples = future.result()[-1]
+		except ProbeScopeTransactions.TransactionError as e:
+			print("Autoset failed: {}".format(e))
+			self.autosetPushButton.setChecked(False)
+			return
+		message = self.autoranger.update(samples.samples)
+		if message is None:
+			print("Autoset to {}dB".format(self.autoranger.adrf.Gain))
+			self.autosetPushButton.setChecked(False)
+			return
+		self.register_map.set("VGA", message)
+		self.autoset_step()
+
+	def toggle_spectrum(self):
+		enabled = self.fftPushButton.isChecked()
+		if enabled and not self.fft_average_box.hasAcceptableInput():
+			print("Invalid FFT averaging!")
+			self.fftPushButton.setChecked(False)
+			return
+		self.spectrum_result = None
+		self.spectrum_plot.setVisible(enabled)
 		self.update_measurements()
 
-	def autorange_plot(self):
-		self.main_plot.autoRange()
+	def update_spectrum(self, result):
+		if not self.fftPushButton.isChecked():
+			return
+		self.spectrum_result = result
+		self.spectrum_curve.setData(result.frequencies, result.power_db)
+		self.update_measurements()
 
-	def update_ports(self):
-		self.port_list = dict()
+	def meas_spectrum(self, samples):
+		result = self.spectrum_result
+		if result is None:
+			return "N/A"
+		return "{:.4g}Hz, THD {:.2f}%, SNR {:.1f}dB".format(result.dominant_frequency, result.thd * 100, result.snr)
 
-		# add dummy NC entry
-		self.port_list[" - "] = None
+	def toggle_dsp(self):
+		self.stop_dsp()
+		if not self.dspPushButton.isChecked():
+			return
+		boxes = [self.dsp_average_box, self.dsp_boxcar_box, self.dsp_cutoff_box, self.dsp_decimate_box]
+		if not all([box.hasAcceptableInput() for box in boxes]):
+			print("Invalid DSP settings!")
+			self.dspPushButton.setChecked(False)
+			return
 
-		for port in serial.tools.list_ports.comports():
-			if "Microsoft" in port.manufacturer:
-				self.port_list["Probe-Scope ({})".format(port.device)] = port.device
-			else:
-				self.port_list["{} ({})".format(port.manufacturer, port.device)] = port.device
+		stages = list()
+		boxcar = int(self.dsp_boxcar_box.text())
+		if boxcar > 1:
+			# High resolution mode averages and decimates in one stage
+			stages.append(dsp.Boxcar(boxcar, decimate=self.dsp_hires_check.isChecked()))
+		cutoff = float(self.dsp_cutoff_box.text())
+		if cutoff < 1:
+			stages.append(dsp.FIRLowPass(cutoff))
+		decimate = int(self.dsp_decimate_box.text())
+		if decimate > 1:
+			stages.append(dsp.Decimate(decimate))
+		ordered_stages = list()
+		average = int(self.dsp_average_box.text())
+		if average > 1:
+			ordered_stages.append(dsp.FrameAverage(average))
+
+		self.dsp_oversized = False
+		self.dsp_pipeline = dsp.ProcessPoolPipeline(stages, ordered_stages, self.serial_signals.deliver_samples)
+
+	def stop_dsp(self):
+		dsp_pipeline = self.dsp_pipeline
+		self.dsp_pipeline = None
+		if dsp_pipeline is not None:
+			dsp_pipeline.close()
+
+	def apply_trigger(self):
+		mode = TRIGGER_MODES[self.trigger_mode_box.currentText()]
+		if mode is None:
+			self.trigger = None
+			return
+		boxes = [self.trigger_level_box, self.trigger_hysteresis_box, self.trigger_min_width_box,
+				 self.trigger_max_width_box, self.trigger_runt_box]
+		if not all([box.hasAcceptableInput() or box.text() == "" for box in boxes]):
+			print("Invalid trigger settings!")
+			return
+		value = lambda box, convert, default: convert(box.text()) if box.text() != "" else default
+		try:
+			# Without a high level a runt could never qualify, runt mode is refused instead of never firing
+			self.trigger = trigger.SoftwareTrigger(
+				mode,
+				level=value(self.trigger_level_box, float, 0.0),
+				hysteresis=value(self.trigger_hysteresis_box, float, 0.0),
+				min_width=value(self.trigger_min_width_box, int, 0),
+				max_width=value(self.trigger_max_width_box, int, None),
+				runt_high=value(self.trigger_runt_box, float, None))
+		except ValueError as e:
+			print("Invalid trigger settings! {}".format(e))
+			return
+		self.phosphor.clear()
+
+	def update_persistence(self, raw_samples, offset=0):
+		if self.phosphor_key != self.x_axis_key:
+			# Time or voltage scale changed, old traces no longer line up
+			self.phosphor.clear()
+			self.phosphor_key = self.x_axis_key
+		self.phosphor.add(raw_samples, offset)
+		self.phosphor_image.setImage(self.phosphor.image(), autoLevels=False, levels=(0, 1))
+
+		x = self.x_axis_cache
+		v_step = ADC_STEP * self.adc_scale
+		self.phosphor_image.setRect(QtCore.QRectF(x[0], -128 * v_step, x[-1] - x[0], 256 * v_step))
+
+	def toggle_persistence(self):
+		enabled = self.persistencePushButton.isChecked()
+		if enabled:
+			if not self.decay_box.hasAcceptableInput():
+				print("Invalid decay!")
+				self.persistencePushButton.setChecked(False)
+				return
+			decay = float(self.decay_box.text())
+			self.phosphor.decay = None if decay >= 1 else decay
+		self.phosphor.clear()
+		self.phosphor_image.setVisible(enabled)
+
+	def clear_persistence(self):
+		self.phosphor.clear()
+		self.phosphor_image.setImage(self.phosphor.image(), autoLevels=False, levels=(0, 1))
+
+	def x_axis(self, length, decimation):
+		key = (length, decimation)
+		if key != self.x_axis_key:
+			total_len = length * (1 / (ADC_SAMPLE_RATE / decimation))
+			self.x_axis_cache = np.linspace(-(total_len / 2), total_len / 2, length)
+			self.x_axis_key = key
+		return self.x_axis_cache
+
+	def redraw_curve(self):
+		"""
+		Draw the per-pixel min/max envelope of the visible part of the record
+		"""
+		if self.lod is None:
+			return
+		x = self.samples[0]
+		view_box = self.curve.getViewBox()
+		start, stop = 0, len(x)
+		if not view_box.state["autoRange"][0]:
+			x_min, x_max = view_box.viewRange()[0]
+			start = int(np.searchsorted(x, x_min)) - 1
+			stop = int(np.searchsorted(x, x_max)) + 1
+			if start >= len(x) or stop <= 0:
+				start, stop = 0, len(x)
+		index, y = self.lod.envelope(start, stop, max(1, int(view_box.width())))
+		self.curve.setData(x[index], y)
+
+	def record(self):
+		if not self.recordPushButton.isChecked():
+			self.stop_recording()
+			return
+		path, _ = QFileDialog.getSaveFileName(self, "Record to", "capture.psrec", "Probe-Scope recordings (*.psrec)")
+		if not path:
+			self.recordPushButton.setChecked(False)
+			return
+		# One file per device, numbered when there are several
+		self.devices.record(ProbeScopeDevices.recording_paths(path, len(self.devices)), self.adc_scale,
+							self.adc_decimation)
+
+	def stop_recording(self):
+		for recorder in self.devices.stop_recording():
+			print("Recorded {} frames to {}, {} dropped".format(recorder.written, recorder.path, recorder.dropped))
+		self.recordPushButton.setChecked(False)
+
+	def replay(self):
+		if not self.replayPushButton.isChecked():
+			self.stop_replay()
+			return
+		path, _ = QFileDialog.getOpenFileName(self, "Replay", "", "Probe-Scope recordings (*.psrec)")
+		if not path:
+			self.replayPushButton.setChecked(False)
+			return
+		try:
+			self.replay_reader = ProbeScopeRecording.RecordingReader(path)
+		except ProbeScopeRecording.RecordingError as e:
+			print(e)
+			self.replayPushButton.setChecked(False)
+			return
+		if self.live_adc is None:
+			self.live_adc = (self.adc_scale, self.adc_decimation)
+		self.adc_scale = self.replay_reader.adc_scale
+		self.adc_decimation = self.replay_reader.adc_decimation
+		self.replay_index = 0
+		self.replay_next()
+
+	def replay_next(self):
+		reader = self.replay_reader
+		if reader is None or self.replay_index >= len(reader):
+			self.stop_replay()
+			return
 
-		self.Serial_Port_Box.clear()
-		self.Serial_Port_Box.addItems(list(self.port_list.keys()))
+		frame = reader[self.replay_index]
+		self.update_plot(ProbeScopeInterface.ProbeScopeSamples(frame.samples))
+		self.replay_index += 1
+		if self.replay_index >= len(reader):
+			self.stop_replay()
+			return
+
+		# Keep the recorded spacing between frames, scaled by the replay speed
+		speed = REPLAY_SPEEDS[self.replay_speed_box.currentText()]
+		delay = 0
+		if speed is not None:
+			delay = (reader.timestamps[self.replay_index] - reader.timestamps[self.replay_index - 1]) / speed
+		self.replay_timer.start(max(0, int(delay * 1000)))
+
+	def stop_replay(self):
+		self.replay_timer.stop()
+		if self.replay_reader is not None:
+			self.replay_reader.close()
+			self.replay_reader = None
+		if self.live_adc is not None:
+			# Live frames are scaled with the front end settings again
+			self.adc_scale, self.adc_decimation = self.live_adc
+			self.live_adc = None
+		self.replayPushButton.setChecked(False)
 
-	def init_device(self):
-		self.serial_state = SerialState.Waiting_For_Reg_Response
+	def autorange_plot(self):
+		self.main_plot.autoRange()
 
-		self.Serial_Handel.write(ProbeScopeInterface.ProbeScopeSetVGA())
-		print("WroteVGA")
-		time.sleep(0.1)
+	def list_ports(self):
+		port_list = dict()
 
-		print("Finished waiting")
+		# add dummy NC entry
+		port_list[" - "] = None
+
+		# Probe-Scopes first
+		for port in sorted(self.port_scanner.ports(), key=lambda port: not port.probe_scope):
+			port_list[port.label] = port.device
+		return port_list
+
+	def fill_port_box(self, box, port_list, port=None):
+		# Refilling must not look like a selection, the current entry or the one of port stays selected
+		current = box.currentText()
+		if port is not None:
+			current = next((label for label, device in port_list.items() if device == port), current)
+		box.blockSignals(True)
+		box.clear()
+		box.addItems(list(port_list.keys()))
+		box.setCurrentIndex(max(box.findText(current), 0))
+		box.blockSignals(False)
+
+	def update_ports(self):
+		self.port_list = self.list_ports()
+		self.fill_port_box(self.Serial_Port_Box, self.port_list, self.connected_ports.get(0))
+
+	def update_device_ports(self):
+		self.device_port_list = self.list_ports()
+		self.fill_port_box(self.Device_Port_Box, self.device_port_list)
+
+	def ports_changed(self, added, removed):
+		for port in removed:
+			for index, device in list(self.connected_ports.items()):
+				if device == port.device:
+					print("{} unplugged, CH{} closed".format(port.label, index + 1))
+					self.devices[index].serial_io.close()
+		for port in added:
+			reconnect = [index for index, device in self.connected_ports.items() if device == port.device]
+			for index in reconnect:
+				print("{} plugged in again, reopening CH{}".format(port.label, index + 1))
+				self.open_device(index, port.device)
+			if port.probe_scope and not reconnect:
+				print("Found {}".format(port.label))
+		self.update_ports()
+		self.update_device_ports()
 
-		self.Serial_Handel.write(ProbeScopeInterface.ProbeScopeInitDAC())
-		print("WroteDAC")
+	def add_device(self):
+		port = self.device_port_list.get(self.Device_Port_Box.currentText())
+		if port is None:
+			return
+		if port in self.connected_ports.values():
+			print("{} is already open!".format(port))
+			return
+		if self.streamPushButton.isChecked():
+			print("Stop streaming to add a device!")
+			return
+		serial_port = serial.Serial()
+		serial_port.baudrate = self.Serial_Handel.baudrate
+		device = self.devices.add(serial_port)
+		# Same front end settings as the first device
+		for name in ("VGA", "DAC"):
+			value = self.register_map.get(name)
+			if value is not None:
+				device.register_map.set(name, value)
+		self.connected_ports[device.index] = port
+		self.open_device(device.index, port)
+		self.align_timer.start()
+
+	def open_device(self, index, port):
+		# Fresh device, everything set so far is written again, VGA and DAC init first, the GUI does not wait for it
+		future = self.devices[index].open(port)
+		future.add_done_callback(
+			lambda done: self.serial_signals.call_soon(lambda: self.device_opened(index, port, done)))
+		return future
+
+	def device_opened(self, index, port, future):
+		try:
+			future.result()
+		except (ProbeScopeTransactions.TransactionError, serial.SerialException) as e:
+			print("Failed to open {} as CH{}! {}".format(port, index + 1, e))
+			return
+		print("Opened {} as CH{}".format(port, index + 1))
+
+	def write_registers(self):
+		"""
+		Write what changed in the register map, all writes in flight at once
+
+		:return: future of the write responses
+		:rtype: concurrent.futures.Future
+		"""
+		future = self.devices[0].write_registers()
+		future.add_done_callback(lambda done: self.serial_signals.call_soon(lambda: self.registers_written(done)))
+		return future
+
+	def registers_written(self, future):
+		if not future.cancelled() and future.exception() is not None:
+			print("Register write failed: {}".format(future.exception()))
+
+	def read_registers(self):
+		# Shows what the device holds, e.g. after another program or a reset changed it
+		if not self.serial_io.is_open:
+			print("Serial handel closed, cannot read regs")
+			return None
+		future = self.devices[0].read_registers()
+		future.add_done_callback(lambda done: self.serial_signals.call_soon(lambda: self.registers_read(done)))
+		return future
+
+	def registers_read(self, future):
+		if future.cancelled():
+			return
+		if future.exception() is not None:
+			print("Register read failed: {}".format(future.exception()))
+			return
+		dac = self.register_map.get("DAC")
+		if dac is not None:
+			vgn1, _, _, offset = struct.unpack("<HHHH", dac)
+			self.VGN1_box.setText(str(vgn1))
+			self.Offset_box.setText(str(offset))
 
 	def selected_port(self):
 		selected_port = self.Serial_Port_Box.currentText()
 		print("Selected:" + selected_port)
 
-		if self.serial_lock.tryLock(2000):  # Wait 2 seconds
-			if selected_port is '' or self.port_list[selected_port] is None:
-				# Selected dummy object
-				self.Serial_Handel.close()
-				self.Serial_Handel.port = None
-			else:
-				self.Serial_Handel.port = self.port_list[selected_port]
-				self.Serial_Handel.open()
-				self.init_device()
-				print("Set Handel to {}".format(self.Serial_Handel))
-			self.serial_lock.unlock()
+		port = self.port_list.get(selected_port)
+		if port is None:
+			# Selected dummy object
+			self.connected_ports.pop(0, None)
+			self.serial_io.close()
 		else:
-			print("Failed to get serial port mutex!")
-			self.Serial_Port_Box.setCurrentIndex(0)
+			self.connected_ports[0] = port
+			self.open_device(0, port)
 
 	def set_regs(self):
 		if not all([self.VGN1_box.hasAcceptableInput(), self.Offset_box.hasAcceptableInput()]):
 			print("Invalid input! {}".format([self.VGN1_box.hasAcceptableInput(), self.VGN2_box.hasAcceptableInput(), self.VGN3_box.hasAcceptableInput(), self.Offset_box.hasAcceptableInput()]))
-		#if self.serial_state is not None:
-		#	print("Can't set values! {}".format(self.serial_state))
-		#	return
-		if self.serial_lock.tryLock(50):
-			if self.Serial_Handel.isOpen():
-				self.serial_state = SerialState.Waiting_For_Reg_Response
-				self.serial_state_timeout = time.time() + 2
-				print(ProbeScopeInterface.ProbeScopeSetDAC(int(self.VGN1_box.text()), int(self.VGN1_box.text()), int(self.VGN1_box.text()), int(self.Offset_box.text())))
-				self.Serial_Handel.write(ProbeScopeInterface.ProbeScopeSetDAC(int(self.VGN1_box.text()), int(self.VGN1_box.text()), int(self.VGN1_box.text()), int(self.Offset_box.text())))
-			else:
-				print("Serial handel closed, cannot set regs")
-			self.serial_lock.unlock()
+		if self.serial_io.is_open:
+			self.register_map.set("DAC", struct.pack("<HHHH", int(self.VGN1_box.text()), int(self.VGN1_box.text()), int(self.VGN1_box.text()), int(self.Offset_box.text())))
+			# Only the changed DAC words are sent, nothing at all when the settings did not change
+			self.write_registers()
 		else:
-			print("Failed to get serial lock! Cannot request samples!")
+			print("Serial handel closed, cannot set regs")
 
 
 	def create_control_group_box(self):
@@ -312,10 +947,59 @@ class WidgetGallery(QMainWindow):
 		self.auto_sample_timer.timeout.connect(self.auto_sample)
 		self.auto_sample_timer.setSingleShot(True)
 
+		self.streamPushButton = QPushButton("Stream")
+		self.streamPushButton.setDefault(True)
+		self.streamPushButton.setCheckable(True)
+		self.streamPushButton.clicked.connect(self.stream_sample)
+
+		in_flight_label = QLabel()
+		in_flight_label.setText("Requests in flight")
+
+		self.in_flight_box = QLineEdit("2")
+		self.in_flight_box.setValidator(QtGui.QIntValidator(1, 16))
+
+		self.push_check = QCheckBox("Push (triggered)")
+
+		self.blocks_check = QCheckBox("Block transfer")
+
+		self.stream_stats_timer = QtCore.QTimer()
+		self.stream_stats_timer.setInterval(250)
+		self.stream_stats_timer.timeout.connect(self.update_stream_stats)
+
+		self.telemetryPushButton = QPushButton("Telemetry")
+		self.telemetryPushButton.setCheckable(True)
+		self.telemetryPushButton.clicked.connect(self.toggle_telemetry)
+
+		export_telemetry = QPushButton("Export Telemetry")
+		export_telemetry.clicked.connect(self.export_telemetry)
+
+		self.telemetry_timer = QtCore.QTimer()
+		self.telemetry_timer.setInterval(500)
+		self.telemetry_timer.timeout.connect(self.update_telemetry)
+
+		self.recordPushButton = QPushButton("Record")
+		self.recordPushButton.setCheckable(True)
+		self.recordPushButton.clicked.connect(self.record)
+
+		self.replayPushButton = QPushButton("Replay")
+		self.replayPushButton.setCheckable(True)
+		self.replayPushButton.clicked.connect(self.replay)
+
+		self.replay_speed_box = QComboBox()
+		self.replay_speed_box.addItems(list(REPLAY_SPEEDS.keys()))
+
+		self.replay_timer = QtCore.QTimer()
+		self.replay_timer.timeout.connect(self.replay_next)
+		self.replay_timer.setSingleShot(True)
+
 		autoRange = QPushButton("Auto Range")
 		autoRange.setDefault(True)
 		autoRange.clicked.connect(self.autorange_plot)
 
+		self.autosetPushButton = QPushButton("Autoset Gain")
+		self.autosetPushButton.setCheckable(True)
+		self.autosetPushButton.clicked.connect(self.autoset)
+
 		VGN1_label = QLabel()
 		VGN1_label.setText("VGN1-3")
 
@@ -328,20 +1012,131 @@ class WidgetGallery(QMainWindow):
 		self.Offset_box = QLineEdit()
 		self.Offset_box.setValidator(QtGui.QIntValidator(0, 2 ** 12))
 
+		self.persistencePushButton = QPushButton("Persistence")
+		self.persistencePushButton.setCheckable(True)
+		self.persistencePushButton.clicked.connect(self.toggle_persistence)
+
+		decay_label = QLabel()
+		decay_label.setText("Decay (1 = infinite)")
+
+		self.decay_box = QLineEdit("0.9")
+		self.decay_box.setValidator(QtGui.QDoubleValidator(0, 1, 3))
+
+		clear_persistence = QPushButton("Clear Persistence")
+		clear_persistence.clicked.connect(self.clear_persistence)
+
+		self.fftPushButton = QPushButton("FFT")
+		self.fftPushButton.setCheckable(True)
+		self.fftPushButton.clicked.connect(self.toggle_spectrum)
+
+		fft_average_label = QLabel()
+		fft_average_label.setText("FFT averages")
+
+		self.fft_average_box = QLineEdit("1")
+		self.fft_average_box.setValidator(QtGui.QIntValidator(1, 1000))
+
+		trigger_label = QLabel()
+		trigger_label.setText("Trigger")
+
+		self.trigger_mode_box = QComboBox()
+		self.trigger_mode_box.addItems(list(TRIGGER_MODES.keys()))
+		self.trigger_mode_box.currentIndexChanged.connect(self.apply_trigger)
+
+		self.trigger_level_box = QLineEdit("0")
+		self.trigger_level_box.setPlaceholderText("Level (V)")
+		self.trigger_level_box.setValidator(QtGui.QDoubleValidator())
+
+		self.trigger_hysteresis_box = QLineEdit("0.02")
+		self.trigger_hysteresis_box.setPlaceholderText("Hysteresis (V)")
+		self.trigger_hysteresis_box.setValidator(QtGui.QDoubleValidator(0, 10, 4))
+
+		self.trigger_min_width_box = QLineEdit()
+		self.trigger_min_width_box.setPlaceholderText("Min width (samples)")
+		self.trigger_min_width_box.setValidator(QtGui.QIntValidator(0, 2 ** 31 - 1))
+
+		self.trigger_max_width_box = QLineEdit()
+		self.trigger_max_width_box.setPlaceholderText("Max width (samples)")
+		self.trigger_max_width_box.setValidator(QtGui.QIntValidator(0, 2 ** 31 - 1))
+
+		self.trigger_runt_box = QLineEdit()
+		self.trigger_runt_box.setPlaceholderText("Runt high (V)")
+		self.trigger_runt_box.setValidator(QtGui.QDoubleValidator())
+
+		set_trigger = QPushButton("Set Trigger")
+		set_trigger.clicked.connect(self.apply_trigger)
+
+		self.dspPushButton = QPushButton("DSP")
+		self.dspPushButton.setCheckable(True)
+		self.dspPushButton.clicked.connect(self.toggle_dsp)
+
+		self.dsp_average_box = QLineEdit("1")
+		self.dsp_average_box.setPlaceholderText("Average frames")
+		self.dsp_average_box.setValidator(QtGui.QIntValidator(1, 1000))
+
+		self.dsp_boxcar_box = QLineEdit("1")
+		self.dsp_boxcar_box.setPlaceholderText("Boxcar width")
+		self.dsp_boxcar_box.setValidator(QtGui.QIntValidator(1, 4096))
+
+		self.dsp_hires_check = QCheckBox("High resolution")
+
+		self.dsp_cutoff_box = QLineEdit("1")
+		self.dsp_cutoff_box.setPlaceholderText("Low-pass cutoff (x Nyquist)")
+		self.dsp_cutoff_box.setValidator(QtGui.QDoubleValidator(0.001, 1, 3))
+
+		self.dsp_decimate_box = QLineEdit("1")
+		self.dsp_decimate_box.setPlaceholderText("Decimate")
+		self.dsp_decimate_box.setValidator(QtGui.QIntValidator(1, 4096))
+
 		flush_reg = QPushButton("Flush Settings")
 		flush_reg.setDefault(True)
 		flush_reg.clicked.connect(self.set_regs)
 
+		read_reg = QPushButton("Read Settings")
+		read_reg.clicked.connect(self.read_registers)
+
 
 		layout = QVBoxLayout()
 		layout.addWidget(updatePushButton)
 		layout.addWidget(self.autoPushButton)
+		layout.addWidget(self.streamPushButton)
+		layout.addWidget(in_flight_label)
+		layout.addWidget(self.in_flight_box)
+		layout.addWidget(self.push_check)
+		layout.addWidget(self.blocks_check)
+		layout.addWidget(self.telemetryPushButton)
+		layout.addWidget(export_telemetry)
+		layout.addWidget(self.recordPushButton)
+		layout.addWidget(self.replayPushButton)
+		layout.addWidget(self.replay_speed_box)
 		layout.addWidget(autoRange)
+		layout.addWidget(self.autosetPushButton)
 		layout.addWidget(VGN1_label)
 		layout.addWidget(self.VGN1_box)
 		layout.addWidget(Offset_label)
 		layout.addWidget(self.Offset_box)
 		layout.addWidget(flush_reg)
+		layout.addWidget(read_reg)
+		layout.addWidget(self.persistencePushButton)
+		layout.addWidget(decay_label)
+		layout.addWidget(self.decay_box)
+		layout.addWidget(clear_persistence)
+		layout.addWidget(self.fftPushButton)
+		layout.addWidget(fft_average_label)
+		layout.addWidget(self.fft_average_box)
+		layout.addWidget(self.dspPushButton)
+		layout.addWidget(self.dsp_average_box)
+		layout.addWidget(self.dsp_boxcar_box)
+		layout.addWidget(self.dsp_hires_check)
+		layout.addWidget(self.dsp_cutoff_box)
+		layout.addWidget(self.dsp_decimate_box)
+		layout.addWidget(trigger_label)
+		layout.addWidget(self.trigger_mode_box)
+		layout.addWidget(self.trigger_level_box)
+		layout.addWidget(self.trigger_hysteresis_box)
+		layout.addWidget(self.trigger_min_width_box)
+		layout.addWidget(self.trigger_max_width_box)
+		layout.addWidget(self.trigger_runt_box)
+		layout.addWidget(set_trigger)
 		layout.addStretch(1)
 		self.ControlGroupBox.setLayout(layout)
 
@@ -1,8 +1,15 @@
+import collections
 import struct
-import warnings
+
+import numpy as np
+
+from telemetry import telemetry
 
 # Probe Scope
 
+ADC_STEP = 0.004
+ADC_SAMPLE_RATE = 250000000
+
 # Global message symbols
 START_OF_MESSAGE = 0x1E
 END_OF_MESSAGE = 0x04
@@ -18,6 +25,8 @@ REQUEST_SAMPLE_DATA = 0x73
 TRIGGERED_COMMAND = 0x74
 WRITE_REGISTERS = 0x77
 READ_REGISTERS = 0x72
+# Like REQUEST_SAMPLE_DATA, the sample data comes in chunks separated by unescaped END_OF_BLOCK
+REQUEST_SAMPLE_BLOCKS = 0x62
 
 SAMPLE_DATA_LENGTH = 0x4C
 SAMPLE_DATA_FIELD_INDICATOR = 0x44
@@ -26,17 +35,78 @@ LENGTH_FIELD_INDICATOR = 0x4C
 DATA_FIELD_INDICATOR = 0x44
 ADDRESS_FIELD_INDICATOR = 0x41
 
-# Commands to send
-REQUEST_SAMPLE_DATA_COMMAND = [START_OF_MESSAGE, COMMAND_MESSAGE, REQUEST_SAMPLE_DATA, END_OF_MESSAGE]
-
-
-class ParserWarning(UserWarning):
-	pass
+# Commands to send, pre-serialized so writes need no conversion
+REQUEST_SAMPLE_DATA_COMMAND = bytes([START_OF_MESSAGE, COMMAND_MESSAGE, REQUEST_SAMPLE_DATA, END_OF_MESSAGE])
+TRIGGERED_SAMPLE_COMMAND = bytes([START_OF_MESSAGE, COMMAND_MESSAGE, TRIGGERED_COMMAND, END_OF_MESSAGE])
+REQUEST_SAMPLE_BLOCKS_COMMAND = bytes([START_OF_MESSAGE, COMMAND_MESSAGE, REQUEST_SAMPLE_BLOCKS, END_OF_MESSAGE])
+
+# Escaping tables
+ESCAPED_CHARS = bytes([ESCAPE_CHAR, START_OF_MESSAGE, END_OF_MESSAGE, END_OF_BLOCK])
+ESCAPE_TABLE = np.zeros(256, dtype=bool)
+ESCAPE_TABLE[list(ESCAPED_CHARS)] = True
+ESCAPE_VECTORIZE_MIN = 256  # Below this many bytes a plain loop is cheaper than the numpy setup
+
+# Longest message kept while waiting for its END_OF_MESSAGE, in received bytes, or for an END_OF_BLOCK in a block
+# transfer
+MAX_MESSAGE_LENGTH = 1 << 22
+# Largest block transfer in samples, its array is allocated when the header arrives
+MAX_CAPTURE_LENGTH = 1 << 28
+
+# Reasons the parser drops bytes or messages, counted in ProbeScopeParser.errors
+ERROR_GARBAGE = "garbage"  # Bytes between messages, counted per byte
+ERROR_RESYNC = "resync"  # START_OF_MESSAGE inside a message, its END_OF_MESSAGE was lost
+ERROR_OVERFLOW = "overflow"  # No END_OF_MESSAGE within MAX_MESSAGE_LENGTH
+ERROR_TRUNCATED = "truncated"  # Too short for its header
+ERROR_BAD_FIELD = "bad_field"  # Field indicator not where the format has it
+ERROR_LENGTH = "length"  # Received length differs from the length field
+ERROR_UNKNOWN = "unknown"  # Unknown message, command or response type
 
 
 class ProbeScopeSamples(object):
 	def __init__(self, samples):
-		self.samples = [-256 + s if s > 127 else s for s in samples]
+		self.timeline = None  # Stage timestamps, see telemetry.STAGES
+		self.timestamp = None  # Host clock time of the capture, set by ProbeScopeDevices
+		if isinstance(samples, np.ndarray):
+			self.samples = samples.view(np.int8)
+			return
+		if not isinstance(samples, (bytes, bytearray, memoryview)):
+			samples = bytes(samples)
+		# Signed view over the received bytes, no per sample conversion
+		self.samples = np.frombuffer(samples, dtype=np.int8)
+
+
+class ProbeScopeSampleBlock(object):
+	"""
+	Block transfer in progress, handed out after every chunk
+
+	The whole capture is allocated once from the length field and every chunk is decoded straight into it, the final
+	ProbeScopeSamples is a view of the same array. Samples past received are not set yet.
+	"""
+
+	def __init__(self, command, length):
+		self.command = command
+		self.buffer = np.empty(length, dtype=np.uint8)
+		self.received = 0
+
+	def __len__(self):
+		return len(self.buffer)
+
+	@property
+	def samples(self):
+		return self.buffer[:self.received].view(np.int8)
+
+	def write(self, chunk):
+		"""
+		:return: False when the chunk does not fit the declared length
+		"""
+		if isinstance(chunk, (bytes, bytearray)):
+			chunk = np.frombuffer(chunk, dtype=np.uint8)
+		end = self.received + len(chunk)
+		if end > len(self.buffer):
+			return False
+		self.buffer[self.received:end] = chunk
+		self.received = end
+		return True
 
 
 class ProbeScopeWriteResponse(object):
@@ -57,7 +127,20 @@ class ProbeScopeTriggered(object):
 
 
 class ProbeScopeParser(object):
-	def __init__(self):
+	"""
+	Decodes the byte stream into messages
+
+	Corrupted input never raises or prints, bytes between messages are skipped to the next START_OF_MESSAGE and
+	malformed messages are dropped, each counted in errors under one of the ERROR_ reason codes.
+
+	Sample data of a block transfer is split by END_OF_BLOCK, each chunk is written into the capture's array as it
+	arrives and a ProbeScopeSampleBlock reports the progress, so only the latest chunk is buffered.
+
+	:param max_message: Longest message or chunk in received bytes, longer ones are dropped as overflow
+	:param max_capture: Largest block transfer in samples
+	"""
+
+	def __init__(self, max_message=MAX_MESSAGE_LENGTH, max_capture=MAX_CAPTURE_LENGTH):
 		self.packet_dict = {
 			COMMAND_MESSAGE: self.parse_command,
 			COMMAND_RESULT: self.parse_response
@@ -66,6 +149,7 @@ class ProbeScopeParser(object):
 		self.command_result_dict = {
 			REQUEST_SAMPLE_DATA: self.parse_sample_response,
 			TRIGGERED_COMMAND: self.parse_sample_response,  # same message as a response
+			REQUEST_SAMPLE_BLOCKS: self.parse_sample_response,  # a block transfer that fit one chunk
 			WRITE_REGISTERS: self.parse_write_reg_response,
 			READ_REGISTERS: self.parse_read_reg_response
 		}
@@ -74,70 +158,121 @@ class ProbeScopeParser(object):
 			TRIGGERED_COMMAND: self.parse_triggered
 		}
 
+		self.max_message = max_message
+		self.max_capture = max_capture
+		self.errors = collections.Counter()
+		self.reset()
+
+	def reset(self):
+		"""
+		Forget any partial message, e.g. when the port is reopened, the limits and error counters are kept
+		"""
 		self.receiving_message = False
 		self.escape_char = False
 		self.char_buff = list()
+		self.block = None  # Block transfer in progress
+
+		# Bulk decoder state (see feed), raw bytes of the current partial message
+		self.feed_in_message = False
+		self.feed_buff = bytearray()
+		self.feed_escape_pending = False
+
+	def drop(self, reason, n=1):
+		# Counted, never printed, so a noisy link costs no more than a clean one
+		self.errors[reason] += n
+		telemetry.count("parser_" + reason, n)
+		self.char_buff = list()
+		self.block = None
+		return None
+
+	def parse_block(self):
+		"""
+		Take the chunk in char_buff, the first chunk of a transfer starts with the sample response header
+
+		:return: the transfer's ProbeScopeSampleBlock, None if it was dropped
+		"""
+		chunk = self.char_buff
+		if self.block is None:
+			if len(chunk) < 8:
+				return self.drop(ERROR_TRUNCATED)
+			if chunk[0] != COMMAND_RESULT or chunk[1] not in (REQUEST_SAMPLE_BLOCKS, TRIGGERED_COMMAND) or \
+					chunk[2] != SAMPLE_DATA_LENGTH or chunk[7] != SAMPLE_DATA_FIELD_INDICATOR:
+				return self.drop(ERROR_BAD_FIELD)
+			num_samples = int.from_bytes(chunk[3:7], byteorder='little')
+			if num_samples > self.max_capture:
+				return self.drop(ERROR_LENGTH)
+			self.block = ProbeScopeSampleBlock(chunk[1], num_samples)
+			chunk = chunk[8:]
+		if not self.block.write(chunk):
+			return self.drop(ERROR_LENGTH)
+		self.char_buff = list()
+		return self.block
+
+	def finish_block(self):
+		block = self.parse_block()
+		if block is None:
+			return None
+		self.block = None
+		if block.received != len(block):
+			return self.drop(ERROR_LENGTH)
+		return ProbeScopeSamples(block.buffer)
 
 	def parse_sample_response(self):
-		if self.char_buff[2] != SAMPLE_DATA_LENGTH:
-			warnings.warn("Warning Sample Data Length Field Indicator invalid! {}".format(self.char_buff),
-						  ParserWarning)
-		if self.char_buff[7] != SAMPLE_DATA_FIELD_INDICATOR:
-			warnings.warn("Warning Sample Data Field Indicator invalid! {}".format(self.char_buff),
-						  ParserWarning)
+		if len(self.char_buff) < 8:
+			return self.drop(ERROR_TRUNCATED)
+		if self.char_buff[2] != SAMPLE_DATA_LENGTH or self.char_buff[7] != SAMPLE_DATA_FIELD_INDICATOR:
+			return self.drop(ERROR_BAD_FIELD)
 
-		num_samples = int.from_bytes(self.char_buff[3:6], byteorder='little')
+		num_samples = int.from_bytes(self.char_buff[3:7], byteorder='little')
 
 		if len(self.char_buff) - 8 != num_samples:
-			warnings.warn(
-				"Warning {} samples not the same as indicated {}".format(len(self.char_buff) - 8, num_samples),
-				ParserWarning)
+			return self.drop(ERROR_LENGTH)
 
 		samples = self.char_buff[8:]
 		self.char_buff = list()
 		return ProbeScopeSamples(samples)
 
 	def parse_write_reg_response(self):
-		print(bytes(self.char_buff[3:7]))
-		ret = ProbeScopeWriteResponse(struct.unpack("<I", bytes(self.char_buff[3:7])))
+		if len(self.char_buff) != 7:
+			return self.drop(ERROR_TRUNCATED if len(self.char_buff) < 7 else ERROR_LENGTH)
+		ret = ProbeScopeWriteResponse(struct.unpack("<I", bytes(self.char_buff[3:7]))[0])
 		self.char_buff = list()
 		return ret
 
 	def parse_read_reg_response(self):
-		data_len = struct.unpack("<I", self.char_buff[4:8])
+		if len(self.char_buff) < 10:
+			return self.drop(ERROR_TRUNCATED)
+		data_len = struct.unpack("<I", bytes(self.char_buff[4:8]))[0]
 		if len(self.char_buff) != data_len + 10:
-			warnings.warn("Returned less data then they said they would! {} vs the stated {}".format(data_len, len(
-				self.char_buff) - 10), ParserWarning)
-		ret = ProbeScopeReadResponse(self.char_buff[9:-1])
+			return self.drop(ERROR_LENGTH)
+		ret = ProbeScopeReadResponse(bytes(self.char_buff[9:-1]))
 		self.char_buff = list()
 		return ret
 
 	def parse_response(self):
-		try:
-			return self.command_result_dict[self.char_buff[1]]()
-		except KeyError:
-			warnings.warn("Unknown command response {}".format(self.char_buff), ParserWarning)
-			self.char_buff = list()
-			return None
+		parse = self.command_result_dict.get(self.char_buff[1]) if len(self.char_buff) > 1 else None
+		if parse is None:
+			return self.drop(ERROR_UNKNOWN if len(self.char_buff) > 1 else ERROR_TRUNCATED)
+		return parse()
 
 	def parse_command(self):
-		try:
-			return self.command_dict[self.char_buff[1]]()
-		except KeyError:
-			warnings.warn("Unknown command {}".format(self.char_buff), ParserWarning)
-			self.char_buff = list()
-			return None
+		parse = self.command_dict.get(self.char_buff[1]) if len(self.char_buff) > 1 else None
+		if parse is None:
+			return self.drop(ERROR_UNKNOWN if len(self.char_buff) > 1 else ERROR_TRUNCATED)
+		return parse()
 
 	def parse_triggered(self):
 		return ProbeScopeTriggered()
 
 	def parse_message(self):
-		try:
-			return self.packet_dict[self.char_buff[0]]()
-		except KeyError:
-			warnings.warn("Unknown message format {}".format(self.char_buff), ParserWarning)
-			self.char_buff = list()
+		if self.block is not None:
+			return self.finish_block()
+		if len(self.char_buff) == 0:
 			return None
+		parse = self.packet_dict.get(self.char_buff[0])
+		if parse is None:
+			return self.drop(ERROR_UNKNOWN)
+		return parse()
 
 	def read_char(self, char):
 		if not self.receiving_message:
@@ -145,7 +280,8 @@ class ProbeScopeParser(object):
 				self.receiving_message = True
 			else:
 				self.escape_char = False
-				warnings.warn("Unexpected char between messages! {}".format(char), ParserWarning)
+				self.errors[ERROR_GARBAGE] += 1
+				telemetry.count("parser_" + ERROR_GARBAGE)
 		else:
 			if self.escape_char:
 				self.char_buff.append(char)
@@ -155,10 +291,132 @@ class ProbeScopeParser(object):
 			elif char == END_OF_MESSAGE:
 				self.receiving_message = False
 				return self.parse_message()
+			elif char == END_OF_BLOCK:
+				block = self.parse_block()
+				if block is None:
+					self.receiving_message = False
+				return block
+			elif char == START_OF_MESSAGE:
+				# Start over on the new message
+				self.drop(ERROR_RESYNC)
+			elif len(self.char_buff) >= self.max_message:
+				self.drop(ERROR_OVERFLOW)
+				self.receiving_message = False
 			else:
 				self.char_buff.append(char)
 		return None
 
+	def feed(self, buffer):
+		"""
+		Decode a whole buffer of received bytes at once
+
+		Message boundaries and escapes are found with vectorized scans instead of a call per char. Partial messages are
+		kept between calls, so buffers can be split anywhere. Do not mix with read_char on the same parser.
+
+		:param buffer: Bytes read from the serial port
+		:type buffer: bytes
+		:return: Parsed messages, in the order they were received
+		:rtype: list
+		"""
+		results = list()
+		data = self.feed_buff
+		scan_from = len(data)  # Only the partial message is kept, and it has been scanned already
+		data.extend(buffer)
+		data_len = len(data)
+		if scan_from == data_len:
+			return results
+
+		arr = np.frombuffer(data[scan_from:], dtype=np.uint8)
+		escaping = None
+		escaped = None
+		if self.feed_escape_pending:
+			escaping = _escaping_mask(np.concatenate(([ESCAPE_CHAR], arr)))
+			escaped = escaping[:-1]
+			escaping = escaping[1:]
+		elif ESCAPE_CHAR in buffer:
+			escaping = _escaping_mask(arr)
+			escaped = np.zeros(len(arr), dtype=bool)
+			escaped[1:] = escaping[:-1]
+		# Any START_OF_MESSAGE opens a message, like read_char, only unescaped ones interrupt one
+		starts_any = np.flatnonzero(arr == START_OF_MESSAGE)
+		# Messages and the chunks of block transfers both end at these
+		ends = (arr == END_OF_MESSAGE) | (arr == END_OF_BLOCK)
+		if escaped is None:
+			ends = np.flatnonzero(ends)
+			starts = starts_any
+		else:
+			ends = np.flatnonzero(ends & ~escaped)
+			starts = starts_any[~escaped[starts_any]]
+		ends += scan_from
+		starts = starts + scan_from
+		starts_any += scan_from
+
+		in_message = self.feed_in_message
+		start = 0
+		pos = scan_from
+		while pos < data_len:
+			if not in_message:
+				# Resync, skip to the next START_OF_MESSAGE in one search
+				i = np.searchsorted(starts_any, pos)
+				if i == len(starts_any):
+					self.drop(ERROR_GARBAGE, data_len - pos)
+					start = pos = data_len
+					break
+				start_of_message = int(starts_any[i])
+				if start_of_message > pos:
+					self.drop(ERROR_GARBAGE, start_of_message - pos)
+				in_message = True
+				start = pos = start_of_message + 1
+
+			i = np.searchsorted(ends, pos)
+			end_of_message = int(ends[i]) if i < len(ends) else data_len
+			j = np.searchsorted(starts, pos)
+			if j < len(starts) and starts[j] < end_of_message:
+				self.drop(ERROR_RESYNC)
+				in_message = False
+				pos = int(starts[j])
+				continue
+			if i == len(ends):
+				break
+			end_of_block = data[end_of_message] == END_OF_BLOCK
+			in_message = end_of_block
+
+			if start < scan_from:
+				message = ProbeScopeUnescapeBytes(data[start:end_of_message])
+			elif escaping is None:
+				message = data[start:end_of_message]
+			else:
+				body = slice(start - scan_from, end_of_message - scan_from)
+				message = bytearray(arr[body][~escaping[body]].tobytes())
+			start = pos = end_of_message + 1
+
+			if end_of_block:
+				self.char_buff = message
+				res = self.parse_block()
+				if res is None:
+					in_message = False  # Dropped, skip the rest of the transfer
+				elif not results or results[-1] is not res:
+					results.append(res)
+			elif len(message) > 0 or self.block is not None:
+				self.char_buff = message
+				res = self.parse_message()
+				if res is not None:
+					results.append(res)
+
+		if in_message and data_len - start > self.max_message:
+			# END_OF_MESSAGE never came, drop it rather than grow without bound
+			self.drop(ERROR_OVERFLOW)
+			in_message = False
+
+		self.feed_in_message = in_message
+		if in_message:
+			self.feed_escape_pending = escaping is not None and bool(escaping[-1])
+			del data[:start]
+		else:
+			self.feed_escape_pending = False
+			del data[:]
+		return results
+
 
 def ProbeScopeRegisterWrite(data_address, data):
 	"""
@@ -171,54 +429,91 @@ def ProbeScopeRegisterWrite(data_address, data):
 	:return: regester write command
 	:rtype: bytearray
 	"""
-	data = bytearray(data)
-	data_len = len(data)
-
-	output = bytearray()
-	output.extend([
-		START_OF_MESSAGE,
-		COMMAND_MESSAGE,
-		WRITE_REGISTERS
-	])
-	output.append(ADDRESS_FIELD_INDICATOR)
-	output.extend(ProbeScopeEscapeBytes(struct.pack("<I", data_address)))
-	output.append(LENGTH_FIELD_INDICATOR)
-	output.extend(ProbeScopeEscapeBytes(struct.pack("<I", data_len)))
-	output.append(DATA_FIELD_INDICATOR)
-	output.extend(ProbeScopeEscapeBytes(data))
-	output.append(END_OF_MESSAGE)
-
-	return output
+	data = bytes(data)
 
+	# One allocation for the whole frame
+	return bytearray().join((
+		REGISTER_WRITE_HEADER,
+		ProbeScopeEscapeBytes(struct.pack("<I", data_address)),
+		LENGTH_FIELD,
+		ProbeScopeEscapeBytes(struct.pack("<I", len(data))),
+		DATA_FIELD,
+		ProbeScopeEscapeBytes(data),
+		END_FIELD
+	))
 
-def ProbeScopeRegisterRead(address, len):
-	output = bytearray()
-	output.extend([
-		START_OF_MESSAGE,
-		COMMAND_MESSAGE,
-		READ_REGISTERS,
-	])
-	output.append(ADDRESS_FIELD_INDICATOR)
-	output.extend(ProbeScopeEscapeBytes(struct.pack("<I", address)))
-	output.append(LENGTH_FIELD_INDICATOR)
-	output.extend(ProbeScopeEscapeBytes(struct.pack("<I", len)))
-	output.append(END_OF_MESSAGE)
 
-	return output
+def ProbeScopeRegisterRead(address, len):
+	return bytearray().join((
+		REGISTER_READ_HEADER,
+		ProbeScopeEscapeBytes(struct.pack("<I", address)),
+		LENGTH_FIELD,
+		ProbeScopeEscapeBytes(struct.pack("<I", len)),
+		END_FIELD
+	))
 
 
 def ProbeScopeEscapeBytes(data):
-	out = bytearray()
-	for d in data:
-		if d in [ESCAPE_CHAR, START_OF_MESSAGE, END_OF_MESSAGE, END_OF_BLOCK]:
-			out.extend(bytes([ESCAPE_CHAR, d]))
-		else:
-			out.extend(bytes([d]))
-	return out
+	"""
+	Escape every byte that would be taken for a message symbol
+
+	:param data: Bytes or byte like things
+	:return: escaped data
+	:rtype: bytearray
+	"""
+	if not isinstance(data, (bytes, bytearray)):
+		data = bytes(data)
+
+	if len(data) < ESCAPE_VECTORIZE_MIN:
+		output = bytearray()
+		for b in data:
+			if b in ESCAPED_CHARS:
+				output.append(ESCAPE_CHAR)
+			output.append(b)
+		return output
+
+	# Fast path, most sample payloads contain nothing to escape
+	if not any(char in data for char in ESCAPED_CHARS):
+		return bytearray(data)
+
+	arr = np.frombuffer(data, dtype=np.uint8)
+	escape = ESCAPE_TABLE[arr]
+	# Every byte moves right by the number of escapes inserted up to and including it
+	positions = np.arange(len(arr)) + np.cumsum(escape)
+	out = np.empty(len(arr) + int(positions[-1] - len(arr) + 1), dtype=np.uint8)
+	out[positions] = arr
+	out[positions[escape] - 1] = ESCAPE_CHAR
+	return bytearray(out.tobytes())
+
+
+def ProbeScopeUnescapeBytes(data):
+	"""
+	Remove escape chars from the body of one message
+
+	:param data: Message body between START_OF_MESSAGE and END_OF_MESSAGE
+	:type data: bytearray
+	:return: unescaped message body
+	:rtype: bytearray
+	"""
+	if ESCAPE_CHAR not in data:
+		return data
+
+	arr = np.frombuffer(data, dtype=np.uint8)
+	return bytearray(arr[~_escaping_mask(arr)].tobytes())
+
+
+def _escaping_mask(arr):
+	# Within a run of escape chars every other one escapes the next char
+	is_escape = arr == ESCAPE_CHAR
+	index = np.arange(len(arr))
+	run_starts = is_escape.copy()
+	run_starts[1:] &= ~is_escape[:-1]
+	run_start = np.maximum.accumulate(np.where(run_starts, index, 0))
+	return is_escape & ((index - run_start) % 2 == 0)
 
 
 def ProbeScopeInitDAC():
-	return ProbeScopeRegisterWrite(0x4000, b'\xAA')
+	return INIT_DAC_COMMAND
 
 
 def ProbeScopeSetDAC(a, b, c, d):
@@ -226,7 +521,19 @@ def ProbeScopeSetDAC(a, b, c, d):
 
 
 def ProbeScopeSetVGA():
-	return ProbeScopeRegisterWrite(0x3000, bytearray([0, 1]))
+	return SET_VGA_COMMAND
+
+
+# Fixed parts of the command frames
+REGISTER_WRITE_HEADER = bytes([START_OF_MESSAGE, COMMAND_MESSAGE, WRITE_REGISTERS, ADDRESS_FIELD_INDICATOR])
+REGISTER_READ_HEADER = bytes([START_OF_MESSAGE, COMMAND_MESSAGE, READ_REGISTERS, ADDRESS_FIELD_INDICATOR])
+LENGTH_FIELD = bytes([LENGTH_FIELD_INDICATOR])
+DATA_FIELD = bytes([DATA_FIELD_INDICATOR])
+END_FIELD = bytes([END_OF_MESSAGE])
+
+# Constant commands, serialized once
+INIT_DAC_COMMAND = bytes(ProbeScopeRegisterWrite(0x4000, b'\xAA'))
+SET_VGA_COMMAND = bytes(ProbeScopeRegisterWrite(0x3000, bytearray([0, 1])))
 
 if __name__ == '__main__':
 	test_samples_arr = [0x1E, 0x52, 0x73, 0x4C, 0x0A, 0x00, 0x00, 0x00, 0x44, 0x01, 0x02, 0x03, 0x0F, 0x05, 0x06, 0x07,
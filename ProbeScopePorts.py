@@ -0,0 +1,147 @@
+import threading
+
+import serial.tools.list_ports
+
+# USB (vid, pid) pairs a Probe-Scope enumerates with, checked first, add a device's IDs to identify it by them
+PROBE_SCOPE_USB_IDS = set()
+# Fallback for ports without a known ID, the CDC ACM driver Windows binds to the Probe-Scope reports this manufacturer
+PROBE_SCOPE_MANUFACTURER = "Microsoft"
+
+
+class PortInfo(object):
+	"""
+	What is known about a serial port without opening it
+
+	probe_scope is True for a port whose USB IDs are in usb_ids. Ports with other or no IDs fall back to a guess from the
+	manufacturer string, as the port list always made it, such a port is not identified as a Probe-Scope until it
+	answers.
+
+	:param port: serial.tools.list_ports_common.ListPortInfo
+	:param usb_ids: (vid, pid) pairs of Probe-Scopes
+	"""
+
+	def __init__(self, port, usb_ids=PROBE_SCOPE_USB_IDS):
+		self.device = port.device
+		self.description = port.description
+		self.manufacturer = port.manufacturer  # None for ports that are not USB, and for some that are
+		self.vid = port.vid
+		self.pid = port.pid
+		self.serial_number = port.serial_number
+		if self.vid is not None and (self.vid, self.pid) in usb_ids:
+			self.probe_scope = True
+		else:
+			self.probe_scope = self.manufacturer is not None and PROBE_SCOPE_MANUFACTURER in self.manufacturer
+
+	@property
+	def label(self):
+		if self.probe_scope:
+			name = "Probe-Scope"
+		elif self.manufacturer is not None:
+			name = self.manufacturer
+		elif self.description and self.description != "n/a":
+			name = self.description
+		else:
+			name = "Serial port"
+		return "{} ({})".format(name, self.device)
+
+	def __eq__(self, other):
+		return isinstance(other, PortInfo) and (self.device, self.vid, self.pid, self.serial_number) == \
+			(other.device, other.vid, other.pid, other.serial_number)
+
+	def __hash__(self):
+		return hash((self.device, self.vid, self.pid, self.serial_number))
+
+
+class PortScanner(threading.Thread):
+	"""
+	Enumerates serial ports in the background and keeps the result, so nothing waits for the enumeration
+
+	Ports are listed every interval seconds and diffed with the last list, a port that was plugged in or removed since
+	is passed to callback(added, removed) on this thread. A port that was re-plugged with another device on the same
+	name is both removed and added, the USB IDs and serial number tell them apart. rescan lists again right away, e.g.
+	when a port list is about to be shown.
+
+	:param callback: Called with the lists of added and removed PortInfo, the first scan adds every port
+	:param interval: Seconds between scans, enumeration is cheap but not free on every platform
+	:param usb_ids: (vid, pid) pairs of Probe-Scopes, see PortInfo
+	"""
+
+	def __init__(self, callback=None, interval=1.0, usb_ids=PROBE_SCOPE_USB_IDS,
+				 list_ports=serial.tools.list_ports.comports):
+		threading.Thread.__init__(self, daemon=True)
+		self.callback = callback
+		self.interval = interval
+		self.usb_ids = usb_ids
+		self.list_ports = list_ports
+		self.known = dict()
+		self.lock = threading.Lock()
+		self.scanned = threading.Event()
+		self.wake = threading.Event()
+		self.stopped = threading.Event()
+
+		# Counters
+		self.scans = 0
+		self.errors = 0
+
+	def ports(self):
+		"""
+		:return: Ports of the last scan sorted by name, empty before the first one finished
+		:rtype: list
+		"""
+		with self.lock:
+			return sorted(self.known.values(), key=lambda port: port.device)
+
+	def probe_scopes(self):
+		return [port for port in self.ports() if port.probe_scope]
+
+	def scan(self):
+		"""
+		List the ports once, call from this thread or instead of starting it
+
+		:return: added and removed PortInfo
+		:rtype: tuple
+		"""
+		try:
+			found = {info.device: info for info in (PortInfo(port, self.usb_ids) for port in self.list_ports())}
+		except OSError:
+			self.errors += 1  # Ports come and go while they are listed, the next scan sees the result
+			return list(), list()
+		with self.lock:
+			added = [info for device, info in found.items() if self.known.get(device) != info]
+			removed = [info for device, info in self.known.items() if found.get(device) != info]
+			self.known = found
+			self.scans += 1
+		self.scanned.set()
+		if (added or removed) and self.callback is not None:
+			self.callback(added, removed)
+		return added, removed
+
+	def rescan(self):
+		self.wake.set()
+
+	def wait_scanned(self, timeout=None):
+		"""
+		Wait for the first scan, e.g. before looking for a device at startup
+
+		:return: False on timeout
+		"""
+		return self.scanned.wait(timeout)
+
+	def run(self):
+		while not self.stopped.is_set():
+			self.wake.clear()
+			self.scan()
+			self.wake.wait(self.interval)
+
+	def stop(self):
+		self.stopped.set()
+		self.wake.set()
+		if self.is_alive():
+			self.join()
+
+	def stats(self):
+		return {
+			"ports": len(self.known),
+			"scans": self.scans,
+			"errors": self.errors
+		}
@@ -0,0 +1,217 @@
+import mmap
+import os
+import queue
+import struct
+import threading
+
+import numpy as np
+
+import ProbeScopeInterface
+from telemetry import telemetry
+
+# File layout
+#   header
+#   frame records: FRAME_HEADER, register state bytes, int8 samples
+#   index: INDEX_DTYPE entry per frame
+#   trailer
+# Appending truncates the index and trailer and writes them again on close. A file that was not closed has no trailer,
+# its index is rebuilt by hopping from frame header to frame header.
+MAGIC = b"PSREC\x00\x00\x01"
+HEADER = struct.Struct("<8sdddI")  # magic, ADC_STEP, ADC_SAMPLE_RATE, adc_scale, adc_decimation
+FRAME_HEADER = struct.Struct("<dII")  # timestamp, number of samples, register state length
+TRAILER_MAGIC = b"PSINDEX\x00"
+TRAILER = struct.Struct("<QQ8s")  # index offset, frame count, magic
+INDEX_DTYPE = np.dtype([("offset", "<u8"), ("timestamp", "<f8")])
+
+
+class RecordingError(Exception):
+	pass
+
+
+class RecordingWriter(object):
+	"""
+	Append-only writer for Probe-Scope recordings
+
+	:param path: File to create, or to append to when it exists and append is set
+	:param adc_scale: Scale of the front end when recording
+	:param adc_decimation: Decimation of the ADC when recording
+	"""
+
+	def __init__(self, path, adc_scale=1, adc_decimation=1, append=False):
+		self.index = list()
+		if append and os.path.exists(path):
+			reader = RecordingReader(path)
+			self.adc_scale = reader.adc_scale
+			self.adc_decimation = reader.adc_decimation
+			self.index = [tuple(entry) for entry in reader.index]
+			end = reader.data_end
+			reader.close()
+			self.file = open(path, "r+b")
+			self.file.truncate(end)
+			self.file.seek(end)
+		else:
+			self.adc_scale = adc_scale
+			self.adc_decimation = adc_decimation
+			self.file = open(path, "wb")
+			self.file.write(HEADER.pack(MAGIC, ProbeScopeInterface.ADC_STEP, ProbeScopeInterface.ADC_SAMPLE_RATE,
+										adc_scale, adc_decimation))
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.close()
+
+	def __len__(self):
+		return len(self.index)
+
+	def append(self, timestamp, samples, registers=b""):
+		"""
+		:param timestamp: Host time the frame was received
+		:type timestamp: float
+		:param samples: Signed samples
+		:type samples: np.ndarray
+		:param registers: Register state the frame was captured with
+		:type registers: bytes
+		"""
+		samples = np.asarray(samples, dtype=np.int8)
+		self.index.append((self.file.tell(), timestamp))
+		self.file.write(FRAME_HEADER.pack(timestamp, len(samples), len(registers)))
+		self.file.write(registers)
+		self.file.write(samples.tobytes())
+
+	def close(self):
+		if self.file.closed:
+			return
+		index_offset = self.file.tell()
+		self.file.write(np.array(self.index, dtype=INDEX_DTYPE).tobytes())
+		self.file.write(TRAILER.pack(index_offset, len(self.index), TRAILER_MAGIC))
+		self.file.close()
+
+
+class RecordingFrame(object):
+	def __init__(self, timestamp, registers, samples):
+		self.timestamp = timestamp
+		self.registers = registers
+		self.samples = samples
+
+
+class RecordingReader(object):
+	"""
+	Memory mapped reader, any frame is reached in O(1) without reading the rest of the file
+
+	Samples are returned as np.int8 views into the mapping, copy them to keep them after close.
+	"""
+
+	def __init__(self, path):
+		self.file = open(path, "rb")
+		size = os.fstat(self.file.fileno()).st_size
+		if size < HEADER.size:
+			raise RecordingError("{} is too short to be a recording".format(path))
+		self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+		magic, self.adc_step, self.adc_sample_rate, self.adc_scale, self.adc_decimation = \
+			HEADER.unpack_from(self.map, 0)
+		if magic != MAGIC:
+			raise RecordingError("{} is not a Probe-Scope recording".format(path))
+
+		index_offset, count, trailer_magic = (0, 0, None)
+		if size >= HEADER.size + TRAILER.size:
+			index_offset, count, trailer_magic = TRAILER.unpack_from(self.map, size - TRAILER.size)
+		if trailer_magic == TRAILER_MAGIC:
+			self.index = np.frombuffer(self.map, dtype=INDEX_DTYPE, count=count, offset=index_offset)
+			self.data_end = index_offset
+		else:
+			self.index, self.data_end = self.rebuild_index(size)
+
+	def rebuild_index(self, size):
+		entries = list()
+		offset = HEADER.size
+		while offset + FRAME_HEADER.size <= size:
+			timestamp, num_samples, reg_len = FRAME_HEADER.unpack_from(self.map, offset)
+			end = offset + FRAME_HEADER.size + reg_len + num_samples
+			if end > size:
+				break  # Frame cut short
+			entries.append((offset, timestamp))
+			offset = end
+		return np.array(entries, dtype=INDEX_DTYPE), offset
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.close()
+
+	def __len__(self):
+		return len(self.index)
+
+	def __getitem__(self, i):
+		return self.frame(i)
+
+	@property
+	def timestamps(self):
+		return self.index["timestamp"]
+
+	def frame(self, i):
+		offset = int(self.index[i]["offset"])
+		timestamp, num_samples, reg_len = FRAME_HEADER.unpack_from(self.map, offset)
+		offset += FRAME_HEADER.size
+		registers = self.map[offset:offset + reg_len]
+		samples = np.frombuffer(self.map, dtype=np.int8, count=num_samples, offset=offset + reg_len)
+		return RecordingFrame(timestamp, registers, samples)
+
+	def close(self):
+		self.index = None
+		if self.map is not None:
+			try:
+				self.map.close()
+			except BufferError:
+				pass  # Frames handed out still view it, it is unmapped when the last of them goes away
+			self.map = None
+		self.file.close()
+
+
+class FrameWriter(threading.Thread):
+	"""
+	Writes frames to disk on its own thread so disk I/O never stalls the serial reader
+
+	Frames that do not fit in the queue are dropped and counted instead of blocking the caller.
+
+	:param registers: Stored after the register state of every frame, e.g. writes the register map does not track
+	"""
+
+	def __init__(self, path, registers=b"", adc_scale=1, adc_decimation=1, max_queued=1024):
+		threading.Thread.__init__(self, daemon=True)
+		self.path = path
+		self.registers = registers
+		self.adc_scale = adc_scale
+		self.adc_decimation = adc_decimation
+		self.frames = queue.Queue(max_queued)
+		self.written = 0
+		self.dropped = 0
+
+	def put(self, timestamp, samples, registers=b""):
+		"""
+		:type samples: ProbeScopeInterface.ProbeScopeSamples
+		:param registers: Register state the frame was captured with
+		:type registers: bytes
+		"""
+		try:
+			self.frames.put_nowait((timestamp, samples, registers))
+		except queue.Full:
+			self.dropped += 1
+			telemetry.count("writer_drops")
+
+	def stop(self):
+		self.frames.put(None)
+		self.join()
+
+	def run(self):
+		with RecordingWriter(self.path, self.adc_scale, self.adc_decimation) as recording:
+			while True:
+				frame = self.frames.get()
+				if frame is None:
+					return
+				timestamp, samples, registers = frame
+				recording.append(timestamp, samples.samples, registers + self.registers)
+				self.written += 1
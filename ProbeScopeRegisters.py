@@ -0,0 +1,218 @@
+import ProbeScopeInterface
+
+
+class RegisterRegion(object):
+	"""
+	Block of device registers
+
+	:param word: Registers are written in whole words of this many bytes, a changed byte writes its whole word
+	:param default: Value written on init, None to leave the region alone until it is set
+	:param action: Writing it makes the device do something rather than hold a value, it is written once per set and
+		never shadowed or read back
+	"""
+
+	def __init__(self, name, address, length, word=1, default=None, action=False):
+		if default is not None and len(default) != length:
+			raise ValueError("Default of {} is {} bytes, the region is {}!".format(name, len(default), length))
+		self.name = name
+		self.address = address
+		self.length = length
+		self.word = word
+		self.default = default
+		self.action = action
+
+	@property
+	def end(self):
+		return self.address + self.length
+
+	def __contains__(self, address):
+		return self.address <= address < self.end
+
+
+# Register map of the Probe-Scope
+REGISTER_REGIONS = (
+	# ADRF control word, see ADRF_Ctl.GetMessage
+	RegisterRegion("VGA", 0x3000, 2, default=bytes([0, 1])),
+	# Writing 0xAA initializes the DAC
+	RegisterRegion("DAC_INIT", 0x4000, 1, default=b'\xAA', action=True),
+	# Four little endian 16 bit DAC channels, VGN1, VGN2, VGN3 and offset
+	RegisterRegion("DAC", 0x4002, 8, word=2),
+)
+
+
+class RegisterMap(object):
+	"""
+	Host side shadow of the device registers
+
+	Values are staged with set, which coalesces repeated changes, and flush turns only the bytes that differ from the
+	shadow into write commands. Changed ranges closer than merge_gap bytes are merged into one WRITE_REGISTERS frame,
+	rewriting the known bytes in between, since every frame costs a round trip and its own header. The shadow holds
+	what was written or read back, after invalidate everything set is written again. Action regions such as DAC_INIT
+	are not state, a set one is written on the next flush and then forgotten, invalidate sets their defaults again.
+
+	:param merge_gap: Largest run of unchanged bytes rewritten to merge two changed ranges
+	"""
+
+	def __init__(self, regions=REGISTER_REGIONS, merge_gap=4):
+		self.regions = dict((region.name, region) for region in regions)
+		self.merge_gap = merge_gap
+		self.shadow = dict()  # Address to the byte the device holds
+		self.version = 0  # Bumped after every shadow change
+		self.snapshot_cache = (None, b"")
+		self.target = dict()  # Address to the byte it should hold, or to write once for actions
+		for region in regions:
+			if region.default is not None:
+				self.stage(region.address, region.default)
+
+	def is_state(self, address):
+		region = self.region_at(address)
+		return region is not None and not region.action
+
+	def region_at(self, address):
+		for region in self.regions.values():
+			if address in region:
+				return region
+		return None
+
+	def stage(self, address, data):
+		for offset, value in enumerate(bytes(data)):
+			self.target[address + offset] = value
+
+	def store(self, address, data):
+		for offset, value in enumerate(data):
+			if self.is_state(address + offset):
+				self.shadow[address + offset] = value
+			else:
+				self.target.pop(address + offset, None)  # Action done
+		self.version += 1
+
+	def set(self, address, data):
+		"""
+		Stage a register write, sent on the next flush
+
+		:param address: Register address, or region name
+		:param data: Bytes or byte like things, whole words of the region
+		"""
+		data = bytes(data)
+		if isinstance(address, str):
+			address = self.regions[address].address
+		region = self.region_at(address)
+		if region is None or address + len(data) > region.end:
+			raise ValueError("{} bytes at 0x{:04X} are not in the register map!".format(len(data), address))
+		if (address - region.address) % region.word or len(data) % region.word:
+			raise ValueError("{} is written in {} byte words!".format(region.name, region.word))
+		self.stage(address, data)
+
+	def get(self, name):
+		"""
+		:return: last known device value of a region, None where it is unknown
+		:rtype: bytes
+		"""
+		region = self.regions[name]
+		values = [self.shadow.get(address) for address in range(region.address, region.end)]
+		if None in values:
+			return None
+		return bytes(values)
+
+	def invalidate(self):
+		"""
+		Forget the device state, e.g. after a reconnect, the next flush writes everything that was set and the default
+		actions
+		"""
+		self.shadow.clear()
+		for region in self.regions.values():
+			if region.action and region.default is not None:
+				self.stage(region.address, region.default)
+		self.version += 1
+
+	def dirty_ranges(self):
+		"""
+		:return: (address, data) for every write needed, merged and in address order
+		:rtype: list
+		"""
+		dirty = set()
+		for address, value in self.target.items():
+			if self.shadow.get(address) != value:
+				region = self.region_at(address)
+				word_start = address - (address - region.address) % region.word
+				dirty.update(range(word_start, word_start + region.word))
+
+		ranges = list()
+		for address in sorted(dirty):
+			if ranges:
+				start, end = ranges[-1]
+				gap = range(end, address)
+				if len(gap) <= self.merge_gap and all(a in self.target or a in self.shadow for a in gap):
+					ranges[-1] = (start, address + 1)
+					continue
+			ranges.append((address, address + 1))
+
+		return [(start, bytes(self.target.get(a, self.shadow.get(a)) for a in range(start, end)))
+				for start, end in ranges]
+
+	def flush(self):
+		"""
+		Write commands for every change since the last flush, the shadow is updated as if all of them succeed
+
+		:return: ProbeScopeRegisterWrite commands, empty when nothing changed
+		:rtype: list
+		"""
+		commands = list()
+		for address, data in self.dirty_ranges():
+			commands.append(ProbeScopeInterface.ProbeScopeRegisterWrite(address, data))
+			self.store(address, data)
+		return commands
+
+	def snapshot(self):
+		"""
+		Write commands that restore every known register value, stored with every recorded frame
+
+		Cached until the shadow changes. Safe to call from the serial worker while another thread flushes, a snapshot
+		taken during a change is rebuilt on the next call.
+
+		:rtype: bytes
+		"""
+		version, snapshot = self.snapshot_cache
+		if version == self.version:
+			return snapshot
+		version = self.version
+		shadow = dict(self.shadow)  # Copied in one step
+		ranges = list()
+		for address in sorted(shadow):
+			if ranges and ranges[-1][0] + len(ranges[-1][1]) == address:
+				ranges[-1][1].append(shadow[address])
+			else:
+				ranges.append((address, bytearray([shadow[address]])))
+		snapshot = b"".join(ProbeScopeInterface.ProbeScopeRegisterWrite(address, data) for address, data in ranges)
+		self.snapshot_cache = (version, snapshot)
+		return snapshot
+
+	def read_ranges(self, names=None):
+		"""
+		:param names: Regions to read, all but the actions if None
+		:return: (address, length) of every read needed, adjoining regions share one read
+		:rtype: list
+		"""
+		if names is not None:
+			regions = [self.regions[name] for name in names]
+		else:
+			regions = [region for region in self.regions.values() if not region.action]
+		ranges = list()
+		for region in sorted(regions, key=lambda r: r.address):
+			if region.action:
+				raise ValueError("{} is an action, it can not be read back!".format(region.name))
+			# Only bytes of registers are read, a gap between regions is not merged over
+			if ranges and region.address == ranges[-1][0] + ranges[-1][1]:
+				ranges[-1] = (ranges[-1][0], region.end - ranges[-1][0])
+			else:
+				ranges.append((region.address, region.length))
+		return ranges
+
+	def update(self, address, data):
+		"""
+		Store read back values in the shadow, staged values that differ are written again on the next flush
+		"""
+		for offset, value in enumerate(bytes(data)):
+			if self.is_state(address + offset):
+				self.shadow[address + offset] = value
+		self.version += 1
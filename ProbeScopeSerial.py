@@ -0,0 +1,186 @@
+import concurrent.futures
+import queue
+import threading
+import time
+
+import serial
+
+import ProbeScopeInterface
+from telemetry import telemetry
+
+# Queued operations
+OP_WRITE = 0
+OP_OPEN = 1
+OP_CLOSE = 2
+
+# Commands answered by a frame, their send times are matched with the frames in telemetry
+SAMPLE_COMMANDS = (ProbeScopeInterface.REQUEST_SAMPLE_DATA_COMMAND, ProbeScopeInterface.TRIGGERED_SAMPLE_COMMAND,
+				   ProbeScopeInterface.REQUEST_SAMPLE_BLOCKS_COMMAND)
+
+
+class SerialWorker(threading.Thread):
+	"""
+	Single owner of a serial port, does all TX and RX on one thread
+
+	Other threads never touch the port, they put commands on a queue with send, which never blocks. Parsed messages are
+	passed to message_callback on the worker thread. An exception from message_callback is printed and counted, it
+	does not stop the worker.
+	"""
+	READ_TIMEOUT = 0.005  # Seconds a read blocks waiting for the first byte, bounds the TX latency
+	CLOSED_POLL = 0.05  # Seconds between checks while the port is closed
+
+	def __init__(self, serial_port, message_callback, parser=None):
+		threading.Thread.__init__(self, daemon=True)
+		self.serial_port = serial_port
+		self.serial_port.timeout = self.READ_TIMEOUT
+		self.message_callback = message_callback
+		self.parser = parser if parser is not None else ProbeScopeInterface.ProbeScopeParser()
+
+		self.tx_queue = queue.Queue()
+		self.tx_pending = threading.Event()
+		self.stopped = threading.Event()
+
+		# Counters
+		self.tx_messages = 0
+		self.tx_bytes = 0
+		self.tx_dropped = 0
+		self.tx_wait_total = 0.0
+		self.tx_wait_max = 0.0
+		self.max_queue_depth = 0
+		self.rx_bytes = 0
+		self.callback_errors = 0
+		self.first_byte_at = None  # When the message being received started to arrive
+
+	@property
+	def is_open(self):
+		return self.serial_port.is_open
+
+	@property
+	def queue_depth(self):
+		return self.tx_queue.qsize()
+
+	def enqueue(self, op, arg=None):
+		self.tx_queue.put((op, arg, time.perf_counter()))
+		self.max_queue_depth = max(self.max_queue_depth, self.tx_queue.qsize())
+		self.tx_pending.set()
+
+	def send(self, command):
+		self.enqueue(OP_WRITE, bytes(command))
+
+	def open(self, port):
+		"""
+		Open port on the worker thread, commands sent after this go to it
+
+		:return: future of the port name, or of the SerialException when it can not be opened
+		:rtype: concurrent.futures.Future
+		"""
+		future = concurrent.futures.Future()
+		self.enqueue(OP_OPEN, (port, future))
+		return future
+
+	def close(self):
+		self.enqueue(OP_CLOSE)
+
+	def stop(self):
+		self.stopped.set()
+		self.tx_pending.set()
+		self.join()
+		if self.serial_port.is_open:
+			self.serial_port.close()
+
+	def stats(self):
+		return {
+			"queue_depth": self.queue_depth,
+			"max_queue_depth": self.max_queue_depth,
+			"tx_messages": self.tx_messages,
+			"tx_bytes": self.tx_bytes,
+			"tx_dropped": self.tx_dropped,
+			"tx_wait_avg": self.tx_wait_total / self.tx_messages if self.tx_messages else 0.0,
+			"tx_wait_max": self.tx_wait_max,
+			"rx_bytes": self.rx_bytes,
+			"callback_errors": self.callback_errors,
+			"parser_errors": dict(self.parser.errors)
+		}
+
+	def process_queue(self):
+		self.tx_pending.clear()
+		while True:
+			try:
+				op, arg, queued_at = self.tx_queue.get_nowait()
+			except queue.Empty:
+				return
+
+			if op == OP_WRITE:
+				if not self.serial_port.is_open:
+					self.tx_dropped += 1
+					continue
+				self.serial_port.write(arg)
+				if telemetry.enabled and arg in SAMPLE_COMMANDS:
+					telemetry.request_sent()
+				wait = time.perf_counter() - queued_at
+				self.tx_messages += 1
+				self.tx_bytes += len(arg)
+				self.tx_wait_total += wait
+				self.tx_wait_max = max(self.tx_wait_max, wait)
+			elif op == OP_OPEN:
+				port, future = arg
+				self.serial_port.close()
+				self.serial_port.port = port
+				self.parser.reset()
+				try:
+					self.serial_port.open()
+				except serial.serialutil.SerialException as e:
+					future.set_exception(e)
+				else:
+					future.set_result(port)
+			elif op == OP_CLOSE:
+				self.serial_port.close()
+				self.serial_port.port = None
+
+	def dispatch(self, message):
+		# This thread is the only reader of the port, a failing consumer must not take it down
+		try:
+			self.message_callback(message)
+		except Exception as e:
+			self.callback_errors += 1
+			telemetry.count("callback_errors")
+			print("Handling {} failed! {!r}".format(type(message).__name__, e))
+
+	def run(self):
+		while not self.stopped.is_set():
+			try:
+				self.process_queue()
+			except serial.serialutil.SerialException as e:
+				print("Serial broke! {}".format(e))
+				self.serial_port.close()
+
+			if not self.serial_port.is_open:
+				self.tx_pending.wait(self.CLOSED_POLL)
+				continue
+
+			try:
+				# Blocks until the first byte arrives or READ_TIMEOUT, then takes whatever is buffered
+				data = self.serial_port.read(max(1, self.serial_port.in_waiting))
+			except serial.serialutil.SerialException as e:
+				print("Serial broke! {}".format(e))
+				self.serial_port.close()
+				continue
+
+			if len(data) > 0:
+				self.rx_bytes += len(data)
+				if not telemetry.enabled:
+					for res in self.parser.feed(data):
+						self.dispatch(res)
+					continue
+
+				received_at = time.perf_counter()
+				if not self.parser.feed_in_message:
+					self.first_byte_at = received_at
+				for res in self.parser.feed(data):
+					if type(res) is ProbeScopeInterface.ProbeScopeSamples:
+						res.timeline = telemetry.start_frame(self.first_byte_at, received_at, time.perf_counter())
+					# Any further message started within this read
+					self.first_byte_at = received_at
+					self.dispatch(res)
+				if not self.parser.feed_in_message:
+					self.first_byte_at = None
@@ -0,0 +1,385 @@
+import collections
+import concurrent.futures
+import threading
+import time
+
+import ProbeScopeInterface
+
+
+class TransactionError(Exception):
+	pass
+
+
+class TransactionTimeout(TransactionError):
+	pass
+
+
+class RetryPolicy(object):
+	"""
+	How long a transaction waits for its response, and how often its command is sent again before it fails
+
+	:param timeout: Seconds to wait for the first attempt
+	:param retries: Extra attempts after the first timed out
+	:param backoff: Every retry waits this many times longer than the attempt before
+	"""
+
+	def __init__(self, timeout=2.0, retries=0, backoff=1.0):
+		self.timeout = timeout
+		self.retries = retries
+		self.backoff = backoff
+
+	def wait(self, attempt):
+		return self.timeout * self.backoff ** attempt
+
+
+# Defaults per kind of request, register accesses are idempotent and cheap to repeat, a capture is neither
+REGISTER_POLICY = RetryPolicy(timeout=1.0, retries=2)
+SAMPLES_POLICY = RetryPolicy(timeout=2.0)
+
+
+class Transaction(object):
+	"""
+	One request and the response it waits for
+
+	:param command: Bytes to send, None to only wait for the next matching message
+	:param match: Called with every message of response_type, only one it returns True for completes the transaction
+	"""
+
+	def __init__(self, command, response_type, policy, match=None):
+		self.command = command
+		self.response_type = response_type
+		self.policy = policy
+		self.match = match
+		self.future = concurrent.futures.Future()
+		self.attempt = 0
+		self.deadline = None
+		self.sent = 0  # Commands sent, every one of them is answered unless it got lost
+		self.answered = 0
+		self.finished = False  # Answered or timed out, the future is completed outside the manager's lock
+
+	@property
+	def owed(self):
+		return self.sent - self.answered
+
+	@property
+	def stale(self):
+		# Only kept to take the responses still owed to it
+		return self.finished or self.future.done()
+
+	def accepts(self, message):
+		return self.match is None or self.match(message)
+
+
+class TransactionManager(threading.Thread):
+	"""
+	Matches responses to outstanding requests and hands out a future for each request
+
+	The Probe-Scope answers in order, so a response goes to the oldest outstanding transaction of its type that accepts
+	it. Any number of transactions, of any type, can be outstanding, every response or block of a type restarts the
+	timeouts of those still waiting. This thread only wakes up for the earliest deadline, to send a command again or
+	fail its future with TransactionTimeout. Every command sent is owed a response, a transaction that timed out, was
+	cancelled or was answered before its retry was stays in line for one more wait to take the responses still owed to
+	it, so a late or repeated response is dropped and counted instead of completing the next transaction. Futures
+	complete on the serial worker thread, or on this one when they time out.
+
+	:param serial_io: SerialWorker the commands are sent with, call on_message with each of its messages
+	"""
+
+	def __init__(self, serial_io):
+		threading.Thread.__init__(self, daemon=True)
+		self.serial_io = serial_io
+		self.pending = collections.defaultdict(collections.deque)
+		self.condition = threading.Condition()
+		self.stopped = False
+
+		# Counters
+		self.completed = 0
+		self.retries = 0
+		self.timeouts = 0
+		self.late = 0
+		self.unmatched = 0
+
+	def submit(self, transaction):
+		"""
+		Send a transaction's command and track it until its response, timeout or cancellation
+
+		:rtype: concurrent.futures.Future
+		"""
+		with self.condition:
+			if self.stopped:
+				transaction.future.set_exception(TransactionError("Transactions are stopped!"))
+				return transaction.future
+			transaction.deadline = time.monotonic() + transaction.policy.wait(0)
+			self.pending[transaction.response_type].append(transaction)
+			# Sent with the condition held, so the send order is the order of pending
+			if transaction.command is not None:
+				self.serial_io.send(transaction.command)
+				transaction.sent += 1
+			self.condition.notify()
+		return transaction.future
+
+	def request(self, command, response_type, policy, match=None):
+		return self.submit(Transaction(command, response_type, policy, match))
+
+	def request_samples(self, command=ProbeScopeInterface.REQUEST_SAMPLE_DATA_COMMAND, policy=SAMPLES_POLICY):
+		"""
+		:param command: Sample request to send, None to wait for the next frame, e.g. while streaming
+		:return: future of the next ProbeScopeSamples
+		"""
+		return self.request(command, ProbeScopeInterface.ProbeScopeSamples, policy)
+
+	def write_registers(self, address, data, policy=REGISTER_POLICY):
+		return self.write(ProbeScopeInterface.ProbeScopeRegisterWrite(address, data), policy)
+
+	def write(self, command, policy=REGISTER_POLICY):
+		"""
+		:param command: Register write command, e.g. from RegisterMap.flush
+		:return: future of its ProbeScopeWriteResponse
+		"""
+		return self.request(bytes(command), ProbeScopeInterface.ProbeScopeWriteResponse, policy)
+
+	def read_registers(self, address, length, policy=REGISTER_POLICY):
+		"""
+		:return: future of a ProbeScopeReadResponse with length bytes
+		"""
+		return self.request(ProbeScopeInterface.ProbeScopeRegisterRead(address, length),
+							ProbeScopeInterface.ProbeScopeReadResponse, policy,
+							lambda response: len(response.data) == length)
+
+	def flush_registers(self, register_map, policy=REGISTER_POLICY):
+		"""
+		Write what changed in a ProbeScopeRegisters.RegisterMap, all writes are in flight at once
+
+		The map's shadow already holds the new values, when the future fails invalidate the map so the next flush
+		writes everything again.
+
+		:return: future of the list of write responses, empty when nothing changed
+		"""
+		return gather([self.write(command, policy) for command in register_map.flush()])
+
+	def read_back(self, register_map, names=None, policy=REGISTER_POLICY):
+		"""
+		Read regions of a ProbeScopeRegisters.RegisterMap into its shadow, all reads are in flight at once
+
+		:param names: Regions to read, all that can be read if None
+		:return: future of the list of read responses, the shadow is updated before it completes
+		"""
+		ranges = register_map.read_ranges(names)
+		reads = gather([self.read_registers(address, length, policy) for address, length in ranges])
+		combined = concurrent.futures.Future()
+
+		def store(future):
+			if future.cancelled():
+				combined.cancel()
+			elif future.exception() is not None:
+				combined.set_exception(future.exception())
+			else:
+				for (address, _), response in zip(ranges, future.result()):
+					register_map.update(address, response.data)
+				combined.set_result(future.result())
+
+		reads.add_done_callback(store)
+		return combined
+
+	def match(self, message):
+		# Called with the condition held, returns the transaction message completes
+		message_type = type(message)
+		if message_type is ProbeScopeInterface.ProbeScopeSampleBlock:
+			message_type = ProbeScopeInterface.ProbeScopeSamples
+		waiting = self.pending.get(message_type)
+		if not waiting:
+			if message_type is not ProbeScopeInterface.ProbeScopeSamples:
+				self.unmatched += 1  # Frames are also pushed and streamed without a transaction
+			return None
+		transaction = None
+		for candidate in list(waiting):
+			if candidate.stale and not (candidate.owed > 0 and candidate.accepts(message)):
+				waiting.remove(candidate)  # Nothing owed, or what it was owed got lost
+			elif candidate.accepts(message):
+				transaction = candidate
+				break
+		if transaction is None:
+			self.unmatched += 1
+			return None
+		# The link is busy answering in order, the transactions queued behind this one are not late either
+		now = time.monotonic()
+		for candidate in waiting:
+			candidate.deadline = max(candidate.deadline, now + candidate.policy.wait(candidate.attempt))
+		if type(message) is ProbeScopeInterface.ProbeScopeSampleBlock:
+			return None  # A long block transfer is still arriving
+		transaction.answered += 1
+		if transaction.stale:
+			self.late += 1
+			if transaction.owed <= 0:
+				waiting.remove(transaction)
+			return None
+		transaction.finished = True
+		if transaction.owed <= 0:
+			waiting.remove(transaction)
+		return transaction
+
+	def on_message(self, message):
+		"""
+		Complete the transaction a message answers, call from the serial worker thread with every message
+		"""
+		with self.condition:
+			transaction = self.match(message)
+			if transaction is None:
+				return
+			self.completed += 1
+		transaction.future.set_result(message)
+
+	def fail(self, message, exception):
+		"""
+		Fail the transaction a message answers with exception, when handling the message raised before on_message
+		"""
+		with self.condition:
+			transaction = self.match(message)
+		if transaction is not None:
+			transaction.future.set_exception(exception)
+
+	def expire(self, now):
+		# Called with the condition held, returns what to resend and what failed
+		resend = list()
+		failed = list()
+		for waiting in self.pending.values():
+			for transaction in list(waiting):
+				if transaction.stale:
+					if transaction.owed <= 0 or transaction.deadline <= now:
+						waiting.remove(transaction)
+				elif transaction.deadline <= now:
+					if transaction.attempt < transaction.policy.retries and transaction.command is not None:
+						transaction.attempt += 1
+						transaction.deadline = now + transaction.policy.wait(transaction.attempt)
+						transaction.sent += 1
+						self.retries += 1
+						resend.append(transaction)
+					else:
+						transaction.finished = True
+						transaction.deadline = now + transaction.policy.wait(transaction.attempt)
+						if transaction.owed <= 0:
+							waiting.remove(transaction)
+						self.timeouts += 1
+						failed.append(transaction)
+		return resend, failed
+
+	def next_deadline(self):
+		deadlines = [transaction.deadline for waiting in self.pending.values() for transaction in waiting]
+		return min(deadlines) if deadlines else None
+
+	def run(self):
+		while True:
+			with self.condition:
+				if self.stopped:
+					return
+				deadline = self.next_deadline()
+				now = time.monotonic()
+				if deadline is None or deadline > now:
+					self.condition.wait(None if deadline is None else deadline - now)
+					continue
+				resend, failed = self.expire(now)
+				for transaction in resend:
+					self.serial_io.send(transaction.command)
+			for transaction in failed:
+				transaction.future.set_exception(TransactionTimeout("No {} after {} attempts".format(
+					transaction.response_type.__name__, transaction.attempt + 1)))
+
+	def stop(self):
+		"""
+		Stop the thread, outstanding transactions fail with TransactionError
+		"""
+		with self.condition:
+			self.stopped = True
+			outstanding = [transaction for waiting in self.pending.values() for transaction in waiting
+						   if not transaction.finished]
+			self.pending.clear()
+			self.condition.notify()
+		for transaction in outstanding:
+			if not transaction.future.done():
+				transaction.future.set_exception(TransactionError("Transactions are stopped!"))
+		if self.is_alive():
+			self.join()
+
+	def outstanding(self):
+		with self.condition:
+			return sum(not transaction.stale for waiting in self.pending.values() for transaction in waiting)
+
+	def stats(self):
+		return {
+			"outstanding": self.outstanding(),
+			"completed": self.completed,
+			"retries": self.retries,
+			"timeouts": self.timeouts,
+			"late": self.late,
+			"unmatched": self.unmatched
+		}
+
+
+def gather(futures):
+	"""
+	:return: future of the list of results of all futures, or of the first exception among them
+	:rtype: concurrent.futures.Future
+	"""
+	futures = list(futures)
+	combined = concurrent.futures.Future()
+	if not futures:
+		combined.set_result(list())
+		return combined
+	lock = threading.Lock()
+	remaining = [len(futures)]
+
+	def done(future):
+		with lock:
+			remaining[0] -= 1
+			if combined.done():
+				return
+			if future.cancelled():
+				combined.cancel()
+			elif future.exception() is not None:
+				combined.set_exception(future.exception())
+			elif remaining[0] == 0:
+				combined.set_result([f.result() for f in futures])
+
+	for future in futures:
+		future.add_done_callback(done)
+	return combined
+
+
+def sequence(steps):
+	"""
+	Run steps one after the other without blocking, each starts when the future of the one before completes
+
+	:param steps: Callables returning a future, or None when there was nothing to do
+	:return: future of the list of step results, or of the first exception, the steps after it do not run
+	:rtype: concurrent.futures.Future
+	"""
+	steps = list(steps)
+	combined = concurrent.futures.Future()
+	results = list()
+
+	def run_next(_=None):
+		while len(results) < len(steps):
+			try:
+				future = steps[len(results)]()
+			except Exception as e:
+				combined.set_exception(e)
+				return
+			if future is None:
+				results.append(None)
+				continue
+			future.add_done_callback(step_done)
+			return
+		combined.set_result(results)
+
+	def step_done(future):
+		if future.cancelled():
+			combined.cancel()
+			return
+		if future.exception() is not None:
+			combined.set_exception(future.exception())
+			return
+		results.append(future.result())
+		run_next()
+
+	run_next()
+	return combined
@@ -0,0 +1,74 @@
+import numpy as np
+
+from ADRF_Struct import ADRF_Ctl
+
+ADC_MIN = -128
+ADC_MAX = 127
+
+
+def clip_fraction(samples):
+	samples = np.asarray(samples)
+	return np.count_nonzero((samples <= ADC_MIN) | (samples >= ADC_MAX)) / max(len(samples), 1)
+
+
+def estimate_amplitude(samples):
+	"""
+	Peak amplitude from mid scale in ADC codes the frame would have without clipping
+
+	A clipped frame only shows its amplitude through how long it stays clipped. For a sine of amplitude A clipped at
+	C that fraction is p = 1 - 2 / pi * asin(C / A), solved for A. Other waveforms get a rougher estimate, good enough
+	for the next capture to land unclipped.
+	"""
+	samples = np.asarray(samples)
+	# Distance from mid scale is what clips, not the peak to peak
+	peak = max(float(np.max(samples)), -float(np.min(samples)))
+	clipped = clip_fraction(samples)
+	if clipped == 0:
+		return peak
+	# Never estimate less than what is visible, and cap the guess when the frame is almost entirely clipped
+	clipped = min(clipped, 0.99)
+	return max(peak, ADC_MAX / np.sin(np.pi / 2 * (1 - clipped)))
+
+
+class Autoranger(object):
+	"""
+	Picks the ADRF gain for a frame from one capture, in closed form instead of a sweep
+
+	The gain needed to bring the frame's peak amplitude to target of full scale is the current gain plus
+	20 * log10(target / amplitude) dB, and the largest gain in ADRF_Ctl.Gain_Table below it is taken. An unclipped
+	frame settles in one capture, a clipped one usually in two.
+
+	:param adrf: ADRF_Ctl holding the current gain, its other settings are kept
+	:param target: Peak amplitude to aim for as a fraction of full scale
+	"""
+
+	def __init__(self, adrf=None, target=0.8):
+		self.adrf = adrf if adrf is not None else ADRF_Ctl()
+		self.target = target
+		self.captures = 0
+
+	def required_gain(self, samples):
+		amplitude = estimate_amplitude(samples)
+		if amplitude < 1:
+			return float("inf")  # Nothing but the LSB, as much gain as there is
+		return self.adrf.Gain + 20 * np.log10(self.target * ADC_MAX / amplitude)
+
+	def update(self, samples):
+		"""
+		:param samples: Raw ADC codes of a frame captured with the current gain
+		:return: the new ADRF message, or None when the gain is already right
+		:rtype: list
+		"""
+		self.captures += 1
+		gains = ADRF_Ctl.Gains
+		index = np.searchsorted(gains, self.required_gain(samples), side="right") - 1
+		gain = gains[min(max(index, 0), len(gains) - 1)]
+		current = gains.index(self.adrf.Gain)
+		if clip_fraction(samples) > 0 and index >= current - 1:
+			# Clipping that does not look like a sine, e.g. narrow pulses, tells little about the amplitude. Halve the
+			# gain index instead, the next unclipped frame gives the exact gain
+			gain = gains[current // 2]
+		if gain == self.adrf.Gain:
+			return None
+		self.adrf.Gain = gain
+		return self.adrf.GetMessage()
@@ -0,0 +1,291 @@
+import argparse
+import collections
+import concurrent.futures
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import ProbeScopeInterface
+import ProbeScopeRecording
+import measurements
+
+RAW_EXTENSIONS = (".bin", ".raw", ".dump")  # Bytes as read from the serial port
+NPY_EXTENSION = ".npy"  # ADC codes, one frame or one frame per row
+RECORDING_EXTENSION = ".psrec"
+SOURCE_EXTENSIONS = RAW_EXTENSIONS + (NPY_EXTENSION, RECORDING_EXTENSION)
+
+READ_SIZE = 1 << 20  # Bytes of a raw dump fed to the parser at once
+INDEX_COLUMNS = (("source", np.int32), ("frame", np.int64), ("timestamp", np.float64), ("length", np.int64))
+
+
+def find_sources(paths):
+	"""
+	Files to analyze, directories are searched recursively for known extensions
+
+	:return: sorted paths
+	:rtype: list
+	"""
+	sources = list()
+	for path in paths:
+		if not os.path.isdir(path):
+			sources.append(path)
+			continue
+		for root, dirs, files in os.walk(path):
+			sources += [os.path.join(root, name) for name in files if name.lower().endswith(SOURCE_EXTENSIONS)]
+	return sorted(sources)
+
+
+class Chunk(object):
+	"""
+	Frames start to stop of one source, stop is None for raw dumps which are only split while they are parsed
+	"""
+
+	def __init__(self, source, path, start=0, stop=None):
+		self.source = source
+		self.path = path
+		self.start = start
+		self.stop = stop
+
+
+def iter_chunks(sources, chunk_samples):
+	"""
+	Split the sources into chunks of about chunk_samples samples, only file headers are read
+
+	:rtype: generator
+	"""
+	for source, path in enumerate(sources):
+		ext = os.path.splitext(path)[1].lower()
+		if ext == NPY_EXTENSION:
+			shape = np.load(path, mmap_mode="r").shape
+			frames, length = (1, shape[0]) if len(shape) == 1 else shape
+			step = max(1, chunk_samples // max(length, 1))
+		elif ext == RECORDING_EXTENSION:
+			with ProbeScopeRecording.RecordingReader(path) as reader:
+				frames = len(reader)
+				# Frame records are mostly samples, their size is a good enough estimate of the length
+				sizes = np.diff(reader.index["offset"].astype(np.int64))
+				length = int(sizes.mean()) if len(sizes) else 1
+			step = max(1, chunk_samples // max(length, 1))
+		else:
+			yield Chunk(source, path)
+			continue
+		for start in range(0, frames, step):
+			yield Chunk(source, path, start, min(start + step, frames))
+
+
+def iter_raw_frames(path):
+	"""
+	Decode a raw serial dump, only the sample frames are kept
+
+	:return: generator of ProbeScopeSamples, and the parser for its error counters
+	"""
+	parser = ProbeScopeInterface.ProbeScopeParser()
+
+	def frames():
+		with open(path, "rb") as f:
+			while True:
+				data = f.read(READ_SIZE)
+				if not data:
+					return
+				for message in parser.feed(data):
+					if type(message) is ProbeScopeInterface.ProbeScopeSamples:
+						yield message
+
+	return frames(), parser
+
+
+def measure(frames, names):
+	"""
+	Statistics of frames in ADC codes, equal length frames are measured as one stack
+
+	:param frames: list of 1D arrays
+	:return: one array per name
+	:rtype: dict
+	"""
+	if len(set(len(y) for y in frames)) == 1 and len(frames[0]):
+		stats = measurements.batch_statistics(np.stack(frames))
+		return dict((name, stats[name]) for name in names)
+	stats = [measurements.frame_statistics(y) for y in frames]
+	return dict((name, np.array([s[name] for s in stats], dtype=np.float64)) for name in names)
+
+
+class ChunkResult(object):
+	"""
+	Columns of the frames of one chunk, measurements in volts
+	"""
+
+	def __init__(self, names):
+		self.names = names
+		self.columns = collections.defaultdict(list)
+		self.errors = collections.Counter()
+
+	def add(self, source, first, frames, timestamps, scale):
+		if not frames:
+			return
+		self.columns["source"].append(np.full(len(frames), source, dtype=np.int32))
+		self.columns["frame"].append(np.arange(first, first + len(frames), dtype=np.int64))
+		self.columns["timestamp"].append(np.asarray(timestamps, dtype=np.float64))
+		self.columns["length"].append(np.array([len(y) for y in frames], dtype=np.int64))
+		# Every statistic is linear in the samples, they are computed in ADC codes and scaled once
+		for name, values in measure(frames, self.names).items():
+			self.columns[name].append(values * scale)
+
+	def arrays(self):
+		dtypes = dict(INDEX_COLUMNS)
+		return dict((name, np.concatenate(self.columns[name]) if self.columns[name] else
+					np.empty(0, dtype=dtypes.get(name, np.float64))) for name in column_names(self.names))
+
+
+def column_names(names):
+	return [name for name, _ in INDEX_COLUMNS] + list(names)
+
+
+def analyze_chunk(chunk, names, chunk_samples=1 << 22, adc_scale=1.0):
+	"""
+	Measure every frame of a chunk, runs in a worker process, only the small result columns go back
+
+	:param adc_scale: Front end scale of raw dumps and .npy frames, recordings carry their own
+	:rtype: ChunkResult
+	"""
+	result = ChunkResult(names)
+	ext = os.path.splitext(chunk.path)[1].lower()
+	if ext == NPY_EXTENSION:
+		stack = np.load(chunk.path, mmap_mode="r")
+		stack = stack[None, :] if stack.ndim == 1 else stack[chunk.start:chunk.stop]
+		result.add(chunk.source, chunk.start, list(np.asarray(stack)), np.full(len(stack), np.nan),
+				   ProbeScopeInterface.ADC_STEP * adc_scale)
+	elif ext == RECORDING_EXTENSION:
+		with ProbeScopeRecording.RecordingReader(chunk.path) as reader:
+			frames = [reader.frame(i).samples for i in range(chunk.start, chunk.stop)]
+			result.add(chunk.source, chunk.start, frames, reader.timestamps[chunk.start:chunk.stop],
+					   reader.adc_step * reader.adc_scale)
+	else:
+		# A dump is parsed front to back, frames are measured in batches so a large one does not fill the memory
+		messages, parser = iter_raw_frames(chunk.path)
+		scale = ProbeScopeInterface.ADC_STEP * adc_scale
+		first = 0
+		batch = list()
+		samples = 0
+		for message in messages:
+			batch.append(message.samples)
+			samples += len(message.samples)
+			if samples >= chunk_samples:
+				result.add(chunk.source, first, batch, np.full(len(batch), np.nan), scale)
+				first += len(batch)
+				batch = list()
+				samples = 0
+		result.add(chunk.source, first, batch, np.full(len(batch), np.nan), scale)
+		result.errors.update(parser.errors)
+	return result
+
+
+class ColumnWriter(object):
+	"""
+	Collects result columns on disk and writes them as one .npz, one array per column
+
+	Columns are appended to spill files next to the output while chunks arrive, close packs them without loading them.
+	Read the table with np.load, the "sources" array holds the path of every source index.
+
+	:param names: Measurement columns after the index columns
+	"""
+
+	def __init__(self, path, names, sources, compressed=True):
+		self.path = path
+		self.sources = sources
+		self.compressed = compressed
+		self.dtypes = dict(INDEX_COLUMNS)
+		self.names = column_names(names)
+		self.spill = tempfile.mkdtemp(prefix=".batch_", dir=os.path.dirname(os.path.abspath(path)))
+		self.files = dict((name, open(os.path.join(self.spill, name), "wb")) for name in self.names)
+		self.rows = 0
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.close(exc_type is None)
+
+	def append(self, columns):
+		for name in self.names:
+			columns[name].astype(self.dtypes.get(name, np.float64), copy=False).tofile(self.files[name])
+		self.rows += len(columns["source"])
+
+	def close(self, save=True):
+		for f in self.files.values():
+			f.close()
+		try:
+			if save:
+				arrays = dict((name, self.column(name)) for name in self.names)
+				arrays["sources"] = np.array(self.sources, dtype=str)
+				(np.savez_compressed if self.compressed else np.savez)(self.path, **arrays)
+				del arrays  # Unmap before the spill files go
+		finally:
+			shutil.rmtree(self.spill, ignore_errors=True)
+
+	def column(self, name):
+		dtype = self.dtypes.get(name, np.float64)
+		if self.rows == 0:
+			return np.empty(0, dtype=dtype)
+		# Memory mapped, savez writes it out in buffered pieces
+		return np.memmap(os.path.join(self.spill, name), dtype=dtype, mode="r", shape=(self.rows,))
+
+
+def analyze(paths, output, names=measurements.STATISTICS, workers=None, chunk_samples=1 << 22, adc_scale=1.0,
+			compressed=True):
+	"""
+	Measure every frame of the sources across a process pool and write the results table to output
+
+	Chunks are handed out as they are planned and at most two per worker are in flight, results are written in chunk
+	order as they complete, so memory is bounded by workers * chunk_samples whatever the size of the data set.
+
+	:param workers: Worker processes, one per core if None
+	:return: frames measured and the summed parser error counters of the raw dumps
+	:rtype: tuple
+	"""
+	sources = find_sources(paths)
+	workers = workers or os.cpu_count() or 1
+	errors = collections.Counter()
+	with ColumnWriter(output, names, sources, compressed) as writer, \
+			concurrent.futures.ProcessPoolExecutor(workers) as pool:
+		pending = collections.deque()
+		for chunk in iter_chunks(sources, chunk_samples):
+			pending.append(pool.submit(analyze_chunk, chunk, names, chunk_samples, adc_scale))
+			if len(pending) >= 2 * workers:
+				result = pending.popleft().result()
+				writer.append(result.arrays())
+				errors.update(result.errors)
+		while pending:
+			result = pending.popleft().result()
+			writer.append(result.arrays())
+			errors.update(result.errors)
+		frames = writer.rows
+	return frames, errors
+
+
+if __name__ == '__main__':
+	arg_parser = argparse.ArgumentParser(description="Run measurements over recorded Probe-Scope frames in parallel")
+	arg_parser.add_argument("paths", nargs="+",
+							help="Directories or files: raw serial dumps ({}), .npy frames in ADC codes, .psrec "
+								 "recordings".format(", ".join(RAW_EXTENSIONS)))
+	arg_parser.add_argument("-o", "--output", default="results.npz", help="Results table, one array per column")
+	arg_parser.add_argument("--measure", nargs="+", choices=measurements.STATISTICS, default=measurements.STATISTICS,
+							help="Measurements to run")
+	arg_parser.add_argument("-j", "--workers", type=int, default=None, help="Worker processes, one per core by default")
+	arg_parser.add_argument("--chunk-samples", type=int, default=1 << 22,
+							help="Samples per unit of work, bounds the memory of each worker")
+	arg_parser.add_argument("--adc-scale", type=float, default=1.0,
+							help="Front end scale of raw dumps and .npy frames")
+	arg_parser.add_argument("--uncompressed", action="store_true", help="Write the table without compression")
+	args = arg_parser.parse_args()
+
+	start = time.monotonic()
+	frames, errors = analyze(args.paths, args.output, args.measure, args.workers, args.chunk_samples, args.adc_scale,
+							 not args.uncompressed)
+	elapsed = time.monotonic() - start
+	print("{} frames in {:.2f} s, {:.0f} frames/s, written to {}".format(
+		frames, elapsed, frames / elapsed if elapsed else 0.0, args.output))
+	if errors:
+		print("Parser errors: {}".format(dict(errors)))
@@ -0,0 +1,475 @@
+import argparse
+import json
+import os
+import queue
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import ProbeScopeDevices
+import ProbeScopeEmulator
+import ProbeScopeInterface
+import ProbeScopeSerial
+import autoset
+import batch_analysis
+import measurements
+import trigger
+from ProbeScopeEmulator import ProbeScopeMakeSamples
+
+SUITES = ("parser", "encoder", "measurements", "update_plot", "latency", "autoset", "trigger", "devices", "batch")
+
+
+def make_stream(frames=50, points=1000, escape_heavy=False, block_size=None):
+	"""
+	Build a recorded-like stream of sample responses
+
+	:param frames: Number of sample messages in the stream
+	:param points: Samples per message
+	:param escape_heavy: Fill the samples with bytes that all need escaping
+	:param block_size: Send the samples as block transfers in chunks of this many samples
+	:return: raw stream as it would be read from the serial port
+	:rtype: bytes
+	"""
+	if escape_heavy:
+		specials = np.array([
+			ProbeScopeInterface.ESCAPE_CHAR,
+			ProbeScopeInterface.START_OF_MESSAGE,
+			ProbeScopeInterface.END_OF_MESSAGE,
+			ProbeScopeInterface.END_OF_BLOCK
+		], dtype=np.uint8)
+		y = np.resize(specials, points).tobytes()
+	else:
+		type_info = np.iinfo(np.int8)
+		arr = np.linspace(-np.pi, np.pi, points)
+		y = np.sin(arr) * 123
+		y += np.random.normal(0, 4, points)
+		y = np.clip(y, type_info.min, type_info.max).astype(np.int8).tobytes()
+
+	if block_size is not None:
+		return bytes(ProbeScopeEmulator.ProbeScopeMakeSampleBlocks(y, block_size)) * frames
+	return bytes(ProbeScopeMakeSamples(y)) * frames
+
+
+def run_read_char(stream, read_size):
+	parser = ProbeScopeInterface.ProbeScopeParser()
+	frames = 0
+	for i in range(0, len(stream), read_size):
+		for s_char in stream[i:i + read_size]:
+			if type(parser.read_char(s_char)) is ProbeScopeInterface.ProbeScopeSamples:
+				frames += 1
+	return frames
+
+
+def run_feed(stream, read_size):
+	parser = ProbeScopeInterface.ProbeScopeParser()
+	frames = 0
+	for i in range(0, len(stream), read_size):
+		frames += sum(type(res) is ProbeScopeInterface.ProbeScopeSamples for res in parser.feed(stream[i:i + read_size]))
+	return frames
+
+
+def bench_parser(stream, read_size=16000, repeat=3):
+	"""
+	Compare the per char and bulk decode paths on the same stream
+
+	:return: bytes per second of each path, best of repeat
+	:rtype: dict
+	"""
+	results = dict()
+	for name, func in [("read_char", run_read_char), ("feed", run_feed)]:
+		best = None
+		for _ in range(repeat):
+			start = time.perf_counter()
+			frames = func(stream, read_size)
+			elapsed = time.perf_counter() - start
+			best = elapsed if best is None else min(best, elapsed)
+		results[name] = {"bytes_per_s": len(stream) / best, "frames": frames}
+	return results
+
+
+def reference_escape(data):
+	# The original byte at a time encoder, kept as the baseline
+	output = bytearray()
+	for b in data:
+		if b in ProbeScopeInterface.ESCAPED_CHARS:
+			output.append(ProbeScopeInterface.ESCAPE_CHAR)
+		output.append(b)
+	return output
+
+
+def bench_encoder(sizes=(4, 64, 1000, 100000), repeat=20):
+	"""
+	Escape encoder bytes per second against the per byte baseline, on clean, random and all-special payloads
+
+	:rtype: dict
+	"""
+	specials = np.frombuffer(ProbeScopeInterface.ESCAPED_CHARS, dtype=np.uint8)
+	results = dict()
+	for size in sizes:
+		payloads = [
+			("clean", np.resize(np.arange(0x20, 0x80, dtype=np.uint8), size).tobytes()),
+			("random", np.random.randint(0, 256, size, dtype=np.uint8).tobytes()),
+			("escape heavy", np.resize(specials, size).tobytes())
+		]
+		for kind, data in payloads:
+			if ProbeScopeInterface.ProbeScopeEscapeBytes(data) != reference_escape(data):
+				raise AssertionError("Encoder output differs from the baseline for {} {}".format(kind, size))
+			res = dict()
+			for name, func in [("baseline", reference_escape), ("encoder", ProbeScopeInterface.ProbeScopeEscapeBytes)]:
+				start = time.perf_counter()
+				for _ in range(repeat):
+					func(data)
+				res[name] = size * repeat / (time.perf_counter() - start)
+			results["{} {}".format(kind, size)] = res
+	return results
+
+
+def time_per_call(func, inputs):
+	"""
+	Best of three runs over inputs, after one warm up call
+
+	:return: seconds per call
+	"""
+	func(inputs[0])
+	best = None
+	for _ in range(3):
+		start = time.perf_counter()
+		for arg in inputs:
+			func(arg)
+		elapsed = (time.perf_counter() - start) / len(inputs)
+		best = elapsed if best is None else min(best, elapsed)
+	return best
+
+
+def bench_measurements(lengths=(1000, 100000), repeat=50):
+	"""
+	Seconds per frame of every measurement, on frames of each length
+
+	:rtype: dict
+	"""
+	functions = [measurements.meas_pk_pk, measurements.meas_rms, measurements.meas_average,
+				 measurements.meas_ac_rms, measurements.meas_min, measurements.meas_max]
+	results = dict()
+	for length in lengths:
+		x = np.arange(length) / ProbeScopeInterface.ADC_SAMPLE_RATE
+		y = np.frombuffer(ProbeScopeEmulator.make_waveform(length), dtype=np.int8) * ProbeScopeInterface.ADC_STEP
+		# A new array per call, so the engine's per frame cache does not hide the cost
+		frames = [y.copy() for _ in range(repeat)]
+		results["frame_statistics {}".format(length)] = time_per_call(measurements.frame_statistics, frames)
+		for func in functions:
+			results["{} {}".format(func.__name__, length)] = time_per_call(func, [(x, y) for y in frames])
+	return results
+
+
+def bench_update_plot(lengths=(1000, 100000), repeat=20):
+	"""
+	Seconds per frame of WidgetGallery.update_plot, on the offscreen Qt platform when no display is set
+
+	:return: empty when Qt or pyqtgraph are not installed
+	:rtype: dict
+	"""
+	os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+	try:
+		import ProbeScopeGUI
+	except ImportError as e:
+		print("Skipping update_plot, {}".format(e))
+		return dict()
+
+	app = ProbeScopeGUI.QApplication.instance() or ProbeScopeGUI.QApplication(sys.argv[:1])
+	gallery = ProbeScopeGUI.WidgetGallery()
+
+	def plot(samples):
+		gallery.update_plot(samples)
+		app.processEvents()
+
+	results = dict()
+	try:
+		for length in lengths:
+			frames = [ProbeScopeInterface.ProbeScopeSamples(ProbeScopeEmulator.make_waveform(length))
+					  for _ in range(repeat)]
+			results[str(length)] = time_per_call(plot, frames)
+	finally:
+		gallery.close()
+	return results
+
+
+def bench_latency(links=(("unlimited", None, 200), ("115200 baud", 11520, 20)), points=1000):
+	"""
+	Request to frame latency through SerialWorker and the emulated device, one request in flight
+
+	:param links: (name, bytes per second, requests) of every link to measure
+	:return: p50, p95 and max seconds of each link
+	:rtype: dict
+	"""
+	results = dict()
+	for name, bytes_per_second, requests in links:
+		emulator = ProbeScopeEmulator.DeviceEmulator(points, bytes_per_second=bytes_per_second)
+		arrivals = queue.Queue()
+
+		def message_callback(message):
+			if type(message) is ProbeScopeInterface.ProbeScopeSamples:
+				arrivals.put(time.perf_counter())
+
+		worker = ProbeScopeSerial.SerialWorker(emulator.open_loopback(), message_callback)
+		worker.start()
+		worker.open("emulator")
+		latencies = list()
+		try:
+			for _ in range(requests):
+				start = time.perf_counter()
+				worker.send(ProbeScopeInterface.REQUEST_SAMPLE_DATA_COMMAND)
+				latencies.append(arrivals.get(timeout=5) - start)
+		finally:
+			worker.stop()
+			emulator.stop()
+		results[name] = {
+			"p50": float(np.percentile(latencies, 50)),
+			"p95": float(np.percentile(latencies, 95)),
+			"max": float(np.max(latencies))
+		}
+	return results
+
+
+def emulate_frame(amplitude, gain, points=1000, noise=1.0, waveform="sine"):
+	"""
+	Frame the ADC would return for an input of amplitude at gain dB, in ADC codes with noise and clipping
+	"""
+	t = np.linspace(0, 10 * 2 * np.pi, points, endpoint=False) + np.random.uniform(0, 2 * np.pi)
+	if waveform == "square":
+		y = np.sign(np.sin(t))
+	elif waveform == "pulse":
+		y = (np.sin(t) > 0.9).astype(np.float64)
+	else:
+		y = np.sin(t)
+	y = y * amplitude * 10 ** (gain / 20) + np.random.normal(0, noise, points)
+	return np.clip(np.round(y), autoset.ADC_MIN, autoset.ADC_MAX).astype(np.int8)
+
+
+def bench_autoset(amplitudes=np.logspace(-2.5, 0, 40), waveforms=("sine", "square", "pulse"), max_captures=20):
+	"""
+	Captures the autoranger and a one step per capture sweep need to settle, over input amplitudes in codes at 0dB
+
+	A capture counts when its frame still changed the gain, the frame after the last change is already a good one.
+
+	:rtype: dict
+	"""
+	gains = autoset.ADRF_Ctl.Gains
+	results = dict()
+	for waveform in waveforms:
+		autoset_captures = list()
+		sweep_captures = list()
+		for amplitude in amplitudes:
+			ranger = autoset.Autoranger()
+			captures = 0
+			for captures in range(1, max_captures + 1):
+				if ranger.update(emulate_frame(amplitude, ranger.adrf.Gain, waveform=waveform)) is None:
+					break
+			autoset_captures.append(captures)
+
+			# Manual sweep, one table step per capture until the frame is unclipped and above half the target
+			index = gains.index(autoset.ADRF_Ctl().Gain)
+			for captures in range(1, max_captures + 1):
+				y = emulate_frame(amplitude, gains[index], waveform=waveform)
+				if autoset.clip_fraction(y) > 0 and index > 0:
+					index -= 1
+				elif autoset.estimate_amplitude(y) < 0.4 * autoset.ADC_MAX and index < len(gains) - 1:
+					index += 1
+				else:
+					break
+			sweep_captures.append(captures)
+		# The last capture of each run only confirmed the gain
+		autoset_captures = np.array(autoset_captures) - 1
+		sweep_captures = np.array(sweep_captures) - 1
+		results[waveform] = {
+			"autoset_mean": float(np.mean(autoset_captures)), "autoset_max": int(np.max(autoset_captures)),
+			"sweep_mean": float(np.mean(sweep_captures)), "sweep_max": int(np.max(sweep_captures))
+		}
+	return results
+
+
+def bench_trigger(lengths=(1000, 10000, 100000, 1000000), frames=20):
+	"""
+	Software trigger frames per second for every mode on noisy sine frames of each length
+
+	:rtype: dict
+	"""
+	results = dict()
+	for length in lengths:
+		# Ten periods per frame with a random phase, like unaligned captures
+		phases = np.random.uniform(0, 2 * np.pi, frames)
+		t = np.linspace(0, 20 * np.pi, length)
+		stack = np.sin(t[None, :] + phases[:, None]) + np.random.normal(0, 0.05, (frames, length))
+
+		for mode in trigger.TRIGGER_MODES:
+			trig = trigger.SoftwareTrigger(mode, level=0.0, hysteresis=0.1, min_width=length // 40, runt_high=2.0)
+			start = time.perf_counter()
+			for y in stack:
+				trig.find(y)
+			elapsed = time.perf_counter() - start
+			results["{} {}".format(mode, length)] = {"frames_per_s": frames / elapsed, "triggered": trig.triggered}
+	return results
+
+
+def bench_devices(counts=(1, 4), bytes_per_second=11520, points=1000, seconds=3.0):
+	"""
+	Per device frame rate of DeviceManager streaming from several emulated devices, each on its own capped link
+
+	:return: for every device count the slowest device's frames per second, and the alignment counters
+	:rtype: dict
+	"""
+	results = dict()
+	for count in counts:
+		captures = list()
+		manager = ProbeScopeDevices.DeviceManager(captures.append)
+		emulators = list()
+		try:
+			for i in range(count):
+				emulator = ProbeScopeEmulator.DeviceEmulator(points, bytes_per_second=bytes_per_second, seed=i)
+				emulators.append(emulator)
+				manager.add(emulator.open_loopback()).open("emulator")
+			manager.start()
+			start = time.monotonic()
+			while time.monotonic() - start < seconds:
+				time.sleep(0.1)
+				manager.poll()
+			manager.stop()
+			elapsed = time.monotonic() - start
+			stats = manager.stats()
+		finally:
+			manager.close()
+			for emulator in emulators:
+				emulator.stop()
+		results[count] = {
+			"fps_per_device": min(device["frames"] for device in stats["devices"]) / elapsed,
+			"captures": len(captures),
+			"max_skew": max(capture.skew for capture in captures) if captures else float("nan"),
+			"unaligned": stats["alignment"]["unaligned"]
+		}
+	return results
+
+
+def bench_batch(workers=(1, os.cpu_count() or 1), files=8, frames=500, points=2000):
+	"""
+	Frames per second of batch_analysis over .npy frame sets, with one worker and with one per core
+
+	:rtype: dict
+	"""
+	results = dict()
+	with tempfile.TemporaryDirectory() as directory:
+		rng = np.random.default_rng(0)
+		for i in range(files):
+			np.save(os.path.join(directory, "{}.npy".format(i)),
+					rng.integers(-128, 128, (frames, points), dtype=np.int16).astype(np.int8))
+		for count in sorted(set(workers)):
+			start = time.perf_counter()
+			measured, _ = batch_analysis.analyze([directory], os.path.join(directory, "results.npz"), workers=count,
+												 chunk_samples=frames * points // 4)
+			results[count] = {"frames_per_s": measured / (time.perf_counter() - start)}
+	return results
+
+
+def run_suites(suites, streams, read_size):
+	"""
+	:return: metric name to (value, unit, higher_is_better)
+	:rtype: dict
+	"""
+	metrics = dict()
+	if "parser" in suites:
+		for name, stream in streams:
+			res = bench_parser(stream, read_size)
+			for path in ("read_char", "feed"):
+				metrics["parser {} {}".format(path, name)] = (res[path]["bytes_per_s"], "B/s", True)
+	if "encoder" in suites:
+		for name, res in bench_encoder().items():
+			metrics["encoder {}".format(name)] = (res["encoder"], "B/s", True)
+	if "measurements" in suites:
+		for name, res in bench_measurements().items():
+			metrics["measurements {}".format(name)] = (res, "s/frame", False)
+	if "update_plot" in suites:
+		for name, res in bench_update_plot().items():
+			metrics["update_plot {}".format(name)] = (res, "s/frame", False)
+	if "latency" in suites:
+		for name, res in bench_latency().items():
+			for stat in ("p50", "p95"):
+				metrics["latency {} {}".format(name, stat)] = (res[stat], "s", False)
+	if "autoset" in suites:
+		for name, res in bench_autoset().items():
+			metrics["autoset {}".format(name)] = (res["autoset_mean"], "captures", False)
+	if "trigger" in suites:
+		for name, res in bench_trigger().items():
+			metrics["trigger {}".format(name)] = (res["frames_per_s"], "frames/s", True)
+	if "devices" in suites:
+		for count, res in bench_devices().items():
+			metrics["devices {} fps per device".format(count)] = (res["fps_per_device"], "frames/s", True)
+	if "batch" in suites:
+		for count, res in bench_batch().items():
+			metrics["batch {} workers".format(count)] = (res["frames_per_s"], "frames/s", True)
+	return metrics
+
+
+def compare(metrics, baseline, threshold):
+	"""
+	:return: names of the metrics that got worse than baseline by more than threshold, as a fraction
+	:rtype: list
+	"""
+	regressions = list()
+	for name, (value, unit, higher_is_better) in sorted(metrics.items()):
+		if name not in baseline:
+			continue
+		base = baseline[name]["value"]
+		if higher_is_better:
+			regressed = value < base * (1 - threshold)
+		else:
+			regressed = value > base * (1 + threshold)
+		change = (value - base) / base * 100 if base else 0.0
+		print("{}{}: {:.4g} {} vs {:.4g} ({:+.1f}%)".format(
+			"REGRESSION " if regressed else "", name, value, unit, base, change))
+		if regressed:
+			regressions.append(name)
+	return regressions
+
+
+if __name__ == '__main__':
+	arg_parser = argparse.ArgumentParser(description="Probe-Scope host stack benchmarks")
+	arg_parser.add_argument("streams", nargs="*", help="Recorded raw serial streams, synthetic ones if omitted")
+	arg_parser.add_argument("--read-size", type=int, default=16000, help="Bytes per serial read")
+	arg_parser.add_argument("--suites", nargs="+", choices=SUITES, default=SUITES, help="Benchmarks to run")
+	arg_parser.add_argument("--save", metavar="JSON", help="Save the results as a baseline")
+	arg_parser.add_argument("--compare", metavar="JSON", help="Fail when a result regressed against this baseline")
+	arg_parser.add_argument("--threshold", type=float, default=0.25,
+							help="Allowed regression as a fraction of the baseline")
+	args = arg_parser.parse_args()
+
+
+	if args.streams:
+		streams = list()
+		for path in args.streams:
+			with open(path, "rb") as f:
+				streams.append((os.path.basename(path), f.read()))
+	else:
+		streams = [
+			("clean", make_stream()),
+			("escape heavy", make_stream(escape_heavy=True)),
+			("blocks", make_stream(frames=2, points=1 << 20, block_size=4096))
+		]
+
+	metrics = run_suites(args.suites, streams, args.read_size)
+
+	if args.save:
+		with open(args.save, "w") as f:
+			json.dump(dict((name, {"value": value, "unit": unit, "higher_is_better": higher_is_better})
+						   for name, (value, unit, higher_is_better) in metrics.items()), f, indent=1, sort_keys=True)
+
+	if args.compare:
+		with open(args.compare) as f:
+			baseline = json.load(f)
+		regressions = compare(metrics, baseline, args.threshold)
+		if regressions:
+			print("{} of {} results regressed more than {:.0f}%".format(
+				len(regressions), len(metrics), args.threshold * 100))
+			sys.exit(1)
+	else:
+		for name, (value, unit, _) in sorted(metrics.items()):
+			print("{}: {:.4g} {}".format(name, value, unit))
@@ -0,0 +1,111 @@
+import argparse
+import struct
+import sys
+import time
+
+import serial
+
+import ProbeScopeDevices
+import ProbeScopeInterface
+import ProbeScopeTransactions
+from telemetry import telemetry
+
+
+def parse_register_preset(text):
+	"""
+	Parse ADDRESS=HEXBYTES, e.g. 0x3000=0001
+	"""
+	address, data = text.split("=", 1)
+	return int(address, 0), bytes.fromhex(data)
+
+
+if __name__ == '__main__':
+	arg_parser = argparse.ArgumentParser(description="Capture Probe-Scope frames to disk without the GUI")
+	arg_parser.add_argument("port", nargs="+", help="Serial port of the Probe-Scope, several capture in parallel")
+	arg_parser.add_argument("-o", "--output", default="capture.psrec",
+							help="Output file, numbered per device when capturing from several")
+	arg_parser.add_argument("-n", "--frames", type=int, default=0, help="Stop after this many frames per device")
+	arg_parser.add_argument("-d", "--duration", type=float, default=0, help="Stop after this many seconds")
+	arg_parser.add_argument("--baudrate", type=int, default=115200)
+	arg_parser.add_argument("--in-flight", type=int, default=2, help="Sample requests kept in flight")
+	arg_parser.add_argument("--push", action="store_true", help="Arm triggered captures instead of requesting")
+	arg_parser.add_argument("--blocks", action="store_true",
+							help="Request block transfers, for captures too long for one message")
+	arg_parser.add_argument("--dac", type=int, nargs=4, metavar=("VGN1", "VGN2", "VGN3", "OFFSET"),
+							help="DAC values to set after init")
+	arg_parser.add_argument("--reg", type=parse_register_preset, action="append", default=[],
+							metavar="ADDRESS=HEXBYTES", help="Extra register write after init, can be repeated")
+	arg_parser.add_argument("--window", type=float, default=0.05,
+							help="Largest skew in seconds between the frames of an aligned capture")
+	arg_parser.add_argument("--telemetry", metavar="JSON", help="Collect stage latencies and counters, export them here")
+	args = arg_parser.parse_args()
+
+	telemetry.enabled = args.telemetry is not None
+	aligned = {"captures": 0, "max_skew": 0.0}
+
+	def capture_callback(capture):
+		aligned["captures"] += 1
+		aligned["max_skew"] = max(aligned["max_skew"], capture.skew)
+
+	def message_callback(message):
+		if type(message) is ProbeScopeInterface.ProbeScopeSamples:
+			telemetry.finish_frame(message.timeline)
+
+	manager = ProbeScopeDevices.DeviceManager(capture_callback, window=args.window)
+	for port in args.port:
+		device = manager.add(serial.Serial(baudrate=args.baudrate), message_callback)
+		if args.dac is not None:
+			device.register_map.set("DAC", struct.pack("<HHHH", *args.dac))
+
+	# Same sequence as WidgetGallery.init_device, then the presets outside the register map, all devices at once
+	init = list()
+	for device, port in zip(manager, args.port):
+		writes = [device.open(port)]
+		writes += [device.transactions.write_registers(address, data) for address, data in args.reg]
+		init.append(ProbeScopeTransactions.gather(writes))
+	for device, port, future in list(zip(manager, args.port, init)):
+		try:
+			future.result()
+		except (ProbeScopeTransactions.TransactionError, serial.SerialException) as e:
+			# It would never reach --frames, and its recording would stay empty
+			print("{}: init failed, {}, leaving it out".format(port, e))
+			manager.remove(device)
+	if len(manager) == 0:
+		manager.close()
+		sys.exit("No device to capture from!")
+	# Stored with every frame after the device's register map, the presets are not in the map
+	presets = b"".join(ProbeScopeInterface.ProbeScopeRegisterWrite(address, data) for address, data in args.reg)
+	paths = ProbeScopeDevices.recording_paths(args.output, len(manager))
+	manager.record(paths, registers=presets)
+
+	start = time.monotonic()
+	manager.start(args.in_flight, args.push, args.blocks)
+	try:
+		while True:
+			time.sleep(0.1)
+			manager.poll()
+			if args.frames and all(device.acquisition.frames >= args.frames for device in manager):
+				break
+			if args.duration and time.monotonic() - start >= args.duration:
+				break
+	except KeyboardInterrupt:
+		pass
+	manager.stop()
+	elapsed = time.monotonic() - start
+
+	stats = manager.stats()
+	recorders = manager.stop_recording()
+	manager.close()
+
+	for device, path, recorder in zip(stats["devices"], paths, recorders):
+		print("{}: {} frames in {:.2f} s, {:.1f} frames/s, {:.0f} B/s ({:.0f}% of link), {} request timeouts".format(
+			device["port"], device["frames"], elapsed, device["frames"] / elapsed, device["rx_bytes"] / elapsed,
+			device["rx_bytes"] * 10 / elapsed / args.baudrate * 100, device["timeouts"]))
+		print("{} written to {}, {} dropped by writer".format(recorder.written, path, recorder.dropped))
+	if len(manager) > 1:
+		print("{} aligned captures, {} partial, {} frames unaligned, skew up to {:.1f} ms".format(
+			aligned["captures"], stats["alignment"]["partial"], stats["alignment"]["unaligned"],
+			aligned["max_skew"] * 1e3))
+	if args.telemetry is not None:
+		telemetry.export(args.telemetry)
+		print(telemetry.status())
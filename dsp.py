@@ -0,0 +1,275 @@
+import abc
+import concurrent.futures
+import multiprocessing
+import multiprocessing.util
+import os
+import queue
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from telemetry import telemetry
+
+
+class Stage(abc.ABC):
+	"""
+	One step of a DSP pipeline, takes a frame and returns the processed frame
+
+	Stateless stages can run in worker processes, stateful ones keep history between frames and have to see frames in
+	order.
+	"""
+	stateful = False
+	decimation = 1
+
+	@abc.abstractmethod
+	def __call__(self, y):
+		"""
+		:type y: np.ndarray
+		:rtype: np.ndarray
+		"""
+
+
+class FrameAverage(Stage):
+	"""
+	Average of the last n frames, reset when the frame length changes
+	"""
+	stateful = True
+
+	def __init__(self, n):
+		self.n = n
+		self.frames = list()
+		self.frame_sum = None
+
+	def __call__(self, y):
+		if self.frame_sum is not None and len(self.frame_sum) != len(y):
+			self.frames = list()
+			self.frame_sum = None
+		y = np.asarray(y, dtype=np.float64)
+		self.frames.append(y)
+		self.frame_sum = y.copy() if self.frame_sum is None else self.frame_sum + y
+		if len(self.frames) > self.n:
+			self.frame_sum -= self.frames.pop(0)
+		return self.frame_sum / len(self.frames)
+
+
+class Boxcar(Stage):
+	"""
+	Moving average over width samples, with decimate it is high resolution mode, one output per width samples
+	"""
+
+	def __init__(self, width, decimate=False):
+		self.width = width
+		self.decimate = decimate
+		self.decimation = width if decimate else 1
+
+	def __call__(self, y):
+		y = np.asarray(y, dtype=np.float64)
+		if self.decimate:
+			usable = len(y) // self.width * self.width
+			return y[:usable].reshape(-1, self.width).mean(axis=1)
+		cumulative = np.cumsum(np.concatenate(([0.0], y)))
+		averaged = (cumulative[self.width:] - cumulative[:-self.width]) / self.width
+		# Keep the frame length, edges padded with the first full average
+		return np.concatenate((np.full(self.width - 1, averaged[0]), averaged)) if len(averaged) else y
+
+
+class FIRLowPass(Stage):
+	"""
+	Windowed sinc low-pass filter
+
+	:param cutoff: Cutoff as a fraction of the Nyquist frequency
+	:param taps: Filter length, odd so the delay is a whole number of samples
+	"""
+
+	def __init__(self, cutoff, taps=63):
+		taps = taps | 1
+		n = np.arange(taps) - (taps - 1) / 2
+		kernel = cutoff * np.sinc(cutoff * n) * np.hamming(taps)
+		self.kernel = kernel / kernel.sum()
+
+	def __call__(self, y):
+		return np.convolve(np.asarray(y, dtype=np.float64), self.kernel, mode="same")
+
+
+class Decimate(Stage):
+	"""
+	Keep every factor-th sample, put a low-pass stage in front to avoid aliasing
+	"""
+
+	def __init__(self, factor):
+		self.factor = factor
+		self.decimation = factor
+
+	def __call__(self, y):
+		return np.asarray(y)[::self.factor]
+
+
+class Pipeline(object):
+	def __init__(self, stages):
+		self.stages = list(stages)
+
+	@property
+	def decimation(self):
+		decimation = 1
+		for stage in self.stages:
+			decimation *= stage.decimation
+		return decimation
+
+	def __call__(self, y):
+		for stage in self.stages:
+			y = stage(y)
+		return y
+
+
+class ProcessedSamples(object):
+	"""
+	Frame that went through a pipeline, samples are in ADC codes like ProbeScopeSamples but float
+
+	:param decimation: Decimation applied by the pipeline on top of the ADC decimation
+	"""
+
+	def __init__(self, samples, decimation=1):
+		self.samples = samples
+		self.decimation = decimation
+
+
+# Worker process state, set once by the pool initializer
+worker_stages = None
+worker_blocks = dict()
+
+
+def init_worker(stages):
+	global worker_stages
+	worker_stages = Pipeline(stages)
+	# Run when the worker exits after the pool shut down
+	multiprocessing.util.Finalize(None, close_blocks, exitpriority=10)
+
+
+def close_blocks():
+	while worker_blocks:
+		_, block = worker_blocks.popitem()
+		block.close()
+
+
+def attach_block(name):
+	block = worker_blocks.get(name)
+	if block is None:
+		block = shared_memory.SharedMemory(name=name)
+		worker_blocks[name] = block
+	return block
+
+
+def run_stages(in_name, out_name, length):
+	frame = np.ndarray(length, dtype=np.float64, buffer=attach_block(in_name).buf)
+	result = worker_stages(frame)
+	out = np.ndarray(len(result), dtype=np.float64, buffer=attach_block(out_name).buf)
+	out[:] = result
+	return len(result)
+
+
+class ProcessPoolPipeline(object):
+	"""
+	Runs the stateless stages of a pipeline in a process pool on shared memory frame buffers
+
+	Frames are copied once into a shared input slot, the worker writes its result into the slot's shared output, so
+	no frame is pickled. Completed frames go through the stateful stages in submission order and then to callback,
+	which is called from the pool's result thread. submit never blocks and never raises, when every slot is busy or
+	the frame is longer than a slot it is dropped and counted, once the pipeline is closed frames are ignored.
+
+	:param stages: Stateless stages, run in the workers
+	:param ordered_stages: Stateful stages such as FrameAverage, run in order on the results
+	:param callback: Called with every ProcessedSamples
+	:param max_length: Largest frame in samples that fits a slot
+	"""
+
+	def __init__(self, stages, ordered_stages, callback, workers=None, slots=None, max_length=1 << 20):
+		stages = list(stages)
+		if any(stage.stateful for stage in stages):
+			raise ValueError("Stateful stages have to be in ordered_stages!")
+		self.ordered = Pipeline(ordered_stages)
+		self.decimation = Pipeline(stages).decimation * self.ordered.decimation
+		self.callback = callback
+		self.max_length = max_length
+
+		workers = workers if workers is not None else os.cpu_count() or 1
+		# Spawned, a forked child of the GUI could inherit a lock held by one of its threads and deadlock
+		self.executor = concurrent.futures.ProcessPoolExecutor(
+			workers, mp_context=multiprocessing.get_context("spawn"), initializer=init_worker, initargs=(stages,))
+		slots = slots if slots is not None else 2 * workers
+		self.blocks = list()
+		self.free_slots = queue.Queue()
+		for slot in range(slots):
+			self.blocks.append((shared_memory.SharedMemory(create=True, size=max_length * 8),
+								shared_memory.SharedMemory(create=True, size=max_length * 8)))
+			self.free_slots.put(slot)
+
+		# Reentrant, a frame that completes right away is handed to done while submit still holds it
+		self.lock = threading.RLock()
+		self.closed = False
+		self.next_submit = 0
+		self.next_deliver = 0
+		self.completed = dict()
+		self.dropped = 0
+
+	def submit(self, samples):
+		"""
+		:param samples: Frame in ADC codes
+		:return: False if the frame was dropped
+		"""
+		if len(samples) > self.max_length:
+			# e.g. a block transfer capture, a slot can not take it
+			self.dropped += 1
+			telemetry.count("dsp_oversized")
+			return False
+		with self.lock:
+			# Held until the frame is in the pool, close can not free the shared memory under it
+			if self.closed:
+				return False
+			try:
+				slot = self.free_slots.get_nowait()
+			except queue.Empty:
+				self.dropped += 1
+				telemetry.count("dsp_drops")
+				return False
+
+			block_in, block_out = self.blocks[slot]
+			np.ndarray(len(samples), dtype=np.float64, buffer=block_in.buf)[:] = samples
+			sequence = self.next_submit
+			self.next_submit += 1
+			future = self.executor.submit(run_stages, block_in.name, block_out.name, len(samples))
+			future.add_done_callback(lambda f: self.done(sequence, slot, f))
+		return True
+
+	def done(self, sequence, slot, future):
+		with self.lock:
+			if self.closed:
+				return  # Shutting down, the shared memory may be gone
+			try:
+				length = future.result()
+				out = np.ndarray(length, dtype=np.float64, buffer=self.blocks[slot][1].buf).copy()
+			except Exception as e:
+				print("DSP stage failed! {}".format(e))
+				out = None
+			self.free_slots.put(slot)
+
+			self.completed[sequence] = out
+			ready = list()
+			while self.next_deliver in self.completed:
+				ready.append(self.completed.pop(self.next_deliver))
+				self.next_deliver += 1
+			# Ordered stages see frames in submission order, the lock keeps deliveries in order too
+			for out in ready:
+				if out is not None:
+					self.callback(ProcessedSamples(self.ordered(out), self.decimation))
+
+	def close(self):
+		with self.lock:
+			self.closed = True
+		# Not under the lock, the completions of frames still in the pool take it
+		self.executor.shutdown(wait=True)
+		with self.lock:
+			for block_in, block_out in self.blocks:
+				for block in (block_in, block_out):
+					block.close()
+					block.unlink()
@@ -1,22 +1,116 @@
 import numpy as np
 
+STATISTICS = ("min", "max", "pk_pk", "mean", "rms", "std", "ac_rms")
+
+
+def frame_statistics(y):
+	"""
+	All statistics of one frame from a few vectorized reductions
+
+	The variance is taken about the mean, E[x^2] - mean^2 would lose the AC part of a signal with a large DC offset to
+	cancellation.
+
+	:type y: np.ndarray
+	:rtype: dict
+	"""
+	y = np.asarray(y, dtype=np.float64)
+	if len(y) == 0:
+		return dict((name, np.nan) for name in STATISTICS)
+	n = len(y)
+	y_min = y.min()
+	y_max = y.max()
+	mean = y.sum() / n
+	mean_square = np.dot(y, y) / n
+	ac = y - mean
+	variance = np.dot(ac, ac) / n
+	return {
+		"min": y_min,
+		"max": y_max,
+		"pk_pk": y_max - y_min,
+		"mean": mean,
+		"rms": np.sqrt(mean_square),
+		"std": np.sqrt(variance),
+		"ac_rms": np.sqrt(variance)  # RMS with the DC removed is the population standard deviation
+	}
+
+
+def batch_statistics(frames):
+	"""
+	Statistics of a stack of equal length frames
+
+	:param frames: 2D array, one frame per row
+	:type frames: np.ndarray
+	:return: per frame arrays of every statistic, and under "cumulative" the min/max/mean of each over all frames
+	:rtype: dict
+	"""
+	frames = np.asarray(frames, dtype=np.float64)
+	count, n = frames.shape
+	if n == 0:
+		per_frame = dict((name, np.full(count, np.nan)) for name in STATISTICS)
+	else:
+		y_min = frames.min(axis=1)
+		y_max = frames.max(axis=1)
+		mean = frames.sum(axis=1) / n
+		mean_square = np.einsum("ij,ij->i", frames, frames) / n
+		# About the mean like frame_statistics
+		ac = frames - mean[:, None]
+		std = np.sqrt(np.einsum("ij,ij->i", ac, ac) / n)
+		per_frame = {
+			"min": y_min,
+			"max": y_max,
+			"pk_pk": y_max - y_min,
+			"mean": mean,
+			"rms": np.sqrt(mean_square),
+			"std": std,
+			"ac_rms": std
+		}
+	per_frame["cumulative"] = dict(
+		(name, {"min": values.min(), "max": values.max(), "mean": values.mean()} if count else
+			   {"min": np.nan, "max": np.nan, "mean": np.nan})
+		for name, values in list(per_frame.items()))
+	return per_frame
+
+
+class MeasurementEngine(object):
+	"""
+	Computes every statistic of a frame once and serves repeated requests for the same frame from a cache
+
+	The cache is keyed by the identity of the frame array, so a new frame always gets new results.
+	"""
+
+	def __init__(self):
+		self.frame = None
+		self.results = None
+
+	def measure(self, y):
+		if y is not self.frame:
+			self.results = frame_statistics(y)
+			self.frame = y
+		return self.results
+
+
+engine = MeasurementEngine()
+
 
 def meas_pk_pk(samples):
-	x = samples[0]
-	y = samples[1]
-	ret = "{:.2f}V pk-pk".format(max(y) - min(y))
-	print(ret)
-	return ret
+	return "{:.2f}V pk-pk".format(engine.measure(samples[1])["pk_pk"])
+
 
 def meas_rms(samples):
-	x = samples[0]
-	y = samples[1]
-	ret = "{:.2f}V RMS".format(np.sqrt(np.mean(y**2)))
-	print(ret)
-	return ret
+	return "{:.2f}V RMS".format(engine.measure(samples[1])["rms"])
+
 
 def meas_average(samples):
-	x = samples[0]
-	y = samples[1]
-	ret = "{:.2f}V Avg".format(np.mean(y))
-	return ret
+	return "{:.2f}V Avg".format(engine.measure(samples[1])["mean"])
+
+
+def meas_ac_rms(samples):
+	return "{:.2f}V AC RMS".format(engine.measure(samples[1])["ac_rms"])
+
+
+def meas_min(samples):
+	return "{:.2f}V Min".format(engine.measure(samples[1])["min"])
+
+
+def meas_max(samples):
+	return "{:.2f}V Max".format(engine.measure(samples[1])["max"])
@@ -0,0 +1,68 @@
+import numpy as np
+
+
+class PhosphorAccumulator(object):
+	"""
+	Digital phosphor, a 2D time x voltage histogram of every frame
+
+	Frames are binned in raw ADC codes with one bincount, and decay is one multiply of the histogram, so the cost of
+	adding a frame depends on the frame length and the histogram size, never on how many frames were accumulated.
+
+	:param time_bins: Columns across the frame
+	:param voltage_bins: Rows across the int8 ADC code range
+	:param decay: Fraction of the intensity kept per frame, None or 1 for infinite persistence
+	"""
+
+	def __init__(self, time_bins=1000, voltage_bins=256, decay=None):
+		self.time_bins = time_bins
+		self.voltage_bins = voltage_bins
+		self.decay = decay
+		self.histogram = np.zeros((time_bins, voltage_bins), dtype=np.float32)
+		self.frames = 0
+
+		self.column_length = None
+		self.column_offsets = None
+
+	def clear(self):
+		self.histogram[:] = 0
+		self.frames = 0
+
+	def add(self, samples, offset=0):
+		"""
+		:param samples: Raw signed ADC codes of one frame
+		:type samples: np.ndarray
+		:param offset: Samples to shift the frame right by, e.g. to line up trigger points, samples shifted out of the
+			frame are dropped
+		"""
+		length = len(samples)
+		if length == 0:
+			return
+		rows = (samples.astype(np.intp) + 128) * self.voltage_bins // 256
+
+		if offset == 0:
+			if length != self.column_length:
+				# Offset of each sample's time column in the flattened histogram, cached per frame length
+				columns = np.arange(length, dtype=np.intp) * self.time_bins // length
+				self.column_offsets = columns * self.voltage_bins
+				self.column_length = length
+			cells = self.column_offsets + rows
+		else:
+			columns = (np.arange(length, dtype=np.intp) + offset) * self.time_bins // length
+			inside = (columns >= 0) & (columns < self.time_bins)
+			cells = columns[inside] * self.voltage_bins + rows[inside]
+
+		counts = np.bincount(cells, minlength=self.histogram.size)
+
+		if self.decay is not None and self.decay < 1:
+			self.histogram *= self.decay
+		self.histogram += counts.reshape(self.histogram.shape)
+		self.frames += 1
+
+	def image(self):
+		"""
+		Intensity from 0 to 1, log scaled so rare events stay visible next to the steady trace
+		"""
+		peak = self.histogram.max()
+		if peak <= 0:
+			return np.zeros_like(self.histogram)
+		return np.log1p(self.histogram) / np.log1p(peak)
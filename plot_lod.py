@@ -0,0 +1,104 @@
+import numpy as np
+
+
+class MinMaxPyramid(object):
+	"""
+	Multi-resolution min/max pyramid of a waveform for level-of-detail plotting
+
+	Level k holds the min and max of every factor**k samples, so the envelope of any range at any zoom is built from
+	at most a few times as many bins as there are pixels, and narrow peaks survive decimation.
+
+	:param y: Waveform samples
+	:type y: np.ndarray
+	:param factor: Samples merged per bin from one level to the next
+	"""
+
+	def __init__(self, y, factor=4):
+		self.y = y
+		self.factor = factor
+		self.levels = [(y, y)]
+
+		mins = maxs = y
+		while len(mins) > factor:
+			starts = np.arange(0, len(mins), factor)
+			mins = np.minimum.reduceat(mins, starts)
+			maxs = np.maximum.reduceat(maxs, starts)
+			self.levels.append((mins, maxs))
+
+	def __len__(self):
+		return len(self.y)
+
+	def envelope(self, start, stop, pixels):
+		"""
+		Per-pixel min/max envelope of samples start to stop
+
+		:return: sample index and value of each point, two points (min then max) per pixel column
+		:rtype: (np.ndarray, np.ndarray)
+		"""
+		start = max(0, start)
+		stop = min(len(self.y), stop)
+		count = stop - start
+		if count <= 0:
+			return np.empty(0, dtype=np.intp), np.empty(0, dtype=self.y.dtype)
+		if count <= 2 * pixels:
+			return np.arange(start, stop), self.y[start:stop]
+
+		# Coarsest level that still has at least one bin per pixel
+		samples_per_pixel = count / pixels
+		level = min(int(np.log(samples_per_pixel) / np.log(self.factor)), len(self.levels) - 1)
+		bin_size = self.factor ** level
+		mins, maxs = self.levels[level]
+		lo = start // bin_size
+		hi = -(-stop // bin_size)
+
+		edges = np.unique(np.linspace(0, hi - lo, pixels + 1).astype(np.intp)[:-1])
+		column_min = np.minimum.reduceat(mins[lo:hi], edges)
+		column_max = np.maximum.reduceat(maxs[lo:hi], edges)
+
+		index = np.repeat(np.minimum((lo + edges) * bin_size, len(self.y) - 1), 2)
+		values = np.empty(2 * len(edges), dtype=column_min.dtype)
+		values[0::2] = column_min
+		values[1::2] = column_max
+		return index, values
+
+
+class ProgressiveEnvelope(object):
+	"""
+	Min/max envelope of a waveform that arrives in pieces, for drawing a transfer while it lands
+
+	The whole waveform is split into a fixed number of bins, every update folds in only the bins touched since the
+	last one, so drawing a capture as it arrives costs about as much as one pass over it.
+
+	:param length: Samples in the whole waveform
+	:param bins: Envelope resolution, two points per bin
+	"""
+
+	def __init__(self, length, bins=2048):
+		self.length = length
+		self.bin_size = max(1, -(-length // bins))
+		count = -(-length // self.bin_size)
+		self.mins = np.empty(count)
+		self.maxs = np.empty(count)
+		self.done = 0
+
+	def update(self, y):
+		"""
+		:param y: Samples received so far, a prefix of the waveform
+		:return: sample index and value of each point of the received part, min then max per bin
+		:rtype: (np.ndarray, np.ndarray)
+		"""
+		# The last bin may have been partial, fold it in again
+		first = self.done // self.bin_size
+		start = first * self.bin_size
+		if len(y) > start:
+			edges = np.arange(0, len(y) - start, self.bin_size)
+			self.mins[first:first + len(edges)] = np.minimum.reduceat(y[start:], edges)
+			self.maxs[first:first + len(edges)] = np.maximum.reduceat(y[start:], edges)
+		self.done = len(y)
+
+		count = -(-self.done // self.bin_size)
+		index = np.repeat(np.arange(count) * self.bin_size, 2)
+		values = np.empty(2 * count)
+		values[0::2] = self.mins[:count]
+		values[1::2] = self.maxs[:count]
+		return index, values
@@ -1,40 +1,37 @@
-import numpy as np
-import serial
-from ProbeScopeInterface import *
-
+import argparse
+import time
 
-def ProbeScopeMakeSamples(samples):
-	output = bytearray()
-	output.extend([
-		START_OF_MESSAGE,
-		COMMAND_RESULT,
-		REQUEST_SAMPLE_DATA,
-	])
-	output.append(LENGTH_FIELD_INDICATOR)
-	output.extend(ProbeScopeEscapeBytes(struct.pack("<I", len(samples))))
-	output.append(DATA_FIELD_INDICATOR)
-	output.extend(ProbeScopeEscapeBytes(samples))
-	output.append(END_OF_MESSAGE)
+import serial
 
-	return output
+from ProbeScopeEmulator import DeviceEmulator, WAVEFORMS
 
 
 if __name__ == '__main__':
-	port = serial.Serial("COM3")
-	port.timeout = 0
+	arg_parser = argparse.ArgumentParser(description="Emulate a Probe-Scope on a serial port or a pseudo terminal")
+	arg_parser.add_argument("port", nargs="?", default="COM3", help="Serial port to answer on")
+	arg_parser.add_argument("--pty", action="store_true", help="Create a pseudo terminal instead, prints its name")
+	arg_parser.add_argument("--points", type=int, default=1000, help="Samples per frame")
+	arg_parser.add_argument("--waveform", choices=WAVEFORMS, default="sine")
+	arg_parser.add_argument("--rate", type=float, default=0,
+							help="TX cap in bytes per second, 11520 for 115200 baud, 0 for no cap")
+	arg_parser.add_argument("--trigger-interval", type=float, default=0.01,
+							help="Seconds from arming to a triggered push")
+	arg_parser.add_argument("--garbage", type=float, default=0.0, help="Chance of garbage ahead of each response")
+	arg_parser.add_argument("--bit-errors", type=float, default=0.0, help="Chance of a bit error per byte")
+	args = arg_parser.parse_args()
 
-	while True:
-		mess = port.read(4)
-		if len(mess) > 0:
-			mess = [int(i) for i in mess]
-			print(mess)
-		if mess == REQUEST_SAMPLE_DATA_COMMAND:
-			points = 1000
-			type_info = np.iinfo(np.int8)
+	emulator = DeviceEmulator(args.points, args.waveform, bytes_per_second=args.rate or None,
+							  trigger_interval=args.trigger_interval, garbage_rate=args.garbage,
+							  bit_error_rate=args.bit_errors)
+	if args.pty:
+		print("Emulated device on {}".format(emulator.open_pty()), flush=True)
+	else:
+		emulator.open_serial(serial.Serial(args.port))
 
-			arr = np.linspace(-np.pi, np.pi, points)
-			y = np.sin(arr)*123
-			y += np.random.normal(0, 4, points)
-			y = np.clip(y, type_info.min, type_info.max)
-			y = y.astype(np.int8).tobytes()
-			port.write(ProbeScopeMakeSamples(y))
+	try:
+		while True:
+			time.sleep(1)
+	except KeyboardInterrupt:
+		pass
+	emulator.stop()
+	print(emulator.stats())
@@ -0,0 +1,122 @@
+import collections
+
+import numpy as np
+
+
+class SpectrumResult(object):
+	def __init__(self, frequencies, power, dominant_frequency, thd, snr, frames):
+		self.frequencies = frequencies
+		self.power = power
+		self.dominant_frequency = dominant_frequency
+		self.thd = thd
+		self.snr = snr
+		self.frames = frames
+
+	@property
+	def power_db(self):
+		return 10 * np.log10(np.maximum(self.power, 1e-30))
+
+
+class SpectrumAnalyzer(object):
+	"""
+	Power spectrum of frames with np.fft.rfft, averaged over the last N frames
+
+	Window arrays are cached per frame length and frequency axes per length and sample rate, so steady state only pays
+	for the FFT itself.
+
+	:param averages: Number of frames averaged
+	:param harmonics: Highest harmonic included in THD
+	:param lobe_bins: Bins on each side of a peak counted as part of it, the Hann main lobe and near side lobes
+	"""
+
+	def __init__(self, averages=1, harmonics=5, lobe_bins=6):
+		self.harmonics = harmonics
+		self.lobe_bins = lobe_bins
+		self.history = collections.deque(maxlen=averages)
+		self.power_sum = None
+		self.windows = dict()
+		self.frequency_axes = dict()
+
+	@property
+	def averages(self):
+		return self.history.maxlen
+
+	@averages.setter
+	def averages(self, averages):
+		if averages != self.history.maxlen:
+			self.history = collections.deque(maxlen=averages)
+			self.power_sum = None
+
+	def reset(self):
+		self.history.clear()
+		self.power_sum = None
+
+	def window(self, length):
+		window = self.windows.get(length)
+		if window is None:
+			window = np.hanning(length)
+			# Scale so a full scale sine reads its power independent of the window
+			window = window / np.sqrt(np.mean(window ** 2))
+			self.windows[length] = window
+		return window
+
+	def frequencies(self, length, sample_rate):
+		key = (length, sample_rate)
+		frequencies = self.frequency_axes.get(key)
+		if frequencies is None:
+			frequencies = np.fft.rfftfreq(length, 1 / sample_rate)
+			self.frequency_axes[key] = frequencies
+		return frequencies
+
+	def add(self, y, sample_rate):
+		"""
+		:param y: One frame of samples
+		:param sample_rate: Samples per second of the frame, ADC_SAMPLE_RATE / adc_decimation
+		:rtype: SpectrumResult
+		"""
+		length = len(y)
+		spectrum = np.fft.rfft((y - np.mean(y)) * self.window(length))
+		power = (spectrum.real ** 2 + spectrum.imag ** 2) / (length * length)
+		power[1:] *= 2  # One sided
+
+		if self.power_sum is not None and len(self.power_sum) != len(power):
+			self.reset()
+		if len(self.history) == self.history.maxlen:
+			self.power_sum -= self.history[0]
+		self.history.append(power)
+		self.power_sum = power.copy() if self.power_sum is None else self.power_sum + power
+		average = self.power_sum / len(self.history)
+
+		return self.analyze(self.frequencies(length, sample_rate), average)
+
+	def peak_power(self, power, center):
+		lo = max(center - self.lobe_bins, 1)
+		hi = min(center + self.lobe_bins + 1, len(power))
+		return power[lo:hi].sum(), lo, hi
+
+	def analyze(self, frequencies, power):
+		if len(power) < 2 + self.lobe_bins:
+			return SpectrumResult(frequencies, power, np.nan, np.nan, np.nan, len(self.history))
+
+		# Skip DC and the bins it leaks into
+		search_from = self.lobe_bins + 1
+		fundamental = search_from + int(np.argmax(power[search_from:]))
+		fundamental_power, lo, hi = self.peak_power(power, fundamental)
+
+		signal_mask = np.zeros(len(power), dtype=bool)
+		signal_mask[:search_from] = True
+		signal_mask[lo:hi] = True
+
+		harmonic_power = 0.0
+		for n in range(2, self.harmonics + 1):
+			center = fundamental * n
+			if center >= len(power):
+				break
+			h_power, lo, hi = self.peak_power(power, center)
+			harmonic_power += h_power
+			signal_mask[lo:hi] = True
+
+		noise_power = power[~signal_mask].sum()
+		thd = np.sqrt(harmonic_power / fundamental_power) if fundamental_power > 0 else np.nan
+		snr = 10 * np.log10(fundamental_power / noise_power) if noise_power > 0 else np.inf
+		return SpectrumResult(frequencies, power, frequencies[fundamental], thd, snr, len(self.history))
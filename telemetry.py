@@ -0,0 +1,179 @@
+import collections
+import json
+import math
+import threading
+import time
+
+# Points in a frame's life, in order, every interval between two of them gets a histogram
+STAGES = ("request", "first_byte", "complete", "parsed", "measured", "drawn")
+
+
+class Histogram(object):
+	"""
+	Fixed size histogram of durations with logarithmic bins, adding a value is one log and an increment
+
+	:param low: Upper edge of the first bin in seconds, shorter durations land there
+	:param decades: Decades covered above low, longer durations land in the last bin
+	:param bins_per_decade: Resolution, 10 keeps percentiles within about 12%
+	"""
+
+	def __init__(self, low=1e-6, decades=7, bins_per_decade=10):
+		self.low = low
+		self.bins_per_decade = bins_per_decade
+		self.counts = [0] * (decades * bins_per_decade + 1)
+		self.count = 0
+		self.total = 0.0
+		self.max = 0.0
+
+	def add(self, seconds):
+		if seconds > self.low:
+			index = min(int(math.log10(seconds / self.low) * self.bins_per_decade) + 1, len(self.counts) - 1)
+		else:
+			index = 0
+		self.counts[index] += 1
+		self.count += 1
+		self.total += seconds
+		if seconds > self.max:
+			self.max = seconds
+
+	def upper_edge(self, index):
+		return self.low * 10 ** (index / self.bins_per_decade)
+
+	def percentile(self, q):
+		"""
+		:return: upper edge of the bin holding the q-th percentile, nan when empty
+		"""
+		if self.count == 0:
+			return math.nan
+		rank = q / 100 * self.count
+		seen = 0
+		for index, count in enumerate(self.counts):
+			seen += count
+			if seen >= rank and count:
+				return min(self.upper_edge(index), self.max)
+		return self.max
+
+	def summary(self):
+		return {
+			"count": self.count,
+			"mean": self.total / self.count if self.count else math.nan,
+			"p50": self.percentile(50),
+			"p95": self.percentile(95),
+			"p99": self.percentile(99),
+			"max": self.max
+		}
+
+
+class Telemetry(object):
+	"""
+	Counters and per stage latency histograms of the acquisition path
+
+	Frames carry a timeline of perf_counter timestamps, one per STAGES entry reached, and finish_frame turns it into
+	one histogram sample per interval. Request times wait in a FIFO until the frame answering them is parsed, like the
+	responses themselves. Every call returns right away while disabled, hot paths also check enabled before collecting
+	timestamps, so a disabled Telemetry costs an attribute lookup.
+	"""
+
+	def __init__(self, enabled=False, max_pending_requests=64):
+		self.enabled = enabled
+		self.lock = threading.Lock()
+		self.pending_requests = collections.deque(maxlen=max_pending_requests)
+		self.reset()
+
+	def reset(self):
+		with self.lock:
+			self.counters = collections.Counter()
+			self.histograms = dict()
+			self.pending_requests.clear()
+			self.started = time.monotonic()
+
+	def count(self, name, n=1):
+		if not self.enabled:
+			return
+		with self.lock:
+			self.counters[name] += n
+
+	def record(self, name, seconds):
+		if not self.enabled:
+			return
+		with self.lock:
+			histogram = self.histograms.get(name)
+			if histogram is None:
+				histogram = Histogram()
+				self.histograms[name] = histogram
+			histogram.add(seconds)
+
+	def request_sent(self, timestamp=None):
+		if not self.enabled:
+			return
+		self.pending_requests.append(timestamp if timestamp is not None else time.perf_counter())
+
+	def request_lost(self):
+		"""
+		A request timed out, forget its send time so later frames still match their own requests
+		"""
+		self.count("lost_requests")
+		try:
+			self.pending_requests.popleft()
+		except IndexError:
+			pass
+
+	def start_frame(self, first_byte, complete, parsed):
+		"""
+		:return: timeline of a frame just parsed, matched with the oldest request still unanswered
+		:rtype: list
+		"""
+		try:
+			request = self.pending_requests.popleft()
+		except IndexError:
+			request = None  # Pushed or the request was sent before telemetry was enabled
+		if request is not None and first_byte is not None and request > first_byte:
+			request = None
+		return [request, first_byte, complete, parsed, None, None]
+
+	def finish_frame(self, timeline):
+		"""
+		Record every interval of a timeline, stages not reached are skipped
+		"""
+		if not self.enabled or timeline is None:
+			return
+		self.count("frames")
+		previous = None
+		for stage, timestamp in zip(STAGES, timeline):
+			if timestamp is None:
+				continue
+			if previous is not None:
+				self.record("{}->{}".format(previous[0], stage), timestamp - previous[1])
+			previous = (stage, timestamp)
+		if timeline[0] is not None and previous is not None:
+			self.record("request->{}".format(previous[0]), previous[1] - timeline[0])
+
+	def snapshot(self):
+		with self.lock:
+			return {
+				"elapsed": time.monotonic() - self.started,
+				"counters": dict(self.counters),
+				"histograms": dict((name, histogram.summary()) for name, histogram in self.histograms.items())
+			}
+
+	def status(self):
+		"""
+		One line for a status bar
+		"""
+		snapshot = self.snapshot()
+		parts = list()
+		for name in ("request->first_byte", "first_byte->complete", "complete->parsed", "parsed->measured",
+					 "measured->drawn", "request->drawn"):
+			summary = snapshot["histograms"].get(name)
+			if summary is not None:
+				parts.append("{} {:.2f}/{:.2f}ms".format(name, summary["p50"] * 1e3, summary["p95"] * 1e3))
+		parts.extend("{} {}".format(name, value) for name, value in sorted(snapshot["counters"].items()))
+		return ", ".join(parts)
+
+	def export(self, path):
+		with open(path, "w") as f:
+			json.dump(self.snapshot(), f, indent=1, sort_keys=True)
+
+
+# Shared by every stage of the acquisition path
+telemetry = Telemetry()
@@ -0,0 +1,32 @@
+import time
+
+import ProbeScopeDevices
+import ProbeScopeEmulator
+import ProbeScopeInterface
+
+
+def test_single_capture_while_streaming_is_matched_once():
+	emulator = ProbeScopeEmulator.DeviceEmulator(100, bytes_per_second=20000, seed=0)
+	received = list()
+
+	def message_callback(message):
+		if type(message) is ProbeScopeInterface.ProbeScopeSamples:
+			received.append(message)
+
+	manager = ProbeScopeDevices.DeviceManager()
+	try:
+		device = manager.add(emulator.open_loopback(), message_callback)
+		device.open("emulator").result(5)
+		manager.start(in_flight=2)
+		time.sleep(0.2)
+		single = device.transactions.request_samples().result(5)
+		time.sleep(0.2)
+		manager.stop()
+		time.sleep(0.2)  # Let the requests still in flight land
+	finally:
+		manager.close()
+		emulator.stop()
+
+	assert single in received
+	assert device.acquisition.frames == len(received) - 1
+	assert device.acquisition.timeouts == 0
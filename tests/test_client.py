@@ -0,0 +1,49 @@
+import asyncio
+
+import ProbeScopeClient
+import ProbeScopeEmulator
+import ProbeScopeRegisters
+import ProbeScopeTransactions
+
+
+def test_request_right_after_connect():
+	emulator = ProbeScopeEmulator.DeviceEmulator(100, bytes_per_second=None, seed=0)
+	port = emulator.open_pty()
+
+	async def session():
+		client = await ProbeScopeClient.ProbeScopeClient.connect(port)
+		try:
+			return await client.request_samples(ProbeScopeTransactions.RetryPolicy(timeout=5.0))
+		finally:
+			client.close()
+
+	try:
+		frame = asyncio.run(session())
+	finally:
+		emulator.stop()
+	assert len(frame.samples) == 100
+
+
+def test_registers_written_and_read_back():
+	emulator = ProbeScopeEmulator.DeviceEmulator(100, bytes_per_second=None, seed=0)
+	port = emulator.open_pty()
+	register_map = ProbeScopeRegisters.RegisterMap()
+	register_map.set("DAC", bytes(range(8)))
+
+	async def session():
+		client = await ProbeScopeClient.ProbeScopeClient.connect(port)
+		try:
+			writes = await client.sync_registers(register_map)
+			register_map.invalidate()
+			await client.read_back(register_map)
+			return writes
+		finally:
+			client.close()
+
+	try:
+		writes = asyncio.run(session())
+	finally:
+		emulator.stop()
+	assert writes > 0
+	assert register_map.get("DAC") == bytes(range(8))
+	assert register_map.get("VGA") == bytes([0, 1])
@@ -0,0 +1,20 @@
+import ProbeScopeDevices
+import ProbeScopeEmulator
+
+
+def test_read_back_after_another_host_changed_the_dac():
+	emulator = ProbeScopeEmulator.DeviceEmulator(100, bytes_per_second=None, seed=0)
+	manager = ProbeScopeDevices.DeviceManager()
+	try:
+		device = manager.add(emulator.open_loopback())
+		device.register_map.set("DAC", bytes(8))
+		device.open("emulator").result(5)
+		emulator.registers[0x4002:0x400A] = bytes(range(8))
+
+		device.read_registers().result(5)
+	finally:
+		manager.close()
+		emulator.stop()
+	assert device.register_map.get("DAC") == bytes(range(8))
+	# The staged value is written back on the next flush
+	assert device.register_map.dirty_ranges() == [(0x4002, bytes(8))]
@@ -0,0 +1,25 @@
+import threading
+
+import numpy as np
+
+import dsp
+
+
+def test_oversized_and_closed_frames_are_dropped():
+	results = list()
+	done = threading.Event()
+
+	def callback(processed):
+		results.append(processed)
+		done.set()
+
+	pipeline = dsp.ProcessPoolPipeline([dsp.Boxcar(4, decimate=True)], [], callback, workers=1, max_length=1000)
+	try:
+		assert not pipeline.submit(np.zeros(1001))
+		assert pipeline.dropped == 1
+		assert pipeline.submit(np.arange(1000))
+		assert done.wait(30)
+		assert len(results[0].samples) == 250 and results[0].decimation == 4
+	finally:
+		pipeline.close()
+	assert not pipeline.submit(np.zeros(100))
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+QtCore = pytest.importorskip("PySide2.QtCore")
+pytest.importorskip("pyqtgraph")
+
+import ProbeScopeGUI
+import ProbeScopeInterface
+import dsp
+
+
+class PlotRecorder(object):
+	# Stands in for WidgetGallery, only what command_callback draws with
+	def __init__(self):
+		self.plotted = list()
+		self.partial = list()
+
+	def update_plot(self, samples):
+		self.plotted.append(samples)
+
+	def update_partial(self, block):
+		self.partial.append(block)
+
+
+@pytest.fixture(scope="module")
+def app():
+	return QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+
+
+def test_processed_frame_reaches_plot(app):
+	signals = ProbeScopeGUI.SerialSignals()
+	gallery = PlotRecorder()
+	signals.samples_ready.connect(
+		lambda: ProbeScopeGUI.WidgetGallery.command_callback(gallery, signals.take_samples()))
+
+	processed = dsp.ProcessedSamples(np.zeros(100), decimation=4)
+	signals.deliver_samples(processed)
+	app.processEvents()
+
+	assert gallery.plotted == [processed]
+
+
+class DspGallery(object):
+	# Stands in for WidgetGallery, only what serial_message routes frames with
+	def __init__(self, signals, dsp_pipeline):
+		self.devices = [None]
+		self.serial_signals = signals
+		self.dsp_pipeline = dsp_pipeline
+		self.dsp_oversized = False
+
+
+class SubmitRecorder(object):
+	max_length = 1000
+
+	def __init__(self):
+		self.submitted = list()
+
+	def submit(self, samples):
+		self.submitted.append(samples)
+		return True
+
+
+def test_frame_too_long_for_dsp_is_shown_unprocessed(app):
+	signals = ProbeScopeGUI.SerialSignals()
+	received = list()
+	signals.message_received.connect(received.append)
+	signals.samples_ready.connect(lambda: received.append(signals.take_samples()))
+	gallery = DspGallery(signals, SubmitRecorder())
+
+	short = ProbeScopeInterface.ProbeScopeSamples(np.zeros(1000, dtype=np.uint8))
+	long = ProbeScopeInterface.ProbeScopeSamples(np.zeros(1001, dtype=np.uint8))
+	ProbeScopeGUI.WidgetGallery.serial_message(gallery, short)
+	ProbeScopeGUI.WidgetGallery.serial_message(gallery, long)
+	app.processEvents()
+
+	assert len(gallery.dsp_pipeline.submitted) == 1
+	assert received == [long] and gallery.dsp_oversized
@@ -0,0 +1,17 @@
+import numpy as np
+
+import measurements
+
+
+def test_std_keeps_small_ac_on_large_dc():
+	y = 1e8 + 1e-3 * np.sin(np.linspace(0, 20, 1000))
+	assert np.isclose(measurements.frame_statistics(y)["std"], np.std(y))
+	stats = measurements.batch_statistics(np.stack([y, -y]))
+	assert np.allclose(stats["ac_rms"], np.std(y))
+
+
+def test_batch_of_empty_frames():
+	stats = measurements.batch_statistics(np.empty((3, 0)))
+	assert all(np.isnan(stats[name]).all() for name in measurements.STATISTICS)
+	assert len(stats["mean"]) == 3
+	assert np.isnan(measurements.batch_statistics(np.empty((0, 5)))["cumulative"]["mean"]["max"])
@@ -0,0 +1,154 @@
+import random
+
+import numpy as np
+
+import ProbeScopeEmulator
+import ProbeScopeInterface
+
+
+def describe(messages):
+	# Comparable summary of parsed messages, block progress left out since feed reports it once per call
+	described = list()
+	for message in messages:
+		if type(message) is ProbeScopeInterface.ProbeScopeSamples:
+			described.append(("samples", message.samples.tobytes()))
+		elif type(message) is ProbeScopeInterface.ProbeScopeWriteResponse:
+			described.append(("write", message.data_len))
+		elif type(message) is ProbeScopeInterface.ProbeScopeReadResponse:
+			described.append(("read", bytes(message.data)))
+		elif type(message) is ProbeScopeInterface.ProbeScopeTriggered:
+			described.append(("triggered",))
+	return described
+
+
+def read_chars(parser, stream):
+	messages = list()
+	for char in stream:
+		message = parser.read_char(char)
+		if message is not None:
+			messages.append(message)
+	return messages
+
+
+def feed_split(parser, stream, sizes):
+	messages = list()
+	pos = 0
+	while pos < len(stream):
+		size = next(sizes)
+		messages += parser.feed(stream[pos:pos + size])
+		pos += size
+	return messages
+
+
+def random_stream(rng):
+	# Valid messages of every kind with symbol heavy payloads, garbage and cut off messages in between
+	parts = list()
+	for _ in range(rng.randint(1, 6)):
+		data = bytes(rng.choice(ProbeScopeInterface.ESCAPED_CHARS + b"\x55\x00\xFF") if rng.random() < 0.4 else
+					 rng.randrange(256) for _ in range(rng.randint(0, 50)))
+		kind = rng.random()
+		if kind < 0.4:
+			parts.append(bytes(ProbeScopeEmulator.ProbeScopeMakeSamples(data)))
+		elif kind < 0.55:
+			parts.append(bytes(ProbeScopeEmulator.ProbeScopeMakeSampleBlocks(data, rng.randint(1, 10))))
+		elif kind < 0.65:
+			parts.append(bytes(ProbeScopeEmulator.ProbeScopeMakeWriteResponse(rng.randint(0, 300))))
+		elif kind < 0.75:
+			parts.append(bytes(ProbeScopeEmulator.ProbeScopeMakeReadResponse(data)))
+		elif kind < 0.85:
+			parts.append(bytes(rng.randrange(256) for _ in range(rng.randint(1, 5))))
+		else:
+			message = bytes(ProbeScopeEmulator.ProbeScopeMakeSamples(data))
+			parts.append(message[:rng.randint(1, len(message))])
+	return b"".join(parts)
+
+
+def test_feed_matches_read_char_on_random_streams():
+	rng = random.Random(1)
+	for _ in range(500):
+		stream = random_stream(rng)
+		by_char = ProbeScopeInterface.ProbeScopeParser()
+		expected = describe(read_chars(by_char, stream))
+
+		fed = ProbeScopeInterface.ProbeScopeParser()
+		sizes = iter(lambda: rng.randint(1, 20), None)
+		assert describe(feed_split(fed, stream, sizes)) == expected, stream.hex()
+		assert fed.errors == by_char.errors, stream.hex()
+
+
+def test_escape_split_across_feed_calls():
+	samples = bytes([1, ProbeScopeInterface.ESCAPE_CHAR, ProbeScopeInterface.END_OF_MESSAGE, 2,
+					 ProbeScopeInterface.START_OF_MESSAGE, ProbeScopeInterface.END_OF_BLOCK])
+	stream = bytes(ProbeScopeEmulator.ProbeScopeMakeSamples(samples))
+	escapes = [i for i, char in enumerate(stream) if char == ProbeScopeInterface.ESCAPE_CHAR]
+	assert escapes
+	for escape in escapes:
+		parser = ProbeScopeInterface.ProbeScopeParser()
+		# Cut right after the escape byte, the escaped symbol starts the next call
+		messages = parser.feed(stream[:escape + 1]) + parser.feed(stream[escape + 1:])
+		assert describe(messages) == [("samples", samples)]
+		assert not parser.errors
+
+
+def test_resync_and_garbage_counters():
+	frame = bytes(ProbeScopeEmulator.ProbeScopeMakeSamples(bytes(range(20))))
+	# Garbage ahead, then a message whose END_OF_MESSAGE was lost
+	stream = b"\x55\x55\x55" + frame[:10] + frame
+	for messages, parser in (
+			(lambda parser: parser.feed(stream), ProbeScopeInterface.ProbeScopeParser()),
+			(lambda parser: read_chars(parser, stream), ProbeScopeInterface.ProbeScopeParser())):
+		assert describe(messages(parser)) == [("samples", bytes(range(20)))]
+		assert parser.errors == {ProbeScopeInterface.ERROR_GARBAGE: 3, ProbeScopeInterface.ERROR_RESYNC: 1}
+
+
+def test_overflow_is_dropped_and_parsing_goes_on():
+	frame = bytes(ProbeScopeEmulator.ProbeScopeMakeSamples(bytes(range(8))))
+	runaway = bytes([ProbeScopeInterface.START_OF_MESSAGE]) + bytes(100)
+
+	parser = ProbeScopeInterface.ProbeScopeParser(max_message=32)
+	messages = parser.feed(runaway)
+	messages += parser.feed(frame)
+	assert describe(messages) == [("samples", bytes(range(8)))]
+	assert parser.errors[ProbeScopeInterface.ERROR_OVERFLOW] == 1
+	assert parser.feed_buff == bytearray()
+
+	parser = ProbeScopeInterface.ProbeScopeParser(max_message=32)
+	assert describe(read_chars(parser, runaway + frame)) == [("samples", bytes(range(8)))]
+	assert parser.errors[ProbeScopeInterface.ERROR_OVERFLOW] == 1
+
+
+def test_block_progress_and_completion():
+	samples = bytes(range(35))
+	stream = bytes(ProbeScopeEmulator.ProbeScopeMakeSampleBlocks(samples, block_size=10))
+
+	for decode in (lambda parser, char: parser.feed(bytes([char])),
+				   lambda parser, char: [message for message in [parser.read_char(char)] if message is not None]):
+		parser = ProbeScopeInterface.ProbeScopeParser()
+		progress = list()
+		blocks = set()
+		messages = list()
+		for char in stream:
+			for message in decode(parser, char):
+				if type(message) is ProbeScopeInterface.ProbeScopeSampleBlock:
+					# The same block is handed out after every chunk
+					progress.append(message.received)
+					blocks.add(message)
+					assert len(message) == 35
+					assert message.samples.tobytes() == samples[:message.received]
+				else:
+					messages.append(message)
+		assert progress == [10, 20, 30] and len(blocks) == 1
+		assert describe(messages) == [("samples", samples)]
+		# The capture was decoded in place, the final frame is the block's buffer
+		assert np.shares_memory(messages[0].samples, blocks.pop().buffer)
+
+
+def test_block_longer_than_declared_is_dropped():
+	stream = bytearray(ProbeScopeEmulator.ProbeScopeMakeSampleBlocks(bytes(range(20)), block_size=10))
+	stream[4] = 15  # Length field says 15 samples, 20 follow
+	frame = bytes(ProbeScopeEmulator.ProbeScopeMakeSamples(bytes(4)))
+
+	parser = ProbeScopeInterface.ProbeScopeParser()
+	messages = parser.feed(bytes(stream) + frame)
+	assert describe(messages) == [("samples", bytes(4))]
+	assert parser.errors[ProbeScopeInterface.ERROR_LENGTH] == 1
@@ -0,0 +1,23 @@
+import types
+
+import ProbeScopePorts
+
+
+def list_port(device, vid=None, pid=None, manufacturer=None):
+	return types.SimpleNamespace(device=device, description="n/a", manufacturer=manufacturer, vid=vid, pid=pid,
+								 serial_number=None)
+
+
+def test_usb_ids_first_manufacturer_as_fallback():
+	ports = [
+		list_port("/dev/ttyACM0", 0x1209, 0x0001, "Probe-Scope"),
+		list_port("/dev/ttyACM1", 0x2341, 0x0043, "Arduino"),
+		list_port("COM3", 0x1234, 0x5678, "Microsoft"),
+		list_port("/dev/ttyS0")
+	]
+	scanner = ProbeScopePorts.PortScanner(usb_ids={(0x1209, 0x0001)}, list_ports=lambda: ports)
+	added, removed = scanner.scan()
+
+	assert len(added) == 4 and not removed
+	assert [port.device for port in scanner.probe_scopes()] == ["/dev/ttyACM0", "COM3"]
+	assert scanner.ports()[0].label == "Probe-Scope (/dev/ttyACM0)"
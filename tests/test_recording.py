@@ -0,0 +1,49 @@
+import struct
+
+import ProbeScopeDevices
+import ProbeScopeEmulator
+import ProbeScopeInterface
+import ProbeScopeRecording
+
+
+def test_frames_carry_the_register_state_they_were_captured_with(tmp_path):
+	emulator = ProbeScopeEmulator.DeviceEmulator(100, bytes_per_second=None, seed=0)
+	manager = ProbeScopeDevices.DeviceManager()
+	path = str(tmp_path / "capture.psrec")
+	try:
+		device = manager.add(emulator.open_loopback())
+		device.open("emulator").result(5)
+		manager.record([path], registers=b"preset")
+		device.transactions.request_samples().result(5)
+		device.register_map.set("DAC", struct.pack("<HHHH", 1, 2, 3, 4))
+		device.write_registers().result(5)
+		device.transactions.request_samples().result(5)
+	finally:
+		manager.close()
+		emulator.stop()
+
+	with ProbeScopeRecording.RecordingReader(path) as reader:
+		before, after = reader[0].registers, reader[1].registers
+	assert before != after
+	assert after.endswith(b"preset")
+	assert after[:-len(b"preset")] == device.register_map.snapshot()
+
+
+def test_close_unmaps_unless_frames_still_view_the_mapping(tmp_path):
+	path = str(tmp_path / "frames.psrec")
+	writer = ProbeScopeRecording.FrameWriter(path)
+	writer.start()
+	for timestamp in range(2):
+		writer.put(float(timestamp), ProbeScopeInterface.ProbeScopeSamples(bytes(range(10))))
+	writer.stop()
+
+	reader = ProbeScopeRecording.RecordingReader(path)
+	mapping = reader.map
+	reader.close()
+	assert mapping.closed and reader.file.closed
+
+	reader = ProbeScopeRecording.RecordingReader(path)
+	frame = reader[1]
+	reader.close()
+	assert reader.file.closed
+	assert frame.samples.tobytes() == bytes(range(10))
@@ -0,0 +1,28 @@
+import ProbeScopeInterface
+import ProbeScopeRegisters
+
+DAC_INIT_WRITE = ProbeScopeInterface.ProbeScopeRegisterWrite(0x4000, b"\xAA")
+
+
+def test_read_back_only_reads_registers():
+	register_map = ProbeScopeRegisters.RegisterMap()
+	# DAC_INIT is an action, 0x4001 between it and DAC is not a register
+	assert register_map.read_ranges() == [(0x3000, 2), (0x4002, 8)]
+
+	register_map.update(0x4000, bytes(range(10)))
+	assert 0x4000 not in register_map.shadow and 0x4001 not in register_map.shadow
+	assert register_map.get("DAC") == bytes(range(2, 10))
+
+
+def test_action_is_written_once_per_set():
+	register_map = ProbeScopeRegisters.RegisterMap()
+	assert DAC_INIT_WRITE in register_map.flush()
+	assert 0x4000 not in register_map.shadow
+
+	# A read back of everything does not make DAC_INIT dirty again
+	register_map.update(0x3000, b"\x00\x00")
+	assert register_map.flush() == [ProbeScopeInterface.ProbeScopeRegisterWrite(0x3001, b"\x01")]
+
+	# A reconnect initializes the DAC again
+	register_map.invalidate()
+	assert DAC_INIT_WRITE in register_map.flush()
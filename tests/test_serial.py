@@ -0,0 +1,46 @@
+import pytest
+
+import ProbeScopeDevices
+import ProbeScopeEmulator
+import ProbeScopeInterface
+import ProbeScopeSerial
+
+
+@pytest.fixture
+def emulator():
+	emulator = ProbeScopeEmulator.DeviceEmulator(100, bytes_per_second=None, seed=0)
+	yield emulator
+	emulator.stop()
+
+
+def test_callback_error_keeps_worker_and_fails_future(emulator):
+	failures = [RuntimeError("consumer broke")]
+
+	def message_callback(message):
+		if failures:
+			raise failures.pop()
+
+	manager = ProbeScopeDevices.DeviceManager()
+	try:
+		device = manager.add(emulator.open_loopback(), message_callback)
+		device.serial_io.open("emulator").result(5)
+		with pytest.raises(RuntimeError):
+			device.transactions.request_samples().result(5)
+		assert len(device.transactions.request_samples().result(5).samples) == 100
+		assert device.serial_io.is_alive()
+		assert device.serial_io.stats()["callback_errors"] == 1
+	finally:
+		manager.close()
+
+
+def test_reopen_keeps_parser_limits(emulator):
+	parser = ProbeScopeInterface.ProbeScopeParser(max_message=1 << 16, max_capture=1 << 20)
+	worker = ProbeScopeSerial.SerialWorker(emulator.open_loopback(), lambda message: None, parser)
+	worker.start()
+	try:
+		worker.open("emulator").result(5)
+		worker.open("emulator").result(5)
+	finally:
+		worker.stop()
+	assert worker.parser is parser
+	assert (parser.max_message, parser.max_capture) == (1 << 16, 1 << 20)
@@ -0,0 +1,52 @@
+import time
+
+import pytest
+
+import ProbeScopeInterface
+import ProbeScopeTransactions
+
+
+class SentCommands(object):
+	def __init__(self):
+		self.commands = list()
+
+	def send(self, command):
+		self.commands.append(bytes(command))
+
+
+def test_late_response_does_not_complete_the_next_request():
+	transactions = ProbeScopeTransactions.TransactionManager(SentCommands())
+	transactions.start()
+	try:
+		late = transactions.read_registers(0x3000, 2, ProbeScopeTransactions.RetryPolicy(timeout=0.05))
+		with pytest.raises(ProbeScopeTransactions.TransactionTimeout):
+			late.result(1)
+		waiting = transactions.read_registers(0x3000, 2, ProbeScopeTransactions.RetryPolicy(timeout=5))
+
+		transactions.on_message(ProbeScopeInterface.ProbeScopeReadResponse(b"\x01\x02"))
+		assert not waiting.done()
+		transactions.on_message(ProbeScopeInterface.ProbeScopeReadResponse(b"\x03\x04"))
+		assert waiting.result(0).data == b"\x03\x04"
+		assert transactions.stats()["late"] == 1
+	finally:
+		transactions.stop()
+
+
+def test_response_to_a_retry_is_not_taken_by_the_next_request():
+	sent = SentCommands()
+	transactions = ProbeScopeTransactions.TransactionManager(sent)
+	transactions.start()
+	try:
+		retried = transactions.write_registers(0x4002, b"\x00\x01", ProbeScopeTransactions.RetryPolicy(0.05, retries=1))
+		while len(sent.commands) < 2:
+			time.sleep(0.01)
+		transactions.on_message(ProbeScopeInterface.ProbeScopeWriteResponse(2))
+		assert retried.result(0).data_len == 2
+		waiting = transactions.write_registers(0x4002, b"\x00\x02", ProbeScopeTransactions.RetryPolicy(timeout=5))
+
+		transactions.on_message(ProbeScopeInterface.ProbeScopeWriteResponse(2))  # Answers the retry
+		assert not waiting.done()
+		transactions.on_message(ProbeScopeInterface.ProbeScopeWriteResponse(2))
+		assert waiting.result(0).data_len == 2
+	finally:
+		transactions.stop()
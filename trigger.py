@@ -0,0 +1,99 @@
+import numpy as np
+
+TRIGGER_MODES = ("rising", "falling", "pulse_width", "runt")
+
+
+def hysteresis_state(y, low, high):
+	"""
+	Comparator with hysteresis, +1 once y reaches high, -1 once it drops below low, holding between the two
+
+	Samples before the first decision are 0.
+	"""
+	state = np.zeros(len(y), dtype=np.int8)
+	state[y >= high] = 1
+	state[y < low] = -1
+	decided = np.where(state != 0, np.arange(len(y)), 0)
+	np.maximum.accumulate(decided, out=decided)
+	held = state[decided]
+	held[:np.argmax(state != 0)] = 0
+	return held
+
+
+def rising_edges(y, level, hysteresis=0.0):
+	held = hysteresis_state(y, level - hysteresis, level)
+	return np.flatnonzero((held[1:] == 1) & (held[:-1] == -1)) + 1
+
+
+def falling_edges(y, level, hysteresis=0.0):
+	held = hysteresis_state(y, level, level + hysteresis)
+	return np.flatnonzero((held[1:] == -1) & (held[:-1] == 1)) + 1
+
+
+class SoftwareTrigger(object):
+	"""
+	Finds the trigger point of a frame with vectorized comparisons, no Python loop over samples
+
+	Modes:
+		rising / falling: edge through level, rearmed only after crossing back past level -/+ hysteresis
+		pulse_width: positive pulse whose width in samples is within min_width and max_width, triggers on its end
+		runt: positive pulse that rises above level but falls back before reaching runt_high, triggers on its end
+	"""
+
+	def __init__(self, mode="rising", level=0.0, hysteresis=0.0, min_width=0, max_width=None, runt_high=None):
+		if mode not in TRIGGER_MODES:
+			raise ValueError("Trigger mode must be one of {}!".format(TRIGGER_MODES))
+		if mode == "runt" and runt_high is None:
+			raise ValueError("Runt trigger needs runt_high!")
+		if mode == "runt" and runt_high <= level:
+			raise ValueError("Runt trigger needs runt_high above level!")
+		self.mode = mode
+		self.level = level
+		self.hysteresis = hysteresis
+		self.min_width = min_width
+		self.max_width = max_width
+		self.runt_high = runt_high
+
+		self.triggered = 0
+		self.discarded = 0
+
+	def pulses(self, y):
+		# Rising edge to the next falling edge, both through level with hysteresis
+		held = hysteresis_state(y, self.level - self.hysteresis, self.level)
+		starts = np.flatnonzero((held[1:] == 1) & (held[:-1] == -1)) + 1
+		ends = np.flatnonzero((held[1:] == -1) & (held[:-1] == 1)) + 1
+		if len(starts) == 0 or len(ends) == 0:
+			return starts[:0], ends[:0]
+		next_end = np.searchsorted(ends, starts)
+		complete = next_end < len(ends)
+		return starts[complete], ends[next_end[complete]]
+
+	def find(self, y):
+		"""
+		:return: index of the trigger point, or None when the frame does not trigger
+		"""
+		if self.mode == "rising":
+			candidates = rising_edges(y, self.level, self.hysteresis)
+		elif self.mode == "falling":
+			candidates = falling_edges(y, self.level, self.hysteresis)
+		else:
+			starts, ends = self.pulses(y)
+			if self.mode == "pulse_width":
+				widths = ends - starts
+				qualified = widths >= self.min_width
+				if self.max_width is not None:
+					qualified &= widths <= self.max_width
+			else:
+				if len(starts) == 0:
+					qualified = np.zeros(0, dtype=bool)
+				else:
+					# Peak of every pulse in one pass, reduceat over the start/end boundaries
+					bounds = np.column_stack((starts, ends)).ravel()
+					peaks = np.maximum.reduceat(y, bounds)[0::2]
+					qualified = peaks < self.runt_high
+			candidates = ends[qualified]
+
+		if len(candidates) == 0:
+			self.discarded += 1
+			return None
+		self.triggered += 1
+		return int(candidates[0])